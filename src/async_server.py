@@ -0,0 +1,241 @@
+"""
+asyncio serving mode (python3 src/serve.py --mode async), for clients that
+wait for new messages instead of polling channel_messages every couple of
+seconds. A waiting client costs a coroutine and an idle socket, not a
+thread, so thousands of open tabs are cheap.
+
+    GET /channel/messages/poll      token, channel_id, after_message_id and
+                                    optionally timeout (seconds). Answers as
+                                    soon as the channel has messages newer
+                                    than after_message_id, like
+                                    channel_messages_after, or with no
+                                    messages once timeout runs out.
+    GET /channel/messages/stream    token, channel_id, after_message_id.
+                                    Server-sent events: each new message is
+                                    sent as an event with the message as
+                                    JSON data and its id as the event id, so
+                                    a reconnecting EventSource carries on
+                                    where it left off (Last-Event-ID).
+
+Every other request is handed to the Flask APP on a pool of threads, so this
+serves the whole API. Only new messages are pushed, edits and removals
+still need a channel_messages call. Waiters are woken up by message_send in
+this process (see channel_watch.py), so this mode runs as one process.
+"""
+import io
+import sys
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl, unquote
+from server import APP
+from channel import channel_messages_after
+from channel_watch import channel_watch, channel_unwatch
+from fast_json import json_dumps
+from http_params import token_param, int_param, channel_id_param
+from error import InputError, AccessError
+
+POLL_TIMEOUT = 30
+MAX_POLL_TIMEOUT = 60
+# how often an idle stream sends a comment, so proxies don't close it
+HEARTBEAT_INTERVAL = 15
+MAX_HEADER_SIZE = 64 * 1024
+FLASK_THREADS = 8
+
+REASONS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+class Request:
+    def __init__(self, method, target, headers, body):
+        self.method = method
+        url = urlsplit(target)
+        self.path = unquote(url.path)
+        self.query_string = url.query
+        self.args = dict(parse_qsl(url.query))
+        # lower case names
+        self.headers = headers
+        self.body = body
+
+    def keep_alive(self):
+        return self.headers.get('connection', '').lower() != 'close'
+
+async def start_async_server(host, port):
+    """ Starts serving on the running loop, returns the asyncio server """
+    flask_threads = ThreadPoolExecutor(max_workers=FLASK_THREADS, thread_name_prefix='flask')
+    return await asyncio.start_server(
+        lambda reader, writer: handle_connection(reader, writer, flask_threads),
+        host, port, limit=MAX_HEADER_SIZE,
+    )
+
+def serve_async(host, port, announce):
+    async def run():
+        server = await start_async_server(host, port)
+        announce(host, server.sockets[0].getsockname()[1])
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+async def handle_connection(reader, writer, flask_threads):
+    try:
+        while True:
+            request = await read_request(reader)
+            if request is None:
+                break
+            if request.method == 'GET' and request.path == '/channel/messages/poll':
+                await poll(request, writer)
+            elif request.method == 'GET' and request.path == '/channel/messages/stream':
+                # the stream only ends when the client goes away
+                await stream(request, writer)
+                break
+            else:
+                await call_flask(request, writer, flask_threads)
+            if not request.keep_alive():
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+        pass
+    except (InputError, AccessError):
+        # the stream's channel was removed, or its user logged out
+        pass
+    finally:
+        writer.close()
+
+async def read_request(reader):
+    """ None once the client closes the connection """
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError:
+        return None
+    request_line, *header_lines = head.decode('latin-1').split('\r\n')[:-2]
+    method, target, _ = request_line.split(' ', 2)
+    headers = {}
+    for line in header_lines:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return Request(method, target, headers, body)
+
+def write_response(writer, status, headers, body):
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+    lines += [f"{name}: {value}" for name, value in headers]
+    lines.append(f"Content-Length: {len(body)}")
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+
+def write_json(writer, status, value):
+    write_response(writer, status, [('Content-Type', 'application/json')], json_dumps(value))
+
+def write_error(writer, error):
+    # the same body as server.defaultHandler's
+    write_json(writer, error.code, {
+        "code": error.code,
+        "name": "System Error",
+        "message": error.get_description(),
+    })
+
+async def next_messages(request, after_message_id, timeout):
+    """
+    Waits up to timeout seconds for messages newer than after_message_id,
+    returns them (maybe none)
+    """
+    loop = asyncio.get_running_loop()
+    token = token_param(request.args)
+    channel_id = channel_id_param(request.args)
+    woken = asyncio.Event()
+
+    def wake_up():
+        loop.call_soon_threadsafe(woken.set)
+
+    # watch before looking, so a message sent in between isn't missed
+    channel_watch(channel_id, wake_up)
+    try:
+        deadline = loop.time() + timeout
+        while True:
+            woken.clear()
+            messages = (await asyncio.to_thread(channel_messages_after, token, channel_id, after_message_id))['messages']
+            remaining = deadline - loop.time()
+            if messages or remaining <= 0:
+                return messages
+            try:
+                await asyncio.wait_for(woken.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        channel_unwatch(channel_id, wake_up)
+
+async def poll(request, writer):
+    try:
+        timeout = min(max(int_param(request.args, 'timeout', POLL_TIMEOUT), 0), MAX_POLL_TIMEOUT)
+        messages = await next_messages(request, int_param(request.args, 'after_message_id', 0), timeout)
+    except (InputError, AccessError) as error:
+        write_error(writer, error)
+    else:
+        write_json(writer, 200, {'messages': messages})
+    await writer.drain()
+
+async def stream(request, writer):
+    # a reconnecting EventSource tells us the last message it got
+    args = {'after_message_id': request.headers.get('last-event-id', request.args.get('after_message_id', 0))}
+    try:
+        after_message_id = int_param(args, 'after_message_id')
+        # checks the other parameters before the stream starts
+        messages = await next_messages(request, after_message_id, 0)
+    except (InputError, AccessError) as error:
+        write_error(writer, error)
+        await writer.drain()
+        return
+
+    # no length, the stream ends when the connection does
+    writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n')
+    while True:
+        if messages:
+            for message in messages:
+                writer.write(b'id: %d\ndata: %s\n\n' % (message['message_id'], json_dumps(message)))
+            after_message_id = messages[-1]['message_id']
+        else:
+            writer.write(b': keep-alive\n\n')
+        await writer.drain()
+        messages = await next_messages(request, after_message_id, HEARTBEAT_INTERVAL)
+
+async def call_flask(request, writer, flask_threads):
+    status, headers, body = await asyncio.get_running_loop().run_in_executor(flask_threads, call_wsgi, request, writer)
+    write_response(writer, status, headers, body)
+    await writer.drain()
+
+def call_wsgi(request, writer):
+    host, port = writer.get_extra_info('sockname')[:2]
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': request.path,
+        'QUERY_STRING': request.query_string,
+        'SERVER_NAME': host,
+        'SERVER_PORT': str(port),
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'CONTENT_TYPE': request.headers.get('content-type', ''),
+        'CONTENT_LENGTH': str(len(request.body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(request.body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in request.headers.items():
+        if name not in ('content-type', 'content-length'):
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+
+    response = {}
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        # we set the length ourselves
+        response['headers'] = [(name, value) for name, value in headers if name.lower() != 'content-length']
+
+    result = APP(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], body
@@ -0,0 +1,144 @@
+import time
+import asyncio
+import threading
+import pytest
+import requests
+from async_server import start_async_server
+from auth import auth_register, auth_logout
+from channels import channels_create
+from channel import channel_messages_after
+from message import message_send, message_remove
+from database import clear_database
+from error import InputError, AccessError
+
+@pytest.fixture
+def url():
+    clear_database()
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(start_async_server('127.0.0.1', 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}/"
+
+    async def shutdown():
+        server.close()
+        for task in asyncio.all_tasks():
+            if task is not asyncio.current_task():
+                task.cancel()
+
+    asyncio.run_coroutine_threadsafe(shutdown(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+    clear_database()
+
+def send_later(delay, token, channel_id, message):
+    timer = threading.Timer(delay, message_send, (token, channel_id, message))
+    timer.start()
+    return timer
+
+def setup_channel():
+    user = auth_register("email@a.com", "averylongpassword", "A", "LastA")
+    channel_id = channels_create(user['token'], 'channel', is_public=True)['channel_id']
+    return user, channel_id
+
+def test_channel_messages_after():
+    clear_database()
+    user, channel_id = setup_channel()
+    assert channel_messages_after(user['token'], channel_id) == {'messages': []}
+    message_ids = [message_send(user['token'], channel_id, str(i))['message_id'] for i in range(120)]
+
+    first = channel_messages_after(user['token'], channel_id)['messages']
+    assert [message['message_id'] for message in first] == message_ids[:50]
+    rest = channel_messages_after(user['token'], channel_id, message_ids[99])['messages']
+    assert [message['message_id'] for message in rest] == message_ids[100:]
+    assert channel_messages_after(user['token'], channel_id, message_ids[-1])['messages'] == []
+
+    message_remove(user['token'], message_ids[101])
+    rest = channel_messages_after(user['token'], channel_id, message_ids[99])['messages']
+    assert len(rest) == 19
+    # the client's last message was removed, it carries on from where it was
+    rest = channel_messages_after(user['token'], channel_id, message_ids[101])['messages']
+    assert [message['message_id'] for message in rest] == message_ids[102:]
+    with pytest.raises(InputError):
+        channel_messages_after(user['token'], channel_id, message_ids[-1] + 1)
+
+    other = auth_register("email@b.com", "averylongpassword", "B", "LastB")
+    with pytest.raises(AccessError):
+        channel_messages_after(other['token'], channel_id)
+
+def test_async_long_poll_wakes_up(url):
+    user, channel_id = setup_channel()
+    first = message_send(user['token'], channel_id, 'first')['message_id']
+    query = {'token': user['token'], 'channel_id': channel_id, 'after_message_id': first, 'timeout': 10}
+
+    send_later(0.2, user['token'], channel_id, 'second')
+    start = time.monotonic()
+    response = requests.get(url + 'channel/messages/poll', params=query)
+    assert time.monotonic() - start < 5
+    assert [message['message'] for message in response.json()['messages']] == ['second']
+
+def test_async_long_poll_after_removed_message(url):
+    user, channel_id = setup_channel()
+    first = message_send(user['token'], channel_id, 'first')['message_id']
+    message_remove(user['token'], first)
+    query = {'token': user['token'], 'channel_id': channel_id, 'after_message_id': first, 'timeout': 10}
+
+    send_later(0.2, user['token'], channel_id, 'second')
+    response = requests.get(url + 'channel/messages/poll', params=query)
+    assert response.status_code == 200
+    assert [message['message'] for message in response.json()['messages']] == ['second']
+
+def test_async_long_poll_times_out(url):
+    user, channel_id = setup_channel()
+    query = {'token': user['token'], 'channel_id': channel_id, 'after_message_id': 0, 'timeout': 0}
+    assert requests.get(url + 'channel/messages/poll', params=query).json() == {'messages': []}
+
+def test_async_long_poll_errors(url):
+    user, channel_id = setup_channel()
+    response = requests.get(url + 'channel/messages/poll', params={'token': user['token'], 'channel_id': channel_id + 1})
+    assert response.status_code == 400
+    auth_logout(user['token'])
+    response = requests.get(url + 'channel/messages/poll', params={'token': user['token'], 'channel_id': channel_id})
+    assert response.status_code == 400
+
+def test_async_stream(url):
+    user, channel_id = setup_channel()
+    message_send(user['token'], channel_id, 'before')
+    query = {'token': user['token'], 'channel_id': channel_id}
+    with requests.get(url + 'channel/messages/stream', params=query, stream=True, timeout=10) as response:
+        assert response.headers['Content-Type'] == 'text/event-stream'
+        send_later(0.2, user['token'], channel_id, 'after')
+        lines = response.iter_lines(chunk_size=1)
+        events = []
+        while len(events) < 2:
+            line = next(lines)
+            if line.startswith(b'data: '):
+                events.append(line)
+    assert b'"before"' in events[0]
+    assert b'"after"' in events[1]
+
+def test_async_stream_resumes_after_removed_message(url):
+    user, channel_id = setup_channel()
+    last_event = message_send(user['token'], channel_id, 'seen')['message_id']
+    message_send(user['token'], channel_id, 'missed')
+    message_remove(user['token'], last_event)
+    query = {'token': user['token'], 'channel_id': channel_id}
+    headers = {'Last-Event-ID': str(last_event)}
+    with requests.get(url + 'channel/messages/stream', params=query, headers=headers, stream=True, timeout=10) as response:
+        assert response.status_code == 200
+        for line in response.iter_lines(chunk_size=1):
+            if line.startswith(b'data: '):
+                break
+    assert b'"missed"' in line
+
+def test_async_serves_the_rest_of_the_api(url):
+    response = requests.post(url + 'auth/register', json={
+        'email': 'email@a.com', 'password': 'averylongpassword', 'name_first': 'A', 'name_last': 'LastA',
+    })
+    token = response.json()['token']
+    session = requests.Session()
+    # several requests on one kept alive connection
+    for _ in range(3):
+        assert session.get(url + 'channels/list', params={'token': token}).json() == {'channels': []}
+    assert session.get(url + 'nowhere').status_code == 404
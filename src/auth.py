@@ -1,103 +1,198 @@
-import re
-from database import database
+from database import add_user, add_users, get_user, get_user_by_email, update_user, allocate_id, allocate_ids, normalise_email
+from password import password_hash, password_hash_many, password_verify, password_needs_rehash
+from validation import validate_email, validate_registration, validate_registrations
+from tokens import token_generate, token_decode
+from session import session_create, session_revoke, session_get_user_token, session_generation, \
+    session_new_generation
+from locks import locked, email_key, user_key
 from error import InputError, AccessError
 
 def auth_login(email, password):
     check_email(email)
 
-    for user in database['users']:
-        if user['email'] == email:
-            if user['password'] == password:
-                u_id = user['id']
-                # Check if the user has been logged in, if so, return the same active token
-                active_token = next((exist_token for exist_token in database['active_tokens'] \
-                    if auth_get_current_user_id_from_token(exist_token) == u_id), None)
+    user = get_user_by_email(email)
+    if user is None:
+        raise InputError("User doesn't exist.")
 
-                # If the user is not logged in, append a new token
-                if active_token == None:
-                    token = u_id
-                    database['active_tokens'].append(token)
-                    active_token = token
+    if not password_verify(password, user['password']):
+        raise InputError("Wrong password.")
 
-                return {
-                    'u_id': u_id,
-                    'token': active_token,
-                }
+    u_id = user['id']
+    if password_needs_rehash(user['password']):
+        update_user(u_id, {'password': password_hash(password)})
 
-            raise InputError("Wrong password.")
-    raise InputError("User doesn't exist.")
+    with locked(user_key(u_id)):
+        # Check if the user has been logged in, if so, return the same active token
+        generation = session_generation(u_id)
+        active_token = session_get_user_token(u_id)
+
+        # If the user is not logged in, start a new session
+        if active_token == None or token_generation(active_token) != generation:
+            if generation is None:
+                # registered in bulk, never logged in
+                generation = session_new_generation(u_id)
+            active_token = token_generate(u_id, generation)
+            session_create(active_token, u_id)
+
+    return {
+        'u_id': u_id,
+        'token': active_token,
+    }
 
 def auth_logout(token):
-    if token in database['active_tokens']:
-        database['active_tokens'].remove(token)
-        is_success = True
-    else:
-        is_success = False
+    try:
+        claims = token_decode(token)
+    except AccessError:
+        return {
+            'is_success': False,
+        }
+
+    u_id = claims['u_id']
+    with locked(user_key(u_id)):
+        if not is_current_generation(claims):
+            # already logged out
+            return {
+                'is_success': False,
+            }
+        session_new_generation(u_id)
+        session_revoke(token)
 
     return {
-        'is_success': is_success,
+        'is_success': True,
     }
 
 def auth_register(email, password, name_first, name_last):
     input_error_checking(email, password, name_first, name_last)
 
-    for user in database['users']:
-        if user['email'] == email:
+    if get_user_by_email(email) is not None:
+        raise InputError("Email has been used.")
+
+    hashed_password = password_hash(password)
+    with locked(email_key(normalise_email(email))):
+        # again, someone else may have taken it while we were hashing
+        if get_user_by_email(email) is not None:
             raise InputError("Email has been used.")
 
-    # finds the highest user id
-    u_id = max(database['users'], key=lambda user: user['id'], default={'id': 0})['id'] + 1
-    new_user = {
-        'email': email,
-        'password': password,
-        'first_name': name_first,
-        'last_name': name_last,
-        'id': u_id
-    }
-    token = u_id
+        u_id = allocate_id('users')
+        new_user = {
+            'email': email,
+            'password': hashed_password,
+            'first_name': name_first,
+            'last_name': name_last,
+            'id': u_id
+        }
+        add_user(new_user)
 
-    database['users'].append(new_user)
-    database['active_tokens'].append(token)
+    token = token_generate(u_id, session_new_generation(u_id))
+    session_create(token, u_id)
 
     return {
         'u_id': u_id,
         'token': token,
     }
 
+def auth_register_bulk(token, users):
+    """
+    Registers a whole batch of users at once, for example every student in a
+    course. users is a list of dicts with the same keys as auth_register's
+    parameters (email, password, name_first, name_last).
+
+    The batch is atomic: if any row is invalid, nobody is registered and
+    every invalid row is reported in 'errors' as {'row': index, 'message'}.
+    The new users aren't logged in.
+    """
+    auth_get_current_user_id_from_token(token)
+
+    errors = validate_registrations(users)
+    invalid_rows = {error['row'] for error in errors}
+    errors += used_email_errors(users, invalid_rows)
+    errors.sort(key=lambda error: error['row'])
+
+    if errors:
+        return {
+            'u_ids': [],
+            'errors': errors,
+        }
+
+    hashes = password_hash_many([user['password'] for user in users])
+    emails = {normalise_email(user['email']) for user in users}
+    with locked(*map(email_key, emails)):
+        # again, someone else may have taken one while we were hashing
+        errors = used_email_errors(users, set())
+        if errors:
+            return {
+                'u_ids': [],
+                'errors': errors,
+            }
+
+        u_ids = allocate_ids('users', len(users))
+        try:
+            add_users([{
+                'email': user['email'],
+                'password': hashed_password,
+                'first_name': user['name_first'],
+                'last_name': user['name_last'],
+                'id': u_id
+            } for u_id, user, hashed_password in zip(u_ids, users, hashes)])
+        except InputError:
+            # another worker process took one of the emails just now
+            return {
+                'u_ids': [],
+                'errors': used_email_errors(users, set()),
+            }
+
+    return {
+        'u_ids': list(u_ids),
+        'errors': [],
+    }
+
+# helper
+def used_email_errors(users, invalid_rows):
+    """ The errors for the rows whose email is taken, or used by an earlier row """
+    errors = []
+    seen_emails = set()
+    for row, user in enumerate(users):
+        if row in invalid_rows:
+            continue
+        email = normalise_email(user['email'])
+        if email in seen_emails or get_user_by_email(email) is not None:
+            errors.append({'row': row, 'message': "Email has been used."})
+        seen_emails.add(email)
+    return errors
 
 # helper
 def auth_get_current_user_id_from_token(token):
-    # right now, tokens are just the user ids
-    if token not in database['active_tokens']:
+    claims = token_decode(token)
+
+    # a correctly signed token could still have been logged out, which
+    # moved its user on to a new generation of tokens
+    if not is_current_generation(claims):
         raise AccessError("token is invalid")
 
-    return token
+    return claims['u_id']
+
+# helper
+def is_current_generation(claims):
+    generation = session_generation(claims['u_id'])
+    return generation is not None and claims.get('generation') == generation
+
+# helper
+def token_generation(token):
+    return token_decode(token).get('generation')
 
 # helper
 def auth_get_user_data_from_id(user_id):
     """ Raises ValueError is the a user with id id doesn't exists """
-    for user in database['users']:
-        if user['id'] == user_id:
-            return user
+    user = get_user(user_id)
+    if user is not None:
+        return user
     raise ValueError(f"user with id {user_id} wasn't found in the database")
 
 
 # Helper function for validating an Email
 def check_email(email):
-    regex = r'^[a-z0-9]+[\._]?[a-z0-9]+[@]\w+[.]\w{2,3}$'
-    if re.search(regex, email):
-        return
-    raise InputError("Email inputted is invalid.")
+    validate_email(email)
 
 # Helper function to check register info.
 def input_error_checking(email, password, name_first, name_last):
-    check_email(email)
-
-    if len(password) < 6:
-        raise InputError("Password is too short.")
-
-    if len(name_first) > 50 or len(name_first) < 1:
-        raise InputError("First name is invalid.")
-
-    if len(name_last) > 50 or len(name_last) < 1:
-        raise InputError("Last name is invalid.")
+    validate_registration(email, password, name_first, name_last)
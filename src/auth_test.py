@@ -1,7 +1,8 @@
 import pytest
-from auth import auth_login, auth_logout, auth_register, auth_get_user_data_from_id
+from auth import auth_login, auth_logout, auth_register, auth_register_bulk, auth_get_user_data_from_id
 from database import clear_database
-from error import InputError
+from channels import channels_list
+from error import InputError, AccessError
 
 def register_new_account():
     return auth_register('validemail@gmail.com', '123abc!@#', 'Hayden', 'Everest')
@@ -59,6 +60,25 @@ def test_logout_success():
     token = result['token']
     assert auth_logout(token)['is_success'] == True
 
+def test_logout_ends_every_session():
+    clear_database()
+    token = register_new_account()['token']
+    assert auth_logout(token)['is_success'] == True
+    with pytest.raises(AccessError):
+        channels_list(token)
+    new_token = auth_login('validemail@gmail.com', '123abc!@#')['token']
+    assert new_token != token
+    channels_list(new_token)
+
+def test_token_from_before_clear():
+    clear_database()
+    token = register_new_account()['token']
+    clear_database()
+    # the same id, a different user
+    register_new_account()
+    with pytest.raises(AccessError):
+        channels_list(token)
+
 # Successful cases for auth_register
 def test_register_success_case():
     clear_database()
@@ -93,4 +113,41 @@ def test_auth_register_wrong_name():
 def test_auth_helper_user_data_from_invalid_id():
     clear_database()
     with pytest.raises(ValueError):
-        auth_get_user_data_from_id(user_id=-1)
\ No newline at end of file
+        auth_get_user_data_from_id(user_id=-1)
+
+def new_bulk_row(email):
+    return {'email': email, 'password': '123abc!@#', 'name_first': 'Hayden', 'name_last': 'Everest'}
+
+# Tests for auth_register_bulk
+def test_register_bulk_success():
+    clear_database()
+    admin = register_new_account()
+    result = auth_register_bulk(admin['token'], [new_bulk_row('first@gmail.com'), new_bulk_row('second@gmail.com')])
+    assert result['errors'] == []
+    assert len(set(result['u_ids'] + [admin['u_id']])) == 3
+
+    assert auth_login('first@gmail.com', '123abc!@#')['u_id'] == result['u_ids'][0]
+    assert auth_login('second@gmail.com', '123abc!@#')['u_id'] == result['u_ids'][1]
+
+def test_register_bulk_reports_every_bad_row():
+    clear_database()
+    admin = register_new_account()
+    rows = [
+        new_bulk_row('first@gmail.com'),
+        new_bulk_row('invalid.com'),
+        new_bulk_row('validemail@gmail.com'), # used by admin
+        new_bulk_row('first@gmail.com'),      # used earlier in the batch
+        {'email': 'missing@gmail.com'},
+    ]
+    result = auth_register_bulk(admin['token'], rows)
+    assert result['u_ids'] == []
+    assert [error['row'] for error in result['errors']] == [1, 2, 3, 4]
+
+    # nobody was registered
+    with pytest.raises(InputError):
+        auth_login('first@gmail.com', '123abc!@#')
+
+def test_register_bulk_invalid_token():
+    clear_database()
+    with pytest.raises(AccessError):
+        auth_register_bulk(-1, [new_bulk_row('first@gmail.com')])
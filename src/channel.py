@@ -1,106 +1,114 @@
-from database import database
-from auth import auth_get_current_user_id_from_token, auth_get_user_data_from_id
+from database import get_user, get_channel, remove_channel, add_channel_member, remove_channel_member, \
+    add_channel_owner, remove_channel_owner, is_channel_member, is_channel_owner, get_channel_member_ids, \
+    get_channel_owner_ids, get_channel_members_after, get_message_channel_id, is_channel_message, \
+    count_channel_messages, get_channel_messages_page, get_user_profiles
+from auth import auth_get_current_user_id_from_token
+from locks import locked, channel_key, user_key
 from error import InputError, AccessError
 
+MEMBERS_PAGE_SIZE = 50
+
 def channel_invite(token, channel_id, u_id):
     inviter_user_id = auth_get_current_user_id_from_token(token)
 
-    valid_user = None
-    for user in database['users']:
-        if user['id'] == u_id:
-            valid_user = user
-
-    if valid_user is None:
+    if get_user(u_id) is None:
         raise InputError(f"{u_id} is an invalid user id")
 
-    target_channel = None
-    for channel in database['channels']:
-        if channel['id'] == channel_id:
-            target_channel = channel
-
-    if target_channel is None:
-        raise InputError(f"{channel_id} is invalid channel")
+    with locked(channel_key(channel_id), user_key(u_id)):
+        target_channel = get_channel(channel_id)
+        if target_channel is None:
+            raise InputError(f"{channel_id} is invalid channel")
 
-    if inviter_user_id not in target_channel['all_members_id']:
-        raise AccessError(f"user {inviter_user_id} not authorized to invite you to this channel")
+        if not is_channel_member(target_channel, inviter_user_id):
+            raise AccessError(f"user {inviter_user_id} not authorized to invite you to this channel")
 
-    if u_id not in target_channel['all_members_id']:
-        target_channel['all_members_id'].append(u_id)
+        add_channel_member(target_channel, u_id)
 
     return {}
 
 
 def channel_details(token, channel_id):
-    current_user_id = auth_get_current_user_id_from_token(token)
-
-    # TODO: maybe database['channels'] should be a dict and not a list
-    target_channel = None
-    for channel in database['channels']:
-        if channel['id'] == channel_id:
-            target_channel = channel
-
-    if target_channel is None:
-        raise InputError(f"{channel_id} is invalid channel")
-
-    if current_user_id not in target_channel['all_members_id']:
-        raise AccessError(f"user {current_user_id} not authorized to access this channel")
+    # the member sets mustn't change while we go through them
+    with locked(channel_key(channel_id)):
+        target_channel = get_member_channel(token, channel_id)
 
-    # build the information dictionnary
+        return {
+            "name": target_channel['name'],
+            "owner_members": get_user_profiles(get_channel_owner_ids(target_channel)),
+            "all_members": get_user_profiles(get_channel_member_ids(target_channel)),
+        }
 
-    owners = []
-    for ownerid in target_channel['owner_members_id']:
-        user_data = auth_get_user_data_from_id(ownerid)
-        owners.append(formated_user_details_from_user_data(user_data))
-
-    members = []
-    for memberid in target_channel['all_members_id']:
-        user_data = auth_get_user_data_from_id(memberid)
-        members.append(formated_user_details_from_user_data(user_data))
+def channel_details_paged(token, channel_id, cursor=0, limit=MEMBERS_PAGE_SIZE):
+    """
+    Like channel_details, but only returns a page of up to limit members,
+    those with the lowest ids greater than cursor. Pass the returned
+    'cursor' to get the next page, it is -1 once every member was returned.
+    Members joining or leaving don't make the pages skip or repeat anyone.
+    """
+    if limit < 1:
+        raise InputError(f"limit must be positive, got {limit}")
+
+    with locked(channel_key(channel_id)):
+        target_channel = get_member_channel(token, channel_id)
+
+        # one more than asked for, to know if there is a next page
+        page = get_channel_members_after(target_channel, cursor, limit + 1)
+        next_cursor = -1
+        if len(page) > limit:
+            page.pop()
+            next_cursor = page[-1]
+
+        return {
+            "name": target_channel['name'],
+            "owner_members": get_user_profiles(get_channel_owner_ids(target_channel)),
+            "members": get_user_profiles(page),
+            "cursor": next_cursor,
+        }
+
+def channel_messages(token, channel_id, start, before_message_id=None):
+    """
+    Index 0 is the most recent message. If before_message_id is given, index
+    0 is instead the message sent just before that one, so a client scrolling
+    back through history can keep passing the last message it has got and
+    won't see pages shift when new messages are sent.
+    """
+    current_user_id = auth_get_current_user_id_from_token(token)
 
-    return {
-        "name": target_channel['name'],
-        "owner_members": owners,
-        "all_members": members,
-    }
+    # so the count start is checked against and the page are of the same messages
+    with locked(channel_key(channel_id)):
+        return channel_messages_page(current_user_id, channel_id, start, before_message_id)
 
-def channel_messages(token, channel_id, start):
+# helper, channel_messages once the channel is locked
+def channel_messages_page(current_user_id, channel_id, start, before_message_id):
     # Invalid channel ID
-    channel_total = len(database['channels'])
-    if channel_id < 0 or channel_total < channel_id:
+    channel = get_channel(channel_id)
+    if channel is None:
         raise InputError(f'Invalid channel_id: {channel_id}')
 
     # Authorised user not part of channel
-    current_user_id = auth_get_current_user_id_from_token(token)
-    if current_user_id not in database['channels'][channel_id]['all_members_id']:
+    if not is_channel_member(channel, current_user_id):
         raise AccessError(f'Authorised user ({current_user_id}) not part of channel ({channel_id})')
 
+    # a removed message still marks its place, see is_channel_message
+    if before_message_id is not None and not is_channel_message(channel, before_message_id):
+        raise InputError(f'Message {before_message_id} is not in channel {channel_id}')
+
+    # how many messages we could return
+    newest = count_channel_messages(channel, before_message_id)
+
     # Invalid start:
     #   Negative start index
     #   Start greater than total number of messages in channel
-    messages_total = len(database['channels'][channel_id]['messages'])
-    if start < 0 or start > messages_total:
+    if start < 0 or start > newest:
         raise InputError('Invalid start value')
 
-    channel_msg = [] # List of channel_messages to be returned
     end = start + 50 # Correct value unless start + 50 overflows latest message
 
-    # comment this out for now because we don't have message_send yet, so we
-    # can't black box test this YET, so coverage isn't happy.
-
-    # message_count = 0
+    channel_msg = get_channel_messages_page(channel, start, 50, before_message_id)
 
-    # for message in database['channels'][channel_id]['messages']:
-    #     # Searches database and add messages to channel_msg list
-    #     channel_msg.append(message)
-    #     message_count += 1
-    #     if message_count == 50:
-    #         break
-
-    # # less than 50 messages from start value to latest message
-    # if message_count < 50:
-    #     end = -1
-
-    end = -1
+    # less than 50 messages from start value to latest message
+    if end >= newest:
+        end = -1
 
     return {
         'messages': channel_msg,
@@ -108,60 +116,73 @@ def channel_messages(token, channel_id, start):
         'end': end,
     }
 
+def channel_messages_after(token, channel_id, after_message_id=0):
+    """
+    The (up to 50) messages sent to the channel after after_message_id,
+    oldest first, or its first messages if after_message_id is 0. Pass the
+    id of the last message returned to get the next ones, this is what
+    clients waiting for new messages use (see async_server.py). If that
+    message has been removed since, the next ones are still those sent
+    after it.
+    """
+    with locked(channel_key(channel_id)):
+        channel = get_member_channel(token, channel_id)
+
+        newer = count_channel_messages(channel)
+        if after_message_id != 0:
+            if not is_channel_message(channel, after_message_id):
+                raise InputError(f'Message {after_message_id} is not in channel {channel_id}')
+            newer -= count_channel_messages(channel, after_message_id)
+            if get_message_channel_id(after_message_id) is not None:
+                # not removed, and not newer than itself
+                newer -= 1
+
+        page = get_channel_messages_page(channel, max(newer - 50, 0), min(newer, 50))
+    page.reverse()
+    return {
+        'messages': page,
+    }
+
 def channel_leave(token, channel_id):
-    target_channel = None
     current_user_id = auth_get_current_user_id_from_token(token)
-    for channel in database['channels']:
-        if channel['id'] == channel_id:
-            target_channel = channel
-
-    if target_channel is None:
-        raise InputError('Channel ID is invalid')
-    # This method of accessing channel is written by
-    # Matheiu in channel_details. Still has to figure out
-    # whether need to change the channels as list to channel as dictionary
+    with locked(channel_key(channel_id), user_key(current_user_id)):
+        target_channel = get_channel(channel_id)
+        if target_channel is None:
+            raise InputError('Channel ID is invalid')
 
-    if current_user_id not in target_channel['all_members_id']:
-        raise AccessError('User is not in this channel')
+        if not is_channel_member(target_channel, current_user_id):
+            raise AccessError('User is not in this channel')
 
-    #Delete the user's token from that channel
-    for user in target_channel['all_members_id']:
-        if current_user_id == user:
-            target_channel['all_members_id'].remove(current_user_id)
+        remove_channel_member(target_channel, current_user_id)
 
 def channel_join(token, channel_id):
-    target_channel = None
     current_user_id = auth_get_current_user_id_from_token(token)
-    for channel in database['channels']:
-        if channel['id'] == channel_id:
-            target_channel = channel
+    with locked(channel_key(channel_id), user_key(current_user_id)):
+        target_channel = get_channel(channel_id)
+        if target_channel is None:
+            raise InputError('Channel ID is invalid')
 
-    if target_channel is None:
-        raise InputError('Channel ID is invalid')
-
-    if not target_channel['is_public']:
-        raise AccessError('Channel is not public')
+        if not target_channel['is_public']:
+            raise AccessError('Channel is not public')
 
-    for channel in database['channels']:
-        if channel['id'] == channel_id:
-            channel['all_members_id'].append(current_user_id)
+        add_channel_member(target_channel, current_user_id)
 
 def channel_addowner(token, channel_id, u_id):
-    # Generate channel that match the channel_id
-    channel = next((channel for channel in database['channels'] if channel["id"] == channel_id), None)
-    if channel == None:
-        raise InputError("Channel_id is not valid")
+    with locked(channel_key(channel_id)):
+        channel = get_channel(channel_id)
+        if channel == None:
+            raise InputError("Channel_id is not valid")
 
-    if u_id in channel['owner_members_id']:
-        raise InputError("User is already an owner of the channel")
+        if is_channel_owner(channel, u_id):
+            raise InputError("User is already an owner of the channel")
 
-    if u_id not in channel['all_members_id']:
-        raise InputError("User not in the channel")
+        if not is_channel_member(channel, u_id):
+            raise InputError("User not in the channel")
 
-    if auth_get_current_user_id_from_token(token) not in channel['owner_members_id']:
-        raise AccessError("User is not owner")
+        if not is_channel_owner(channel, auth_get_current_user_id_from_token(token)):
+            raise AccessError("User is not owner")
 
-    channel['owner_members_id'].append(u_id)
+        add_channel_owner(channel, u_id)
 
 
 def channel_removeowner(token, channel_id, u_id):
@@ -169,37 +190,50 @@ def channel_removeowner(token, channel_id, u_id):
     When there is only one owner in the channel and this owner is removed,
     there should be another user in this room randomly became the owner.
     """
-    # Generate the channel which match the channel_id
-    channel = next((channel for channel in database['channels'] if channel["id"] == channel_id), None)
     user_who_remove_others_uid = auth_get_current_user_id_from_token(token)
-    if channel == None:
-        raise InputError("Channel_id is not valid")
+    # u_id's channels change too if it's the last member and the channel goes
+    with locked(channel_key(channel_id), user_key(u_id)):
+        channel = get_channel(channel_id)
+        if channel == None:
+            raise InputError("Channel_id is not valid")
+
+        if not is_channel_owner(channel, u_id):
+            raise InputError("User is not a owner, can not be removed")
 
-    if u_id not in channel['owner_members_id']:
-        raise InputError("User is not a owner, can not be removed")
+        if not is_channel_owner(channel, user_who_remove_others_uid):
+            raise AccessError("User is not authorized")
 
-    if user_who_remove_others_uid not in channel['owner_members_id']:
-        raise AccessError("User is not authorized")
+        # If the owner is the only owner in the channel
+        if len(get_channel_owner_ids(channel)) == 1:
+            # Generate a user to become the owner
+            next_owner_uid = next((user for user in get_channel_member_ids(channel) if user != user_who_remove_others_uid), None)
+            if next_owner_uid != None:
+                add_channel_owner(channel, next_owner_uid)
 
-    # If the owner is the only owner in the channel
-    if len(channel['owner_members_id']) == 1:
-        # Generate a user to become the owner
-        next_owner_uid = next((user for user in channel['all_members_id'] if user != user_who_remove_others_uid), None)
-        if next_owner_uid != None:
-            for channel in database['channels']:
-                if channel['id'] == channel_id:
-                    channel['owner_members_id'].append(next_owner_uid)
 
+        # If there are only one member in the channel(including owner),
+        # remove the whole channel otherwise remove the owner.
+        if len(get_channel_member_ids(channel)) == 1:
+            channel_remove(channel_id)
+        else:
+            remove_channel_owner(channel, u_id)
 
-    # If there are only one member in the channel(including owner),
-    # remove the whole channel otherwise remove the owner.
-    if len(channel['all_members_id']) == 1:
-        channel_remove(channel_id)
-    else:
-        channel['owner_members_id'].remove(u_id)
 
+# helper
+def get_member_channel(token, channel_id):
+    """ The channel, if the token's user is allowed to see its details """
+    current_user_id = auth_get_current_user_id_from_token(token)
+
+    target_channel = get_channel(channel_id)
+    if target_channel is None:
+        raise InputError(f"{channel_id} is invalid channel")
+
+    if not is_channel_member(target_channel, current_user_id):
+        raise AccessError(f"user {current_user_id} not authorized to access this channel")
 
-# helper used by channel_create
+    return target_channel
+
+# helper, channel_details uses the cached equivalent, get_user_profiles
 def formated_user_details_from_user_data(user_data):
     return {
         'u_id': user_data['id'],
@@ -214,23 +248,5 @@ def channel_remove(channel_id):
     """
     remove the channel based on its channel_id
     This is not a official function, use it as a helper
-
-    However, removing channel will change the index of the element in the
-    'channels' list, so there should be no access to channel in the database
-    directly using channel_id as its index
-    For example:
-
-    Bad access:
-    >>> database['channels'][channel_id]
-
-    Good access:
-    >>> for channel in database['channels']:
-            if channel['id'] == channel_id:
-                do something
     """
-
-    # the [:] is me showing off. I can think of two options:
-    # database['channels'] = list(filter(...)) # allocates a new list for sure
-    # database['channels'][:] = filter(...)    # has a chance of writing the list in place, maybe without reallocating
-    database['channels'][:] = filter(lambda channel: channel['id'] != channel_id, database['channels'])
-
+    remove_channel(channel_id)
@@ -1,7 +1,8 @@
-from channel import channel_messages, channel_invite, channel_leave, channel_addowner, channel_join, channel_details, formated_user_details_from_user_data, channel_removeowner
+from channel import channel_messages, channel_invite, channel_leave, channel_addowner, channel_join, channel_details, formated_user_details_from_user_data, channel_removeowner, channel_details_paged
 from auth import auth_register, auth_login, auth_get_user_data_from_id
 from channels import channels_create, channels_list
 from database import clear_database
+from message import message_send, message_remove
 from error import InputError, AccessError
 from word_list import word_list
 import random
@@ -64,52 +65,158 @@ def test_messages_invalid_token():
     with pytest.raises(AccessError):
         channel_messages(-1, 0, 0)
     
-# ----------------------------- Add these tests when message_send is implemented ------------------
-# def test_messages_negative_start_index():
-#     clear_database()
-    # # Add a user and log them in
-    # user = register_user('validemailowner01@gmail.com', 'validpass@!owner01', 'Bob', 'Smith')
-    
-    # # Create a channel and fill with messages
-    # channel = channels_create(user['token'], 'new_channel', is_public = True)
-    # populate_channel_hundred_messages(user['token'], channel['channel_id'])
-#     with pytest.raises(InputError):
-#         assert channel_messages(user['token'], channel['channel_id'], -1)
-
-# def test_messages_simple():
-#     clear_database()
-#     # Add a user and log them in
-#     user = register_user('validemailowner01@gmail.com', 'validpass@!owner01', 'Bob', 'Smith')
-    
-#     # Create a channel and fill with messages
-#     channel = channels_create(user['token'], 'new_channel', is_public = True)
-#     message_send(user['token'], channel['channel_id]', "Hello World!"])
-#     res = channel_messages(user['token'], channel['channel_id'], 0)
-#     assert res['messages'][0] == {"Hello World!"}
-
-# def test_messages_start_overflow():
-    # clear_database()
-    # user = register_user('validemail01@gmail.com', 'validpass@!owner01', 'Bob', 'Smith')
-    # channel = channels_create(user['token'], 'channel_01', is_public = True)
-    # channel_join(user['token'], channel['channel_id'])
-    # message_send(user['token'], channel['channel_id'], 'Hello World!')
-    # with pytest.raises(InputError):
-    #     assert channel_messages(user['token'], channel['channel_id'], 100)
-
-# def test_messages_start_underflow():
-#     clear_database()
-#     user = register_user('validemail01@gmail.com', 'validpass@!owner01', 'Bob', 'Smith')
-#     channel = channels_create(user['token'], 'channel_01', is_public = True)
-#     channel_join(user['token'], channel['channel_id'])
-#     message_send(user['token'], channel['channel_id'], 'Hello World!')
-#     assert channel_messages(user['token'], channel['channel_id'], 0) == -1
-
-# # Helper function to send 100 messages to a given channel
-# def populate_channel_hundred_messages(token, channel_id):
-#     for i in range(1,100):
-#         index = random.randint(0, len(word_list) - 1)
-#         message = word_list[index]
-#         message_send(token, channel_id, message)
+def test_messages_negative_start_index():
+    clear_database()
+    # Add a user and log them in
+    user = register_user('validemailowner01@gmail.com', 'validpass@!owner01', 'Bob', 'Smith')
+
+    # Create a channel and fill with messages
+    channel = channels_create(user['token'], 'new_channel', is_public = True)
+    populate_channel_hundred_messages(user['token'], channel['channel_id'])
+    with pytest.raises(InputError):
+        assert channel_messages(user['token'], channel['channel_id'], -1)
+
+def test_messages_simple():
+    clear_database()
+    # Add a user and log them in
+    user = register_user('validemailowner01@gmail.com', 'validpass@!owner01', 'Bob', 'Smith')
+
+    # Create a channel and fill with messages
+    channel = channels_create(user['token'], 'new_channel', is_public = True)
+    message_id = message_send(user['token'], channel['channel_id'], "Hello World!")['message_id']
+    res = channel_messages(user['token'], channel['channel_id'], 0)
+    assert len(res['messages']) == 1
+    assert res['messages'][0]['message_id'] == message_id
+    assert res['messages'][0]['message'] == "Hello World!"
+    assert res['messages'][0]['u_id'] == user['u_id']
+    assert res['end'] == -1
+
+def test_messages_start_overflow():
+    clear_database()
+    user = register_user('validemail01@gmail.com', 'validpass@!owner01', 'Bob', 'Smith')
+    channel = channels_create(user['token'], 'channel_01', is_public = True)
+    message_send(user['token'], channel['channel_id'], 'Hello World!')
+    with pytest.raises(InputError):
+        assert channel_messages(user['token'], channel['channel_id'], 100)
+
+def test_messages_most_recent_first():
+    clear_database()
+    user = register_user('validemail01@gmail.com', 'validpass@!owner01', 'Bob', 'Smith')
+    channel = channels_create(user['token'], 'channel_01', is_public = True)
+    message_send(user['token'], channel['channel_id'], 'first')
+    message_send(user['token'], channel['channel_id'], 'second')
+    messages = channel_messages(user['token'], channel['channel_id'], 0)['messages']
+    assert [message['message'] for message in messages] == ['second', 'first']
+
+def test_messages_pagination():
+    clear_database()
+    user = register_user('validemail01@gmail.com', 'validpass@!owner01', 'Bob', 'Smith')
+    channel = channels_create(user['token'], 'channel_01', is_public = True)
+    populate_channel_hundred_messages(user['token'], channel['channel_id'])
+    message_send(user['token'], channel['channel_id'], 'latest')
+
+    first_page = channel_messages(user['token'], channel['channel_id'], 0)
+    assert len(first_page['messages']) == 50
+    assert first_page['messages'][0]['message'] == 'latest'
+    assert first_page['end'] == 50
+
+    second_page = channel_messages(user['token'], channel['channel_id'], 50)
+    assert len(second_page['messages']) == 50
+    assert second_page['end'] == 100
+
+    last_page = channel_messages(user['token'], channel['channel_id'], 100)
+    assert len(last_page['messages']) == 1
+    assert last_page['end'] == -1
+
+    seen_ids = [message['message_id'] for page in (first_page, second_page, last_page) for message in page['messages']]
+    assert len(set(seen_ids)) == 101
+
+def test_messages_skips_removed():
+    clear_database()
+    user = register_user('validemail01@gmail.com', 'validpass@!owner01', 'Bob', 'Smith')
+    channel = channels_create(user['token'], 'channel_01', is_public = True)
+    message_send(user['token'], channel['channel_id'], 'first')
+    removed = message_send(user['token'], channel['channel_id'], 'second')['message_id']
+    message_send(user['token'], channel['channel_id'], 'third')
+    message_remove(user['token'], removed)
+
+    messages = channel_messages(user['token'], channel['channel_id'], 0)['messages']
+    assert [message['message'] for message in messages] == ['third', 'first']
+
+def test_messages_pagination_after_remove():
+    clear_database()
+    user = register_user('validemail01@gmail.com', 'validpass@!owner01', 'Bob', 'Smith')
+    channel = channels_create(user['token'], 'channel_01', is_public = True)
+    message_ids = [message_send(user['token'], channel['channel_id'], str(i))['message_id'] for i in range(60)]
+    message_remove(user['token'], message_ids[59])
+    message_remove(user['token'], message_ids[0])
+
+    page = channel_messages(user['token'], channel['channel_id'], 0)
+    assert page['messages'][0]['message'] == '58'
+    assert page['end'] == 50
+    last_page = channel_messages(user['token'], channel['channel_id'], 50)
+    assert [message['message'] for message in last_page['messages']] == [str(i) for i in range(8, 0, -1)]
+    assert last_page['end'] == -1
+
+    # removing after reading still works
+    message_remove(user['token'], message_ids[58])
+    assert channel_messages(user['token'], channel['channel_id'], 0)['messages'][0]['message'] == '57'
+
+def test_messages_before_message_id():
+    clear_database()
+    user = register_user('validemail01@gmail.com', 'validpass@!owner01', 'Bob', 'Smith')
+    channel = channels_create(user['token'], 'channel_01', is_public = True)
+    message_ids = [message_send(user['token'], channel['channel_id'], str(i))['message_id'] for i in range(120)]
+
+    first_page = channel_messages(user['token'], channel['channel_id'], 0)
+    cursor = first_page['messages'][-1]['message_id']
+    assert cursor == message_ids[70]
+
+    # new messages don't shift the pages after the cursor
+    message_send(user['token'], channel['channel_id'], 'new')
+    second_page = channel_messages(user['token'], channel['channel_id'], 0, before_message_id=cursor)
+    assert second_page['messages'][0]['message_id'] == message_ids[69]
+    assert len(second_page['messages']) == 50
+    assert second_page['end'] == 50
+
+    cursor = second_page['messages'][-1]['message_id']
+    last_page = channel_messages(user['token'], channel['channel_id'], 0, before_message_id=cursor)
+    assert [message['message_id'] for message in last_page['messages']] == message_ids[19::-1]
+    assert last_page['end'] == -1
+
+def test_messages_before_removed_message():
+    clear_database()
+    user = register_user('validemail01@gmail.com', 'validpass@!owner01', 'Bob', 'Smith')
+    channel = channels_create(user['token'], 'channel_01', is_public = True)
+    message_ids = [message_send(user['token'], channel['channel_id'], str(i))['message_id'] for i in range(10)]
+
+    # the client's cursor was removed since it got it, and the one before it too
+    message_remove(user['token'], message_ids[5])
+    message_remove(user['token'], message_ids[4])
+    page = channel_messages(user['token'], channel['channel_id'], 0, before_message_id=message_ids[5])
+    assert [message['message_id'] for message in page['messages']] == message_ids[3::-1]
+    assert page['end'] == -1
+
+def test_messages_before_message_id_invalid():
+    clear_database()
+    user = register_user('validemail01@gmail.com', 'validpass@!owner01', 'Bob', 'Smith')
+    channel_a = channels_create(user['token'], 'channel_a', is_public = True)
+    channel_b = channels_create(user['token'], 'channel_b', is_public = True)
+    message_id = message_send(user['token'], channel_b['channel_id'], 'hello')['message_id']
+
+    with pytest.raises(InputError):
+        channel_messages(user['token'], channel_a['channel_id'], 0, before_message_id=message_id)
+    with pytest.raises(InputError):
+        channel_messages(user['token'], channel_a['channel_id'], 0, before_message_id=233)
+    with pytest.raises(InputError):
+        channel_messages(user['token'], channel_b['channel_id'], 1, before_message_id=message_id)
+
+# Helper function to send 100 messages to a given channel
+def populate_channel_hundred_messages(token, channel_id):
+    for _ in range(100):
+        index = random.randint(0, len(word_list) - 1)
+        message = word_list[index]
+        message_send(token, channel_id, message)
 
 # ---------------------------------------------------------------------------------------------
 # Returns {u_id, token}
@@ -324,6 +431,47 @@ def test_channel_details_invalid_id():
     with pytest.raises(InputError):
         channel_details(usera['token'], 1)
 
+def test_channel_details_paged():
+    clear_database()
+    owner = register_one_user()
+    channel_id = channels_create(owner['token'], 'channel', True)['channel_id']
+    member_ids = [owner['u_id']]
+    for i in range(4):
+        member = auth_register(f"member{i}@gmail.com", "averylongpassword", "Member", str(i))
+        channel_join(member['token'], channel_id)
+        member_ids.append(member['u_id'])
+
+    first_page = channel_details_paged(owner['token'], channel_id, limit=2)
+    assert first_page['name'] == 'channel'
+    assert_contains_users_id(first_page['owner_members'], [owner['u_id']])
+    assert [member['u_id'] for member in first_page['members']] == member_ids[:2]
+
+    second_page = channel_details_paged(owner['token'], channel_id, first_page['cursor'], limit=2)
+    assert [member['u_id'] for member in second_page['members']] == member_ids[2:4]
+
+    last_page = channel_details_paged(owner['token'], channel_id, second_page['cursor'], limit=2)
+    assert [member['u_id'] for member in last_page['members']] == member_ids[4:]
+    assert last_page['cursor'] == -1
+
+def test_channel_details_paged_exact_page():
+    clear_database()
+    owner = register_one_user()
+    channel_id = channels_create(owner['token'], 'channel', True)['channel_id']
+    page = channel_details_paged(owner['token'], channel_id, limit=1)
+    assert [member['u_id'] for member in page['members']] == [owner['u_id']]
+    assert page['cursor'] == -1
+
+def test_channel_details_paged_errors():
+    clear_database()
+    usera, userb = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', False)['channel_id']
+    with pytest.raises(AccessError):
+        channel_details_paged(userb['token'], channel_id)
+    with pytest.raises(InputError):
+        channel_details_paged(usera['token'], channel_id + 1)
+    with pytest.raises(InputError):
+        channel_details_paged(usera['token'], channel_id, limit=0)
+
 def test_add_owner_invalid_id():
     clear_database()
     usera = auth_register('email@test.com', 'somepasswordgoodenough', 'first', 'last')
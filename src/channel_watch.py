@@ -0,0 +1,32 @@
+"""
+Wakes up whoever is waiting for new messages in a channel (see
+async_server.py) when one is sent, so waiting clients don't have to keep
+polling channel_messages. Callbacks are called on the thread that sent the
+message, so they must be quick and thread-safe.
+"""
+import threading
+
+watchers = {
+    'lock': threading.Lock(),
+    # channel id -> set of callbacks
+    'channels': {},
+}
+
+def channel_watch(channel_id, callback):
+    with watchers['lock']:
+        watchers['channels'].setdefault(channel_id, set()).add(callback)
+
+def channel_unwatch(channel_id, callback):
+    with watchers['lock']:
+        callbacks = watchers['channels'].get(channel_id)
+        if callbacks is None:
+            return
+        callbacks.discard(callback)
+        if not callbacks:
+            del watchers['channels'][channel_id]
+
+def channel_notify(channel_id):
+    with watchers['lock']:
+        callbacks = list(watchers['channels'].get(channel_id, ()))
+    for callback in callbacks:
+        callback()
@@ -1,22 +1,27 @@
-from database import database
-from channel import channel_details
+from database import add_channel, get_channel, get_channels, get_user_channel_ids, allocate_id
 from auth import auth_get_user_data_from_id, auth_get_current_user_id_from_token
+from locks import locked, user_key
 from error import AccessError, InputError
 
-def simplify_channel_details(token, channel_id):
+def channel_summary(channel):
+    """
+    The short form of a channel used by the channel lists. Build it straight
+    from the channel, channel_details does far more work than a list needs.
+    """
     return {
-        'channel_id': channel_id,
-        'name': channel_details(token, channel_id)['name']
+        'channel_id': channel['id'],
+        'name': channel['name'],
     }
 
 def channels_list(token):
     channels = []
     current_user_id = auth_get_current_user_id_from_token(token)
 
-    for channel in database['channels']:
-        for user_id in channel['all_members_id']:
-            if current_user_id == user_id:
-                channels.append(simplify_channel_details(token, channel['id']))
+    # channel ids only go up, so sorting them lists the channels in the order
+    # they were created
+    with locked(user_key(current_user_id)):
+        for channel_id in sorted(get_user_channel_ids(current_user_id)):
+            channels.append(channel_summary(get_channel(channel_id)))
     return channels
 
 def channels_listall(token):
@@ -24,9 +29,8 @@ def channels_listall(token):
     # makes sure the user is valid
     auth_get_current_user_id_from_token(token)
     
-    for channel in database['channels']:
-        authorised_token = channel['all_members_id'][0]
-        channels.append(simplify_channel_details(authorised_token, channel['id']))
+    for channel in get_channels():
+        channels.append(channel_summary(channel))
     return channels
 
 def channels_create(token, name, is_public):
@@ -38,17 +42,20 @@ def channels_create(token, name, is_public):
 
     creator_data = auth_get_user_data_from_id(auth_get_current_user_id_from_token(token))
 
-    channel_num = len(database['channels'])
+    # never reused, even once the channel is removed
+    channel_id = allocate_id('channels')
     new_channel = {
         'name': name,
-        'id': channel_num,
+        'id': channel_id,
         'is_public': is_public,
-        'owner_members_id': [creator_data['id']],
-        'all_members_id': [creator_data['id']],
+        'owner_members_id': {creator_data['id']},
+        'all_members_id': {creator_data['id']},
         'messages': [],
+        'removed_messages': 0,
     }
 
-    database['channels'].append(new_channel)
+    with locked(user_key(creator_data['id'])):
+        add_channel(new_channel)
 
     return {
         'channel_id': new_channel['id']
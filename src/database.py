@@ -1,44 +1,220 @@
-database = {
-    'users': [],
-    'channels': [
-        # {
-        #     "id": 1,
-        #     "name": "greatest_channel",
-        #     # the user id of the owners
-        #     "owner_members_id": [1, 2, 3]
-        #     # the user id of all the members (including the owners)
-        #     "all_members_id": [1, 2, 3, 5, 4, 9]
-        #     "is_public": True
-        #      "messages": [
-        #           {
-        #               "message_id": 1,
-        #               "u_id": 1,
-        #               "message": "Hello world",
-        #               "time_created": 1582426789,
-        #           }
-        #       ],
-        # },
-        # {
-        #     "id": 2,
-        #     "name": "me myself and I",
-        #     "owner_members_id": [3]
-        #     "all_members_id": [3]
-        #     "is_public": False
-        #      "messages": [
-        #           {
-        #               "message_id": 1,
-        #               "u_id": 1,
-        #               "message": "Hello world",
-        #               "time_created": 1582426789,
-        #           }
-        #       ],
-        # }
-    ],
-    'active_tokens': []
+"""
+The helpers the rest of the code reads and changes the data through. Each
+one forwards to the storage backend in use (see storage.py), which is the
+in-memory DictStorage unless use_storage picks another.
+
+The helpers that change a user or a channel also bump its version (see
+response_cache.py), after the change so that a response built from the old
+data is never filed under the new version.
+"""
+from storage import normalise_email
+from dict_storage import DictStorage, database, journal, lazy_messages
+
+storage = {
+    'backend': DictStorage(),
 }
 
+def use_storage(backend):
+    """ Switches to backend, returns the one that was in use """
+    previous = storage['backend']
+    storage['backend'] = backend
+    return previous
+
 def clear_database():
-    database['users'].clear()
-    database['channels'].clear()
-    database['active_tokens'].clear()
-    
\ No newline at end of file
+    storage['backend'].clear()
+
+def sync_database():
+    storage['backend'].sync()
+
+def allocate_ids(kind, count=1):
+    return storage['backend'].allocate_ids(kind, count)
+
+def allocate_id(kind):
+    return allocate_ids(kind)[0]
+
+# Versions
+
+def user_version(u_id):
+    """ The version key of the user, bumped when the user or the channels they are in change """
+    return f"user:{u_id}"
+
+def channel_version(channel_id):
+    """ The version key of the channel, bumped when its details change """
+    return f"channel:{channel_id}"
+
+# bumped when a user is added or changed
+USERS_VERSION = 'users'
+# bumped when a channel is created or removed
+CHANNELS_VERSION = 'channels'
+
+def bump_versions(keys):
+    storage['backend'].bump_versions(keys)
+
+def get_versions(keys):
+    return storage['backend'].get_versions(keys)
+
+# Users
+
+def add_user(user):
+    storage['backend'].add_user(user)
+    bump_versions((USERS_VERSION, user_version(user['id'])))
+
+def add_users(users):
+    storage['backend'].add_users(users)
+    bump_versions((USERS_VERSION, *(user_version(user['id']) for user in users)))
+
+def get_user(u_id):
+    return storage['backend'].get_user(u_id)
+
+def get_users(u_ids):
+    return storage['backend'].get_users(u_ids)
+
+def get_user_profiles(u_ids):
+    return storage['backend'].get_user_profiles(u_ids)
+
+def update_user(u_id, changes):
+    """ Changes the user's fields. Always use this rather than assigning to them """
+    storage['backend'].update_user(u_id, changes)
+    # the details of the user's channels show their name. A copy, the user
+    # may be joining a channel as we go through them
+    channels = list(get_user_channel_ids(u_id))
+    bump_versions((USERS_VERSION, user_version(u_id), *map(channel_version, channels)))
+
+def get_user_by_email(email):
+    return storage['backend'].get_user_by_email(email)
+
+# Channels
+
+def add_channel(channel):
+    storage['backend'].add_channel(channel)
+    members = map(user_version, channel['all_members_id'])
+    bump_versions((CHANNELS_VERSION, channel_version(channel['id']), *members))
+
+def get_channel(channel_id):
+    return storage['backend'].get_channel(channel_id)
+
+def get_channels():
+    return storage['backend'].get_channels()
+
+def remove_channel(channel_id):
+    channel = get_channel(channel_id)
+    members = () if channel is None else get_channel_member_ids(channel)
+    storage['backend'].remove_channel(channel_id)
+    bump_versions((CHANNELS_VERSION, channel_version(channel_id), *map(user_version, members)))
+
+def add_channel_member(channel, u_id):
+    storage['backend'].add_channel_member(channel, u_id)
+    bump_versions((channel_version(channel['id']), user_version(u_id)))
+
+def remove_channel_member(channel, u_id):
+    storage['backend'].remove_channel_member(channel, u_id)
+    bump_versions((channel_version(channel['id']), user_version(u_id)))
+
+def add_channel_owner(channel, u_id):
+    storage['backend'].add_channel_owner(channel, u_id)
+    bump_versions((channel_version(channel['id']),))
+
+def remove_channel_owner(channel, u_id):
+    storage['backend'].remove_channel_owner(channel, u_id)
+    bump_versions((channel_version(channel['id']),))
+
+def is_channel_member(channel, u_id):
+    return storage['backend'].is_channel_member(channel, u_id)
+
+def is_channel_owner(channel, u_id):
+    return storage['backend'].is_channel_owner(channel, u_id)
+
+def get_channel_member_ids(channel):
+    return storage['backend'].get_channel_member_ids(channel)
+
+def get_channel_owner_ids(channel):
+    return storage['backend'].get_channel_owner_ids(channel)
+
+def get_channel_members_after(channel, u_id, limit):
+    return storage['backend'].get_channel_members_after(channel, u_id, limit)
+
+def get_user_channel_ids(u_id):
+    return storage['backend'].get_user_channel_ids(u_id)
+
+# Messages
+
+def add_message(channel, message):
+    storage['backend'].add_message(channel, message)
+
+def get_message(message_id):
+    return storage['backend'].get_message(message_id)
+
+def get_message_channel_id(message_id):
+    return storage['backend'].get_message_channel_id(message_id)
+
+def get_messages_sent(message_ids):
+    return storage['backend'].get_messages_sent(message_ids)
+
+def edit_message(message_id, text):
+    storage['backend'].edit_message(message_id, text)
+
+def remove_message(message_id):
+    storage['backend'].remove_message(message_id)
+
+def is_channel_message(channel, message_id):
+    return storage['backend'].is_channel_message(channel, message_id)
+
+def count_channel_messages(channel, before_message_id=None):
+    return storage['backend'].count_channel_messages(channel, before_message_id)
+
+def get_channel_messages_page(channel, start, count, before_message_id=None):
+    return storage['backend'].get_channel_messages_page(channel, start, count, before_message_id)
+
+def get_all_messages():
+    return storage['backend'].get_all_messages()
+
+def load_all_messages():
+    storage['backend'].load_all_messages()
+
+def load_channels_messages(channel_ids):
+    storage['backend'].load_channels_messages(channel_ids)
+
+# Sessions
+
+def add_session(token, u_id):
+    storage['backend'].add_session(token, u_id)
+
+def get_session(token):
+    return storage['backend'].get_session(token)
+
+def remove_session(token):
+    return storage['backend'].remove_session(token)
+
+def get_user_token(u_id):
+    return storage['backend'].get_user_token(u_id)
+
+def get_token_generation(u_id):
+    return storage['backend'].get_token_generation(u_id)
+
+def set_token_generation(u_id, generation):
+    storage['backend'].set_token_generation(u_id, generation)
+
+# Scheduled messages
+
+def add_scheduled_message(message):
+    storage['backend'].add_scheduled_message(message)
+
+def get_scheduled_message(message_id):
+    return storage['backend'].get_scheduled_message(message_id)
+
+def get_scheduled_messages():
+    return storage['backend'].get_scheduled_messages()
+
+def remove_scheduled_message(message_id):
+    return storage['backend'].remove_scheduled_message(message_id)
+
+# Search
+
+def index_words(message_id, words):
+    storage['backend'].index_words(message_id, words)
+
+def unindex_words(message_id, words):
+    storage['backend'].unindex_words(message_id, words)
+
+def find_words(words):
+    return storage['backend'].find_words(words)
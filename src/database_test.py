@@ -1,9 +1,10 @@
 import pytest
-from database import clear_database
+from database import clear_database, get_user, get_users, get_user_by_email, get_user_profiles, update_user, get_channel, \
+    get_user_channel_ids, allocate_id, allocate_ids
 from error import InputError
 from auth import auth_register, auth_login
 from channels import channels_create, channels_listall
-from channel import channel_details
+from channel import channel_details, channel_join, channel_leave
 
 
 def test_database_clear():
@@ -35,4 +36,69 @@ def test_database_clear():
     with pytest.raises(InputError):
         auth_login("whaa@gmail.com", "nostress")
 
-test_database_clear()
\ No newline at end of file
+test_database_clear()
+
+def test_database_user_indexes():
+    clear_database()
+    user = auth_register("hello@gmail.com", "veryverysafe", "safety", "first")
+
+    assert get_user(user['u_id'])['email'] == "hello@gmail.com"
+    assert get_user_by_email("hello@gmail.com")['id'] == user['u_id']
+    assert get_user(-1) is None
+    assert get_user_by_email("nobody@gmail.com") is None
+
+def test_database_user_channels_index():
+    clear_database()
+    usera = auth_register("hello@gmail.com", "veryverysafe", "safety", "first")
+    userb = auth_register("whaa@gmail.com", "nostress", "safety", "second")
+    channel_id = channels_create(usera['token'], "first_channel", is_public=True)['channel_id']
+
+    assert get_channel(channel_id)['name'] == "first_channel"
+    assert get_user_channel_ids(usera['u_id']) == {channel_id}
+    assert get_user_channel_ids(userb['u_id']) == set()
+
+    channel_join(userb['token'], channel_id)
+    assert get_user_channel_ids(userb['u_id']) == {channel_id}
+
+    channel_leave(userb['token'], channel_id)
+    assert get_user_channel_ids(userb['u_id']) == set()
+
+    clear_database()
+    assert get_channel(channel_id) is None
+    assert get_user_channel_ids(usera['u_id']) == set()
+
+def test_database_email_index_is_normalised():
+    clear_database()
+    user = auth_register("hello@gmail.com", "veryverysafe", "safety", "first")
+    assert get_user_by_email(" Hello@Gmail.com ")['id'] == user['u_id']
+
+def test_database_allocate_ids():
+    clear_database()
+    assert allocate_id('things') == 1
+    assert allocate_id('things') == 2
+    assert list(allocate_ids('things', 3)) == [3, 4, 5]
+    # each kind has its own sequence
+    assert allocate_id('other things') == 1
+
+    clear_database()
+    assert allocate_id('things') == 1
+
+def test_database_bulk_user_lookup():
+    clear_database()
+    usera = auth_register("hello@gmail.com", "veryverysafe", "safety", "first")
+    userb = auth_register("whaa@gmail.com", "nostress", "safety", "second")
+
+    users = get_users([userb['u_id'], usera['u_id']])
+    assert [user['email'] for user in users] == ["whaa@gmail.com", "hello@gmail.com"]
+    with pytest.raises(KeyError):
+        get_users([usera['u_id'], -1])
+
+def test_database_user_profiles_cache():
+    clear_database()
+    user = auth_register("hello@gmail.com", "veryverysafe", "safety", "first")
+    profile = {'u_id': user['u_id'], 'name_first': "safety", 'name_last': "first"}
+    assert get_user_profiles([user['u_id']]) == [profile]
+    assert get_user_profiles([user['u_id']]) == [profile]
+
+    update_user(user['u_id'], {'first_name': "changed"})
+    assert get_user_profiles([user['u_id']])[0]['name_first'] == "changed"
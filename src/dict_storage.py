@@ -0,0 +1,625 @@
+"""
+The default storage backend (see storage.py): everything lives in the
+database dict below, with secondary indexes so that every lookup is a dict or
+set access. persistence.py can keep it on disk.
+"""
+import time
+import heapq
+import secrets
+import threading
+from contextlib import contextmanager
+from storage import Storage, normalise_email, words_of
+from error import InputError
+
+database = {
+    # user id -> user
+    'users': {
+        # 1: {
+        #     "id": 1,
+        #     "email": "hayden@gmail.com",
+        #     # see password.py
+        #     "password": "pbkdf2_sha256$100000$<salt>$<hash>",
+        #     "first_name": "Hayden",
+        #     "last_name": "Everest",
+        # },
+    },
+    # channel id -> channel
+    'channels': {
+        # 1: {
+        #     "id": 1,
+        #     "name": "greatest_channel",
+        #     # set of the user ids of the owners
+        #     "owner_members_id": {1, 2, 3}
+        #     # set of the user ids of all the members (including the owners)
+        #     "all_members_id": {1, 2, 3, 5, 4, 9}
+        #     "is_public": True
+        #     # append only, oldest first. Removed messages are replaced
+        #     # with None so that the positions of the others don't change
+        #      "messages": [
+        #           {
+        #               "message_id": 1,
+        #               "u_id": 1,
+        #               "message": "Hello world",
+        #               "time_created": 1582426789,
+        #           },
+        #           None,
+        #       ],
+        #     # how many None are in messages
+        #     "removed_messages": 1,
+        # },
+    },
+    # secondary indexes, kept up to date by DictStorage. Don't write to them
+    # directly.
+    # normalised email -> user
+    'users_by_email': {},
+    # user id -> set of the ids of the channels the user is a member of
+    'user_channels': {},
+    # user id -> the user's public profile, a cache filled by
+    # get_user_profiles and emptied by update_user
+    'user_profiles': {},
+    # message id -> (channel id, position in the channel's messages), for the
+    # messages that aren't removed
+    'messages': {},
+    # channel id -> {message id: position} for the channel's removed
+    # messages, which are still places to page from (see is_channel_message).
+    # Kept for every channel, loaded or not.
+    'removed_positions': {},
+    # channel id -> how many messages aren't removed, as a Fenwick tree over
+    # the channel's messages (see live_counts_build), for the loaded
+    # channels that have removed messages. So a page can be found from how
+    # recent it is without going over the tombstones before it.
+    'live_messages': {},
+    # channel id -> [its messages, how many of them are tidied up], for the
+    # removed channels whose messages are still in 'messages' and
+    # 'search_index'. They are tidied up a batch at a time (see
+    # tidy_removed_channels), so removing a channel costs the same however
+    # many messages it had.
+    'removed_channels': {},
+    # word -> set of the ids of the messages containing it, see search_index.py
+    'search_index': {},
+    # token -> session, see session.py
+    'sessions': {
+        # 1: {
+        #     "token": 1,
+        #     "u_id": 1,
+        #     "time_created": 1582426789,
+        # },
+    },
+    # user id -> set of the user's active tokens
+    'user_sessions': {},
+    # user id -> the generation the user's tokens must have, see session.py
+    'token_generations': {},
+    # message id -> message waiting to be sent, see message_sendlater
+    'scheduled_messages': {
+        # 1: {
+        #     "message_id": 1,
+        #     "channel_id": 1,
+        #     "u_id": 1,
+        #     "message": "Hello later",
+        #     "time_sent": 1582426789,
+        # },
+    },
+    # kind ('users', ...) -> the next id to hand out, see allocate_ids
+    'next_ids': {},
+    # 'channel:1', 'user:1', ... -> how many times it changed, see
+    # response_cache.py. Not journaled, a restart picks a new epoch instead.
+    'versions': {
+        'epoch': secrets.randbits(32),
+    },
+}
+
+# how many messages of removed channels a change tidies up, see
+# tidy_removed_channels
+TIDY_BATCH_SIZE = 64
+
+# allocate_ids hands out each id once, even to threads asking at the same time
+ids_lock = threading.Lock()
+# see tidy_removed_channels
+removed_lock = threading.Lock()
+# see get_channel_messages
+load_lock = threading.RLock()
+# bump_versions' increments, threads holding different channels' locks bump
+# the same 'channels' version
+versions_lock = threading.Lock()
+# remove_session, so only one of two threads logging out the same token
+# removes it
+sessions_lock = threading.Lock()
+
+# persistence.py sets 'record' to a function that logs every change made
+# through DictStorage, so they can be replayed after a restart. That's why
+# the rest of the code must never modify the database directly. While it is
+# set, each change is logged and made while holding 'lock', so persistence.py
+# can take a snapshot that has exactly the changes logged so far by taking
+# it too.
+journal = {
+    'record': None,
+    'lock': threading.RLock(),
+}
+
+# persistence.py can load a snapshot without reading the channels' messages
+# yet. Those channels have None as their messages until get_channel_messages
+# is called for them, which loads them with 'load'. 'locate' finds which
+# channel a message that isn't loaded yet is in, and 'forget' drops the
+# messages of a channel removed before they were loaded. All three are only
+# called while holding load_lock, readers of the same channel may come
+# across it at once.
+lazy_messages = {
+    'load': None,
+    'locate': None,
+    'forget': None,
+}
+
+@contextmanager
+def recorded(operation, *args):
+    """ Wraps every change the helpers make, logs it before it is made """
+    if journal['record'] is None:
+        yield
+        return
+    with journal['lock']:
+        # persistence may have been closed while we waited
+        if journal['record'] is not None:
+            journal['record'](operation, args)
+        yield
+
+
+# Messages that aren't loaded yet, used by snapshot.py and DictStorage
+
+def get_channel_messages(channel):
+    """ The channel's messages, oldest first, with None for removed ones """
+    if channel['messages'] is None:
+        with load_lock:
+            # unless another reader loaded them while we waited
+            if channel['messages'] is None:
+                lazy_messages['load'](channel)
+    return channel['messages']
+
+def index_messages(channel, messages):
+    """ Indexes messages, the channel's (or about to be, see snapshot.load_messages) """
+    for position, message in enumerate(messages):
+        if message is not None:
+            database['messages'][message['message_id']] = (channel['id'], position)
+    if channel['removed_messages']:
+        database['live_messages'][channel['id']] = live_counts_build(messages)
+
+def locate_message(message_id):
+    """ Returns (channel id, position in its messages), or None """
+    location = database['messages'].get(message_id)
+    if location is not None and location[0] in database['removed_channels']:
+        # not tidied up yet
+        return None
+    if location is None and lazy_messages['locate'] is not None:
+        with load_lock:
+            if lazy_messages['locate'] is not None:
+                channel = database['channels'].get(lazy_messages['locate'](message_id))
+                if channel is not None and channel['messages'] is None:
+                    lazy_messages['load'](channel)
+        location = database['messages'].get(message_id)
+    return location
+
+def tidy_removed_channels(limit=TIDY_BATCH_SIZE):
+    """
+    Drops up to limit messages of removed channels from 'messages' and the
+    search index. remove_channel and add_message call it, so the removed
+    channels' messages are gone soon after, however many there were.
+    """
+    # changes to different channels may call it at once
+    with removed_lock:
+        removed_channels = database['removed_channels']
+        while limit > 0 and removed_channels:
+            channel_id, tidying = next(iter(removed_channels.items()))
+            messages, position = tidying
+            end = min(position + limit, len(messages))
+            for message in messages[position:end]:
+                if message is not None:
+                    del database['messages'][message['message_id']]
+                    unindex_message(message['message_id'], words_of(message['message']))
+            limit -= end - position
+            if end == len(messages):
+                del removed_channels[channel_id]
+            else:
+                tidying[1] = end
+
+def unindex_message(message_id, words):
+    for word in words:
+        postings = database['search_index'].get(word)
+        if postings is None:
+            continue
+        postings.discard(message_id)
+        if not postings:
+            del database['search_index'][word]
+
+def channel_message_position(channel, message_id):
+    """ Where the message is in the channel's messages, even if removed, or None """
+    try:
+        position = database['removed_positions'].get(channel['id'], {}).get(message_id)
+    except TypeError:
+        # unhashable ids can't be a message's
+        return None
+    if position is not None:
+        return position
+    location = locate_message(message_id)
+    if location is None or location[0] != channel['id']:
+        return None
+    return location[1]
+
+def live_position(channel, offset):
+    """ The position in the channel's messages of the offset'th message that isn't removed """
+    live = database['live_messages'].get(channel['id'])
+    return offset if live is None else live_counts_find(live, offset)
+
+def live_count(channel, position):
+    """ How many of the channel's messages before position aren't removed """
+    live = database['live_messages'].get(channel['id'])
+    return position if live is None else live_counts_prefix(live, position)
+
+
+# Fenwick trees counting the messages that aren't removed. tree[i] (from 1)
+# is how many there are in positions [i - lowbit(i), i), so counting up to
+# a position, finding a message by its count, appending and removing all
+# take O(log n).
+
+def live_counts_build(messages):
+    tree = [0] + [0 if message is None else 1 for message in messages]
+    for i in range(1, len(tree)):
+        parent = i + (i & -i)
+        if parent < len(tree):
+            tree[parent] += tree[i]
+    return tree
+
+def live_counts_append(tree, value):
+    i = len(tree)
+    # the sum of [i - lowbit(i), i - 1) is a difference of two prefixes
+    tree.append(value + live_counts_prefix(tree, i - 1) - live_counts_prefix(tree, i - (i & -i)))
+
+def live_counts_add(tree, position, value):
+    i = position + 1
+    while i < len(tree):
+        tree[i] += value
+        i += i & -i
+
+def live_counts_prefix(tree, position):
+    total = 0
+    i = position
+    while i > 0:
+        total += tree[i]
+        i -= i & -i
+    return total
+
+def live_counts_find(tree, offset):
+    """ The position with offset live ones before it that is live itself """
+    i = 0
+    step = 1 << (len(tree) - 1).bit_length()
+    while step:
+        if i + step < len(tree) and tree[i + step] <= offset:
+            i += step
+            offset -= tree[i]
+        step >>= 1
+    return i
+
+class DictStorage(Storage):
+    def clear(self):
+        with recorded('clear_database'):
+            lazy_messages['load'] = None
+            lazy_messages['locate'] = None
+            lazy_messages['forget'] = None
+            for value in database.values():
+                value.clear()
+            database['versions']['epoch'] = secrets.randbits(32)
+
+    def allocate_ids(self, kind, count=1):
+        # not one of locks.py's, its callers may already hold those
+        with ids_lock:
+            with recorded('allocate_ids', kind, count):
+                first = database['next_ids'].get(kind, 1)
+                database['next_ids'][kind] = first + count
+        return range(first, first + count)
+
+    # Users
+
+    def add_user(self, user):
+        self.add_users([user])
+
+    def add_users(self, users):
+        # the callers hold the emails' locks (see locks.email_key), so none
+        # of them can be taken between checking and adding
+        emails = [normalise_email(user['email']) for user in users]
+        if len(set(emails)) < len(emails) or any(email in database['users_by_email'] for email in emails):
+            raise InputError("Email has been used.")
+        for user, email in zip(users, emails):
+            with recorded('add_user', user):
+                database['users'][user['id']] = user
+                database['users_by_email'][email] = user
+                database['user_channels'][user['id']] = set()
+
+    def get_user(self, u_id):
+        return database['users'].get(u_id)
+
+    def get_users(self, u_ids):
+        users = database['users']
+        return [users[u_id] for u_id in u_ids]
+
+    def get_user_profiles(self, u_ids):
+        profiles = database['user_profiles']
+        result = []
+        for u_id in u_ids:
+            profile = profiles.get(u_id)
+            if profile is None:
+                user = database['users'][u_id]
+                profile = profiles[u_id] = {
+                    'u_id': user['id'],
+                    'name_first': user['first_name'],
+                    'name_last': user['last_name'],
+                }
+            result.append(profile)
+        return result
+
+    def update_user(self, u_id, changes):
+        with recorded('update_user', u_id, changes):
+            user = database['users'][u_id]
+            # replaced rather than changed, a snapshot being saved may have
+            # the old one (see snapshot.snapshot_take)
+            updated = database['users'][u_id] = {**user, **changes}
+            del database['users_by_email'][normalise_email(user['email'])]
+            database['users_by_email'][normalise_email(updated['email'])] = updated
+            database['user_profiles'].pop(u_id, None)
+
+    def get_user_by_email(self, email):
+        return database['users_by_email'].get(normalise_email(email))
+
+    # Channels
+
+    def add_channel(self, channel):
+        with recorded('add_channel', channel):
+            database['channels'][channel['id']] = channel
+            for u_id in channel['all_members_id']:
+                database['user_channels'][u_id].add(channel['id'])
+            if channel['messages'] is not None:
+                index_messages(channel, channel['messages'])
+
+    def get_channel(self, channel_id):
+        try:
+            return database['channels'].get(channel_id)
+        except TypeError:
+            # unhashable ids can't be a channel's
+            return None
+
+    def get_channels(self):
+        # a copy, so it can be gone through while channels are created
+        return list(database['channels'].values())
+
+    def remove_channel(self, channel_id):
+        with recorded('remove_channel', channel_id):
+            channel = database['channels'].pop(channel_id, None)
+            if channel is None:
+                return
+            for u_id in channel['all_members_id']:
+                database['user_channels'][u_id].discard(channel_id)
+            # so it can't be being loaded right now
+            with load_lock:
+                if channel['messages'] is None:
+                    # never loaded, so none of them are in 'messages'
+                    lazy_messages['forget'](channel)
+                elif len(channel['messages']) > channel['removed_messages']:
+                    database['removed_channels'][channel_id] = [channel['messages'], 0]
+            database['live_messages'].pop(channel_id, None)
+            database['removed_positions'].pop(channel_id, None)
+        tidy_removed_channels()
+
+    def add_channel_member(self, channel, u_id):
+        with recorded('add_channel_member', channel['id'], u_id):
+            channel['all_members_id'].add(u_id)
+            database['user_channels'][u_id].add(channel['id'])
+
+    def remove_channel_member(self, channel, u_id):
+        with recorded('remove_channel_member', channel['id'], u_id):
+            channel['all_members_id'].discard(u_id)
+            database['user_channels'][u_id].discard(channel['id'])
+
+    def add_channel_owner(self, channel, u_id):
+        with recorded('add_channel_owner', channel['id'], u_id):
+            channel['owner_members_id'].add(u_id)
+
+    def remove_channel_owner(self, channel, u_id):
+        with recorded('remove_channel_owner', channel['id'], u_id):
+            channel['owner_members_id'].discard(u_id)
+
+    def is_channel_member(self, channel, u_id):
+        return u_id in channel['all_members_id']
+
+    def is_channel_owner(self, channel, u_id):
+        return u_id in channel['owner_members_id']
+
+    def get_channel_member_ids(self, channel):
+        return channel['all_members_id']
+
+    def get_channel_owner_ids(self, channel):
+        return channel['owner_members_id']
+
+    def get_channel_members_after(self, channel, u_id, limit):
+        return heapq.nsmallest(limit, (member for member in channel['all_members_id'] if member > u_id))
+
+    def get_user_channel_ids(self, u_id):
+        return database['user_channels'].get(u_id, set())
+
+    # Messages
+
+    def add_message(self, channel, message):
+        with recorded('add_message', channel['id'], message):
+            messages = get_channel_messages(channel)
+            database['messages'][message['message_id']] = (channel['id'], len(messages))
+            messages.append(message)
+            live = database['live_messages'].get(channel['id'])
+            if live is not None:
+                live_counts_append(live, 1)
+        tidy_removed_channels()
+
+    def get_message(self, message_id):
+        location = locate_message(message_id)
+        if location is None:
+            return None, None
+        channel_id, position = location
+        channel = database['channels'][channel_id]
+        # through get_channel_messages, in case it is still being loaded
+        return channel, get_channel_messages(channel)[position]
+
+    def get_message_channel_id(self, message_id):
+        location = locate_message(message_id)
+        return None if location is None else location[0]
+
+    def get_messages_sent(self, message_ids):
+        sent = []
+        for message_id in message_ids:
+            location = locate_message(message_id)
+            if location is None:
+                continue
+            channel = database['channels'].get(location[0])
+            # the channel or the message may be going while we look
+            message = None if channel is None else get_channel_messages(channel)[location[1]]
+            if message is not None:
+                sent.append((message['time_created'], message_id, channel['id']))
+        return sent
+
+    def edit_message(self, message_id, text):
+        with recorded('edit_message', message_id, text):
+            channel_id, position = locate_message(message_id)
+            messages = get_channel_messages(database['channels'][channel_id])
+            # replaced like users are, see update_user
+            messages[position] = {**messages[position], 'message': text}
+
+    def remove_message(self, message_id):
+        with recorded('remove_message', message_id):
+            channel_id, position = database['messages'].pop(message_id)
+            database['removed_positions'].setdefault(channel_id, {})[message_id] = position
+            channel = database['channels'][channel_id]
+            get_channel_messages(channel)[position] = None
+            channel['removed_messages'] += 1
+            live = database['live_messages'].get(channel_id)
+            if live is None:
+                # the channel's first removal
+                database['live_messages'][channel_id] = live_counts_build(channel['messages'])
+            else:
+                live_counts_add(live, position, -1)
+
+    def is_channel_message(self, channel, message_id):
+        return channel_message_position(channel, message_id) is not None
+
+    def count_channel_messages(self, channel, before_message_id=None):
+        if before_message_id is None:
+            return len(get_channel_messages(channel)) - channel['removed_messages']
+        return live_count(channel, channel_message_position(channel, before_message_id))
+
+    def get_channel_messages_page(self, channel, start, count, before_message_id=None):
+        # how many messages there are up to the most recent one we can return
+        newest = self.count_channel_messages(channel, before_message_id)
+        messages = get_channel_messages(channel)
+        # find the page's messages only, rather than reversing or copying
+        # the channel's whole history, or going over its removed messages
+        return [messages[live_position(channel, offset)] for offset in range(newest - start - 1, max(newest - start - count, 0) - 1, -1)]
+
+    def get_all_messages(self):
+        self.load_all_messages()
+        for channel in database['channels'].values():
+            for message in channel['messages']:
+                if message is not None:
+                    yield message
+
+    def load_all_messages(self):
+        if lazy_messages['load'] is None:
+            return
+        for channel in self.get_channels():
+            get_channel_messages(channel)
+
+    def load_channels_messages(self, channel_ids):
+        if lazy_messages['load'] is None:
+            return
+        for channel_id in channel_ids:
+            channel = self.get_channel(channel_id)
+            if channel is not None:
+                get_channel_messages(channel)
+
+    # Sessions
+
+    def add_session(self, token, u_id):
+        with recorded('session_create', token, u_id):
+            database['sessions'][token] = {
+                'token': token,
+                'u_id': u_id,
+                'time_created': int(time.time()),
+            }
+            database['user_sessions'].setdefault(u_id, set()).add(token)
+
+    def get_session(self, token):
+        try:
+            return database['sessions'].get(token)
+        except TypeError:
+            # unhashable tokens can't be active
+            return None
+
+    def remove_session(self, token):
+        with sessions_lock:
+            if self.get_session(token) is None:
+                return False
+            with recorded('session_revoke', token):
+                session = database['sessions'].pop(token, None)
+                database['user_sessions'][session['u_id']].discard(token)
+        return session is not None
+
+    def get_user_token(self, u_id):
+        return next(iter(database['user_sessions'].get(u_id, ())), None)
+
+    def get_token_generation(self, u_id):
+        return database['token_generations'].get(u_id)
+
+    def set_token_generation(self, u_id, generation):
+        with recorded('set_token_generation', u_id, generation):
+            database['token_generations'][u_id] = generation
+
+    # Search
+
+    def index_words(self, message_id, words):
+        for word in words:
+            database['search_index'].setdefault(word, set()).add(message_id)
+
+    def unindex_words(self, message_id, words):
+        unindex_message(message_id, words)
+
+    def find_words(self, words):
+        postings = sorted((database['search_index'].get(word, set()) for word in words), key=len)
+        # start from the rarest word, so the intersection stays small
+        found = postings[0].intersection(*postings[1:])
+        # leaving out the messages of removed channels that aren't tidied up yet
+        return {message_id for message_id in found if locate_message(message_id) is not None}
+
+    # Scheduled messages
+
+    def add_scheduled_message(self, message):
+        with recorded('add_scheduled_message', message):
+            database['scheduled_messages'][message['message_id']] = message
+
+    def get_scheduled_message(self, message_id):
+        try:
+            return database['scheduled_messages'].get(message_id)
+        except TypeError:
+            return None
+
+    def get_scheduled_messages(self):
+        return list(database['scheduled_messages'].values())
+
+    def remove_scheduled_message(self, message_id):
+        # pop is atomic, two threads can't both get the message
+        if self.get_scheduled_message(message_id) is None:
+            return False
+        with recorded('remove_scheduled_message', message_id):
+            return database['scheduled_messages'].pop(message_id, None) is not None
+
+    # Versions
+
+    def bump_versions(self, keys):
+        versions = database['versions']
+        with versions_lock:
+            for key in keys:
+                versions[key] = versions.get(key, 0) + 1
+
+    def get_versions(self, keys):
+        versions = database['versions']
+        return tuple(versions.get(key, 0) for key in keys)
@@ -0,0 +1,65 @@
+"""
+Reading the parameters of a request, shared by every route. data is the
+query string of a GET (where every value is a string) or the JSON body of
+the other methods.
+"""
+import math
+from error import InputError, AccessError
+
+def param(data, name):
+    if name not in data:
+        raise InputError(f"{name} is missing")
+    return data[name]
+
+def str_param(data, name):
+    value = param(data, name)
+    if not isinstance(value, str):
+        raise InputError(f"{name} must be a string, got {value!r}")
+    return value
+
+def token_param(data):
+    token = data.get('token')
+    if not isinstance(token, str) or token == '':
+        raise AccessError("token is missing")
+    return token
+
+def int_param(data, name, default=None):
+    """ Accepts an int, or a string of one (from a query string) """
+    if name not in data and default is not None:
+        return default
+    value = param(data, name)
+    # True is an int too, but it isn't an id
+    if isinstance(value, bool):
+        raise InputError(f"{name} must be an integer, got {value!r}")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise InputError(f"{name} must be an integer, got {value!r}") from None
+
+def float_param(data, name):
+    """ Accepts a number, or a string of one (from a query string), but not inf or nan """
+    value = param(data, name)
+    if isinstance(value, bool):
+        raise InputError(f"{name} must be a number, got {value!r}")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise InputError(f"{name} must be a number, got {value!r}") from None
+    if not math.isfinite(number):
+        raise InputError(f"{name} must be a number, got {value!r}")
+    return number
+
+def channel_id_param(data):
+    return int_param(data, 'channel_id')
+
+def u_id_param(data):
+    return int_param(data, 'u_id')
+
+def bool_param(data, name):
+    """ Accepts a bool, or 'true'/'false' (from a query string) """
+    value = param(data, name)
+    if isinstance(value, str) and value.lower() in ('true', 'false'):
+        return value.lower() == 'true'
+    if not isinstance(value, bool):
+        raise InputError(f"{name} must be true or false, got {value!r}")
+    return value
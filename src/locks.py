@@ -0,0 +1,50 @@
+"""
+Locks for the functions that look at a channel or a user and then change
+it, now that several requests are served at once (see serve.py). Without
+them two requests can both pass a check before either makes its change, and
+a channel's member set can change while another request iterates over it.
+
+Each channel and user has its own lock, so requests about different
+channels never wait for each other. Rather than creating (and forgetting) a
+lock for every channel and user, keys are spread over a fixed number of
+stripes, and two keys sharing one only means they wait for each other
+sometimes.
+
+    with locked(channel_key(channel_id), user_key(u_id)):
+        ...
+
+locked takes all of its locks at once, always in the same order, so two
+requests can't each be holding a lock the other is waiting for. Inside a
+locked block only take the same keys again (the locks are reentrant), not
+new ones, or that guarantee is lost.
+
+These locks only cover the threads of one process. The worker processes of
+serve.py's prefork mode each have their own.
+"""
+import threading
+from contextlib import contextmanager
+
+STRIPES = 1024
+
+stripes = [threading.RLock() for _ in range(STRIPES)]
+
+def channel_key(channel_id):
+    return ('channel', channel_id)
+
+def user_key(u_id):
+    return ('user', u_id)
+
+def email_key(email):
+    """ For making sure two users can't take the same (normalised) email at once """
+    return ('email', email)
+
+@contextmanager
+def locked(*keys):
+    indexes = sorted({hash(key) % STRIPES for key in keys})
+    for index in indexes:
+        stripes[index].acquire()
+    try:
+        yield
+    finally:
+        for index in reversed(indexes):
+            stripes[index].release()
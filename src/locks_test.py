@@ -0,0 +1,137 @@
+import sys
+import threading
+import pytest
+from auth import auth_register
+from channel import channel_invite, channel_details, channel_messages, channel_leave, channel_join, \
+    channel_addowner, channel_removeowner
+from channels import channels_create, channels_list
+from message import message_send, message_remove
+from other import search
+from database import clear_database, get_channel, get_channel_member_ids, get_user_channel_ids
+from error import InputError, AccessError
+
+THREADS = 8
+ROUNDS = 200
+
+@pytest.fixture(autouse=True)
+def switch_often():
+    # switch threads far more often than usual, so races show up
+    clear_database()
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+    clear_database()
+
+def run_threads(target, count=THREADS):
+    """ Runs target(i) on count threads at once, re-raises the first error """
+    errors = []
+    start = threading.Barrier(count)
+
+    def run(i):
+        start.wait()
+        try:
+            target(i)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+def test_locks_join_leave_addowner():
+    owner = auth_register("owner@gmail.com", "averylongpassword", "Owner", "User")
+    users = [auth_register(f"user{i}@gmail.com", "averylongpassword", "User", str(i)) for i in range(THREADS)]
+    channel_id = channels_create(owner['token'], "busy", is_public=True)['channel_id']
+    other_id = channels_create(owner['token'], "quiet", is_public=True)['channel_id']
+
+    def hammer(i):
+        user = users[i]
+        for round in range(ROUNDS):
+            channel_join(user['token'], channel_id)
+            if round % 3 == 0:
+                try:
+                    channel_addowner(owner['token'], channel_id, user['u_id'])
+                except InputError:
+                    # already an owner from an earlier round
+                    pass
+            channel_details(user['token'], channel_id)
+            channels_list(user['token'])
+            if round % 2 == 0:
+                channel_invite(owner['token'], other_id, user['u_id'])
+            channel_leave(user['token'], channel_id)
+        channel_join(user['token'], channel_id)
+
+    def watch(i):
+        # the owner never leaves, so can read the details throughout
+        for _ in range(ROUNDS):
+            channel_details(owner['token'], channel_id)
+
+    run_threads(lambda i: hammer(i) if i < THREADS else watch(i), THREADS + 2)
+
+    details = channel_details(owner['token'], channel_id)
+    assert sorted(member['u_id'] for member in details['all_members']) == [owner['u_id']] + [user['u_id'] for user in users]
+    for user in users:
+        assert get_user_channel_ids(user['u_id']) == {channel_id, other_id}
+
+def test_locks_removeowner_keeps_an_owner():
+    owners = [auth_register(f"user{i}@gmail.com", "averylongpassword", "User", str(i)) for i in range(THREADS)]
+    channel_id = channels_create(owners[0]['token'], "owners", is_public=True)['channel_id']
+    for owner in owners[1:]:
+        channel_join(owner['token'], channel_id)
+        channel_addowner(owners[0]['token'], channel_id, owner['u_id'])
+
+    def remove_the_next_one(i):
+        try:
+            channel_removeowner(owners[i]['token'], channel_id, owners[(i + 1) % THREADS]['u_id'])
+        except (InputError, AccessError):
+            # an owner removed first can't remove anyone
+            pass
+
+    run_threads(remove_the_next_one)
+
+    owner_ids = {owner['u_id'] for owner in channel_details(owners[0]['token'], channel_id)['owner_members']}
+    assert owner_ids
+
+def test_locks_messages_and_registrations():
+    user = auth_register("user@gmail.com", "averylongpassword", "User", "Name")
+    channel_id = channels_create(user['token'], "chat", is_public=True)['channel_id']
+
+    sent = []
+    run_threads(lambda i: sent.extend(message_send(user['token'], channel_id, f"{i} {n}")['message_id'] for n in range(20)))
+    assert len(set(sent)) == THREADS * 20
+    assert channel_messages(user['token'], channel_id, 0)['end'] == 50
+    assert len(get_channel_member_ids(get_channel(channel_id))) == 1
+
+    registered = []
+    def register(i):
+        try:
+            registered.append(auth_register("same@gmail.com", "averylongpassword", "Same", str(i)))
+        except InputError:
+            pass
+
+    run_threads(register)
+    assert len(registered) == 1
+
+def test_locks_search_while_messages_change():
+    user = auth_register("user@gmail.com", "averylongpassword", "User", "Name")
+    channel_id = channels_create(user['token'], "chat", is_public=True)['channel_id']
+    for n in range(100):
+        message_send(user['token'], channel_id, f"hello {n}")
+
+    def change_or_search(i):
+        for n in range(ROUNDS):
+            if i == 0:
+                message_id = message_send(user['token'], channel_id, f"hello again {n}")['message_id']
+                if n % 2 == 0:
+                    message_remove(user['token'], message_id)
+                channel_messages(user['token'], channel_id, 0)
+            else:
+                messages = search(user['token'], "hello")['messages']
+                assert messages and all('hello' in message['message'] for message in messages)
+
+    run_threads(change_or_search, 4)
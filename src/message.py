@@ -1,12 +1,174 @@
+import math
+import time
+from database import get_channel, is_channel_member, is_channel_owner, add_message, get_message, \
+    get_message_channel_id, edit_message, remove_message, allocate_id, add_scheduled_message, \
+    get_scheduled_message, get_scheduled_messages, remove_scheduled_message
+from search_index import search_index_add, search_index_remove
+from channel_watch import channel_notify
+from scheduler import schedule_at, schedule_cancel
+from auth import auth_get_current_user_id_from_token
+from locks import locked, channel_key
+from error import InputError, AccessError
+
+MAX_MESSAGE_LENGTH = 1000
+
+# message id -> the scheduler's job sending it, for the messages
+# message_sendlater scheduled in this process
+sendlater_jobs = {}
+
 def message_send(token, channel_id, message):
+    u_id = auth_get_current_user_id_from_token(token)
+
+    return {
+        'message_id': send_message(u_id, channel_id, message),
+    }
+
+def message_sendlater(token, channel_id, message, time_sent):
+    """
+    Sends the message at time_sent (a unix timestamp), its id is returned
+    straight away. The message is checked now like message_send checks it,
+    and again when it is sent: if the user has left the channel by then, it
+    is dropped. Messages waiting to be sent are kept with the rest of the
+    data, so they are still sent after a restart.
+    """
+    u_id = auth_get_current_user_id_from_token(token)
+    sendable_channel(u_id, channel_id, message)
+
+    if time_sent < time.time():
+        raise InputError(f"{time_sent} is in the past")
+
+    scheduled = {
+        'message_id': allocate_id('messages'),
+        'channel_id': channel_id,
+        'u_id': u_id,
+        'message': message,
+        # never early
+        'time_sent': math.ceil(time_sent),
+    }
+    add_scheduled_message(scheduled)
+    schedule_delivery(scheduled)
+
+    return {
+        'message_id': scheduled['message_id'],
+    }
+
+def message_sendlater_cancel(token, message_id):
+    """ Stops a message from message_sendlater being sent, only its sender can """
+    u_id = auth_get_current_user_id_from_token(token)
+
+    scheduled = get_scheduled_message(message_id)
+    if scheduled is None:
+        raise InputError(f"Message {message_id} isn't waiting to be sent")
+
+    if scheduled['u_id'] != u_id:
+        raise AccessError(f"user {u_id} can't cancel message {message_id}")
+
+    if not remove_scheduled_message(message_id):
+        raise InputError(f"Message {message_id} has just been sent")
+
+    job = sendlater_jobs.pop(message_id, None)
+    if job is not None:
+        schedule_cancel(job)
+
     return {
-        'message_id': 1,
     }
 
+def message_sendlater_resume():
+    """ Schedules the messages that were waiting to be sent when the server stopped """
+    for scheduled in get_scheduled_messages():
+        schedule_delivery(scheduled)
+
 def message_remove(token, message_id):
+    u_id = auth_get_current_user_id_from_token(token)
+    with locked(channel_key(get_message_channel_id(message_id))):
+        target_message = find_editable_message(u_id, message_id)
+
+        search_index_remove(target_message)
+        remove_message(message_id)
+
     return {
     }
 
 def message_edit(token, message_id, message):
+    u_id = auth_get_current_user_id_from_token(token)
+    with locked(channel_key(get_message_channel_id(message_id))):
+        target_message = find_editable_message(u_id, message_id)
+
+        search_index_remove(target_message)
+        if message == "":
+            remove_message(message_id)
+        else:
+            edit_message(message_id, message)
+            search_index_add({**target_message, 'message': message})
+
     return {
-    }
\ No newline at end of file
+    }
+
+# helpers
+def send_message(u_id, channel_id, message, message_id=None, time_created=None, max_length=MAX_MESSAGE_LENGTH):
+    """
+    Sends the message as the user and returns its id. message_sendlater's
+    messages already have an id, and are sent as of when they were due.
+    A standup's summary has no max_length (None).
+    """
+    with locked(channel_key(channel_id)):
+        channel = sendable_channel(u_id, channel_id, message, max_length)
+
+        new_message = {
+            'message_id': allocate_id('messages') if message_id is None else message_id,
+            'u_id': u_id,
+            'message': message,
+            'time_created': int(time.time()) if time_created is None else time_created,
+        }
+        add_message(channel, new_message)
+        search_index_add(new_message)
+    channel_notify(channel_id)
+
+    return new_message['message_id']
+
+def sendable_channel(u_id, channel_id, message, max_length=MAX_MESSAGE_LENGTH):
+    """ The channel, if the user may send the message to it """
+    channel = get_channel(channel_id)
+    if channel is None:
+        raise InputError(f"{channel_id} is invalid channel")
+
+    if not is_channel_member(channel, u_id):
+        raise AccessError(f"user {u_id} has not joined channel {channel_id}")
+
+    if max_length is not None and len(message) > max_length:
+        raise InputError(f"Message is more than {max_length} characters")
+
+    return channel
+
+def schedule_delivery(scheduled):
+    sendlater_jobs[scheduled['message_id']] = schedule_at(scheduled['time_sent'], deliver_later, scheduled)
+
+def deliver_later(scheduled):
+    """ Runs on the scheduler's thread when a message from message_sendlater is due """
+    message_id = scheduled['message_id']
+    sendlater_jobs.pop(message_id, None)
+
+    # whoever removes it sends it: after a restart, every worker process
+    # has it scheduled. Comparing makes sure it wasn't cleared, and its id
+    # given to another message, in the meantime.
+    if get_scheduled_message(message_id) != scheduled or not remove_scheduled_message(message_id):
+        return
+    try:
+        send_message(scheduled['u_id'], scheduled['channel_id'], scheduled['message'], message_id, scheduled['time_sent'])
+    except (InputError, AccessError):
+        # the user left the channel, or it was removed
+        pass
+
+def find_editable_message(u_id, message_id):
+    """
+    Returns the message if the user is allowed to change it, that is if they
+    sent it or own the channel it was sent to.
+    """
+    channel, message = get_message(message_id)
+    if message is None:
+        raise InputError(f"Message {message_id} no longer exists")
+
+    if message['u_id'] != u_id and not is_channel_owner(channel, u_id):
+        raise AccessError(f"user {u_id} can't change message {message_id}")
+
+    return message
@@ -0,0 +1,195 @@
+import time
+import pytest
+from message import message_send, message_remove, message_edit, message_sendlater, message_sendlater_cancel
+from channel import channel_messages, channel_join, channel_leave
+from scheduler import run_due
+from channels import channels_create
+from auth import auth_register
+from database import clear_database
+from other import search
+from error import InputError, AccessError
+
+def register_a_and_b():
+    """ Registers sample users """
+    paira = auth_register("email@a.com", "averylongpassword", "A", "LastA")
+    pairb = auth_register("email@b.com", "averylongpassword", "B", "LastB")
+    return paira, pairb
+
+def channel_message_texts(token, channel_id):
+    return [message['message'] for message in channel_messages(token, channel_id, 0)['messages']]
+
+# Tests for message_send
+def test_send_simple():
+    clear_database()
+    usera, _ = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    message_send(usera['token'], channel_id, 'hello')
+    assert channel_message_texts(usera['token'], channel_id) == ['hello']
+
+def test_send_unique_ids_across_channels():
+    clear_database()
+    usera, _ = register_a_and_b()
+    channela = channels_create(usera['token'], 'a', is_public=True)['channel_id']
+    channelb = channels_create(usera['token'], 'b', is_public=True)['channel_id']
+    ids = [
+        message_send(usera['token'], channela, 'hello')['message_id'],
+        message_send(usera['token'], channelb, 'hello')['message_id'],
+        message_send(usera['token'], channela, 'hello')['message_id'],
+    ]
+    assert len(set(ids)) == 3
+
+def test_send_too_long():
+    clear_database()
+    usera, _ = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    message_send(usera['token'], channel_id, 'a' * 1000)
+    with pytest.raises(InputError):
+        message_send(usera['token'], channel_id, 'a' * 1001)
+
+def test_send_not_member():
+    clear_database()
+    usera, userb = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    with pytest.raises(AccessError):
+        message_send(userb['token'], channel_id, 'hello')
+
+def test_send_invalid_channel():
+    clear_database()
+    usera, _ = register_a_and_b()
+    with pytest.raises(InputError):
+        message_send(usera['token'], 233, 'hello')
+
+def test_send_invalid_token():
+    clear_database()
+    with pytest.raises(AccessError):
+        message_send(-1, 0, 'hello')
+
+# Tests for message_remove
+def test_remove_own_message():
+    clear_database()
+    usera, userb = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    channel_join(userb['token'], channel_id)
+    message_id = message_send(userb['token'], channel_id, 'hello')['message_id']
+    message_send(userb['token'], channel_id, 'world')
+    message_remove(userb['token'], message_id)
+    assert channel_message_texts(usera['token'], channel_id) == ['world']
+
+def test_remove_by_channel_owner():
+    clear_database()
+    usera, userb = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    channel_join(userb['token'], channel_id)
+    message_id = message_send(userb['token'], channel_id, 'hello')['message_id']
+    message_remove(usera['token'], message_id)
+    assert channel_message_texts(usera['token'], channel_id) == []
+
+def test_remove_by_other_member():
+    clear_database()
+    usera, userb = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    channel_join(userb['token'], channel_id)
+    message_id = message_send(usera['token'], channel_id, 'hello')['message_id']
+    with pytest.raises(AccessError):
+        message_remove(userb['token'], message_id)
+
+def test_remove_twice():
+    clear_database()
+    usera, _ = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    message_id = message_send(usera['token'], channel_id, 'hello')['message_id']
+    message_remove(usera['token'], message_id)
+    with pytest.raises(InputError):
+        message_remove(usera['token'], message_id)
+
+# Tests for message_edit
+def test_edit_simple():
+    clear_database()
+    usera, _ = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    message_id = message_send(usera['token'], channel_id, 'hello')['message_id']
+    message_edit(usera['token'], message_id, 'goodbye')
+    assert channel_message_texts(usera['token'], channel_id) == ['goodbye']
+
+def test_edit_empty_removes():
+    clear_database()
+    usera, _ = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    message_id = message_send(usera['token'], channel_id, 'hello')['message_id']
+    message_edit(usera['token'], message_id, '')
+    assert channel_message_texts(usera['token'], channel_id) == []
+    with pytest.raises(InputError):
+        message_edit(usera['token'], message_id, 'hello again')
+
+def test_edit_by_other_member():
+    clear_database()
+    usera, userb = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    channel_join(userb['token'], channel_id)
+    message_id = message_send(usera['token'], channel_id, 'hello')['message_id']
+    with pytest.raises(AccessError):
+        message_edit(userb['token'], message_id, 'goodbye')
+
+# Tests for message_sendlater
+def test_sendlater():
+    clear_database()
+    usera, _ = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    later = time.time() + 3600
+    later_id = message_sendlater(usera['token'], channel_id, 'later', later)['message_id']
+    message_send(usera['token'], channel_id, 'now')
+    assert channel_message_texts(usera['token'], channel_id) == ['now']
+
+    run_due(later + 1)
+    messages = channel_messages(usera['token'], channel_id, 0)['messages']
+    # sent last, though its id was taken first
+    assert [message['message'] for message in messages] == ['later', 'now']
+    assert messages[0]['message_id'] == later_id
+    assert messages[0]['time_created'] >= later
+    # only sent once
+    run_due(later + 2)
+    assert channel_message_texts(usera['token'], channel_id) == ['later', 'now']
+    # search agrees on which is the most recent
+    message_edit(usera['token'], later_id, 'later word')
+    message_send(usera['token'], channel_id, 'now word')
+    assert [message['message'] for message in search(usera['token'], 'word')['messages']] == ['later word', 'now word']
+
+def test_sendlater_errors():
+    clear_database()
+    usera, userb = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    later = time.time() + 3600
+    with pytest.raises(InputError):
+        message_sendlater(usera['token'], channel_id, 'hello', time.time() - 10)
+    with pytest.raises(InputError):
+        message_sendlater(usera['token'], channel_id + 1, 'hello', later)
+    with pytest.raises(InputError):
+        message_sendlater(usera['token'], channel_id, 'a' * 1001, later)
+    with pytest.raises(AccessError):
+        message_sendlater(userb['token'], channel_id, 'hello', later)
+
+def test_sendlater_cancel():
+    clear_database()
+    usera, userb = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    channel_join(userb['token'], channel_id)
+    later = time.time() + 3600
+    message_id = message_sendlater(usera['token'], channel_id, 'never', later)['message_id']
+    with pytest.raises(AccessError):
+        message_sendlater_cancel(userb['token'], message_id)
+    assert message_sendlater_cancel(usera['token'], message_id) == {}
+    with pytest.raises(InputError):
+        message_sendlater_cancel(usera['token'], message_id)
+    run_due(later + 1)
+    assert channel_message_texts(usera['token'], channel_id) == []
+
+def test_sendlater_after_leaving():
+    clear_database()
+    usera, userb = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    channel_join(userb['token'], channel_id)
+    later = time.time() + 3600
+    message_sendlater(userb['token'], channel_id, 'dropped', later)
+    channel_leave(userb['token'], channel_id)
+    run_due(later + 1)
+    assert channel_message_texts(usera['token'], channel_id) == []
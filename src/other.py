@@ -1,4 +1,10 @@
-from database import clear_database
+import heapq
+from database import clear_database, get_user_channel_ids, get_message, get_messages_sent
+from auth import auth_get_current_user_id_from_token
+from search_index import search_index_query
+from locks import locked, channel_key
+
+SEARCH_RESULTS_LIMIT = 50
 
 def clear():
     clear_database()
@@ -20,13 +26,41 @@ def admin_userpermission_change(token, u_id, permission_id):
     pass
 
 def search(token, query_str):
+    """
+    Returns the messages, most recent first, containing every word of
+    query_str (ignoring case) from the channels the user has joined. At most
+    SEARCH_RESULTS_LIMIT messages are returned.
+    """
+    u_id = auth_get_current_user_id_from_token(token)
+    # a copy, the user may be joining or leaving channels while we search
+    channel_ids = frozenset(get_user_channel_ids(u_id))
+
+    # (time_created, message_id, channel_id), by when they were sent rather
+    # than by id, message_sendlater gives a message its id when it is
+    # scheduled. Only the results are read in full.
+    sent = get_messages_sent(search_index_query(query_str, channel_ids))
+    newest = heapq.nlargest(SEARCH_RESULTS_LIMIT, (entry for entry in sent if entry[2] in channel_ids))
     return {
-        'messages': [
-            {
-                'message_id': 1,
-                'u_id': 1,
-                'message': 'Hello world',
-                'time_created': 1582426789,
-            }
-        ],
-    }
\ No newline at end of file
+        'messages': read_messages(newest),
+    }
+
+# helper
+def read_messages(newest):
+    """
+    The messages of search's (time_created, message_id, channel_id) entries,
+    in the same order, read under their channels' locks (a channel's
+    messages may be changing while we read them). Leaves out the ones
+    removed since they were found.
+    """
+    by_channel = {}
+    for _, message_id, channel_id in newest:
+        by_channel.setdefault(channel_id, []).append(message_id)
+
+    messages = {}
+    for channel_id, channel_message_ids in by_channel.items():
+        with locked(channel_key(channel_id)):
+            for message_id in channel_message_ids:
+                message = get_message(message_id)[1]
+                if message is not None:
+                    messages[message_id] = message
+    return [messages[message_id] for _, message_id, _ in newest if message_id in messages]
@@ -0,0 +1,91 @@
+import pytest
+import other
+from other import search, SEARCH_RESULTS_LIMIT
+from message import message_send, message_edit, message_remove
+from channel import channel_join, channel_leave
+from channels import channels_create
+from auth import auth_register
+from database import clear_database
+from error import AccessError
+
+def register_a_and_b():
+    """ Registers sample users """
+    paira = auth_register("email@a.com", "averylongpassword", "A", "LastA")
+    pairb = auth_register("email@b.com", "averylongpassword", "B", "LastB")
+    return paira, pairb
+
+def search_texts(token, query_str):
+    return [message['message'] for message in search(token, query_str)['messages']]
+
+# Tests for search
+def test_search_simple():
+    clear_database()
+    usera, _ = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    message_send(usera['token'], channel_id, 'Hello world')
+    message_send(usera['token'], channel_id, 'goodbye world')
+    message_send(usera['token'], channel_id, 'something else')
+
+    assert search_texts(usera['token'], 'world') == ['goodbye world', 'Hello world']
+    assert search_texts(usera['token'], 'HELLO') == ['Hello world']
+    assert search_texts(usera['token'], 'world hello') == ['Hello world']
+    assert search_texts(usera['token'], 'nothing') == []
+    assert search_texts(usera['token'], '') == []
+
+def test_search_only_joined_channels():
+    clear_database()
+    usera, userb = register_a_and_b()
+    channela = channels_create(usera['token'], 'a', is_public=True)['channel_id']
+    channelb = channels_create(userb['token'], 'b', is_public=True)['channel_id']
+    message_send(usera['token'], channela, 'hello from a')
+    message_send(userb['token'], channelb, 'hello from b')
+
+    assert search_texts(usera['token'], 'hello') == ['hello from a']
+
+    channel_join(usera['token'], channelb)
+    assert search_texts(usera['token'], 'hello') == ['hello from b', 'hello from a']
+
+    channel_leave(usera['token'], channela)
+    assert search_texts(usera['token'], 'hello') == ['hello from b']
+
+def test_search_follows_edits_and_removals():
+    clear_database()
+    usera, _ = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    edited = message_send(usera['token'], channel_id, 'hello world')['message_id']
+    removed = message_send(usera['token'], channel_id, 'hello there')['message_id']
+
+    message_edit(usera['token'], edited, 'goodbye world')
+    message_remove(usera['token'], removed)
+
+    assert search_texts(usera['token'], 'hello') == []
+    assert search_texts(usera['token'], 'goodbye') == ['goodbye world']
+
+def test_search_limit():
+    clear_database()
+    usera, _ = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    for i in range(SEARCH_RESULTS_LIMIT + 10):
+        message_send(usera['token'], channel_id, f'message {i}')
+
+    texts = search_texts(usera['token'], 'message')
+    assert len(texts) == SEARCH_RESULTS_LIMIT
+    assert texts[0] == f'message {SEARCH_RESULTS_LIMIT + 9}'
+
+def test_search_reads_only_the_results(monkeypatch):
+    clear_database()
+    usera, _ = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    for i in range(SEARCH_RESULTS_LIMIT * 3):
+        message_send(usera['token'], channel_id, f'message {i}')
+
+    read = []
+    get_message = other.get_message
+    monkeypatch.setattr(other, 'get_message', lambda message_id: read.append(message_id) or get_message(message_id))
+    assert len(search_texts(usera['token'], 'message')) == SEARCH_RESULTS_LIMIT
+    assert len(read) == SEARCH_RESULTS_LIMIT
+
+def test_search_invalid_token():
+    clear_database()
+    with pytest.raises(AccessError):
+        search(-1, 'hello')
@@ -0,0 +1,67 @@
+"""
+Password hashing with PBKDF2-HMAC-SHA256.
+
+Hashes are stored as 'pbkdf2_sha256$<iterations>$<salt>$<hash>', so a stored
+hash always knows the cost it was made with. When the cost is changed with
+password_set_cost, old hashes keep verifying and auth_login upgrades them
+the next time their owner logs in (see password_needs_rehash).
+
+A good hash is slow on purpose. hashlib releases the GIL while it computes,
+so a login hashes on its own request thread without stopping other requests
+from being served. Bulk hashing (auth_register_bulk) runs on a pool of its
+own with at most half of the cores, so a big import can neither queue in
+front of logins nor take every core from them.
+"""
+import os
+import hashlib
+import hmac
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+
+ALGORITHM = 'pbkdf2_sha256'
+SALT_BYTES = 16
+
+password_config = {
+    'iterations': int(os.environ.get('FLOCKR_PASSWORD_ITERATIONS', 100_000)),
+}
+
+_bulk_workers = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('FLOCKR_PASSWORD_WORKERS', max(1, (os.cpu_count() or 1) // 2))),
+    thread_name_prefix='password',
+)
+
+def password_set_cost(iterations):
+    if iterations < 1:
+        raise ValueError(f"iterations must be positive, got {iterations}")
+    password_config['iterations'] = iterations
+
+def password_hash(password):
+    return _hash(password, password_config['iterations'])
+
+def password_hash_many(passwords):
+    """ Hashes all the passwords in parallel, returns the hashes in order """
+    iterations = password_config['iterations']
+    return list(_bulk_workers.map(lambda password: _hash(password, iterations), passwords))
+
+def password_verify(password, stored_hash):
+    return _verify(password, stored_hash)
+
+def password_needs_rehash(stored_hash):
+    """ True if the hash wasn't made with the current cost """
+    return _parse(stored_hash)[0] != password_config['iterations']
+
+def _hash(password, iterations, salt=None):
+    if salt is None:
+        salt = secrets.token_bytes(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f"{ALGORITHM}${iterations}${salt.hex()}${digest.hex()}"
+
+def _verify(password, stored_hash):
+    iterations, salt, _ = _parse(stored_hash)
+    return hmac.compare_digest(_hash(password, iterations, salt), stored_hash)
+
+def _parse(stored_hash):
+    algorithm, iterations, salt, digest = stored_hash.split('$')
+    if algorithm != ALGORITHM:
+        raise ValueError(f"unknown password hash algorithm {algorithm!r}")
+    return int(iterations), bytes.fromhex(salt), digest
@@ -0,0 +1,37 @@
+"""
+Microbenchmark: how many logins per second we can serve for a few password
+hashing costs, with logins coming from several threads at once (like a
+threaded server would).
+
+    python3 src/password_bench.py [iterations ...]
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from auth import auth_register, auth_login
+from database import clear_database
+from password import password_set_cost
+
+DEFAULT_COSTS = [10_000, 50_000, 100_000, 200_000]
+USERS = 8
+LOGINS = 64
+
+def bench_logins(iterations):
+    clear_database()
+    password_set_cost(iterations)
+    emails = [f"bench{i}@gmail.com" for i in range(USERS)]
+    for email in emails:
+        auth_register(email, 'benchpassword', 'Bench', 'User')
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=USERS) as clients:
+        list(clients.map(lambda i: auth_login(emails[i % USERS], 'benchpassword'), range(LOGINS)))
+    return LOGINS / (time.perf_counter() - start)
+
+def main(costs):
+    print(f"{'iterations':>10}  logins/sec")
+    for iterations in costs:
+        print(f"{iterations:>10}  {bench_logins(iterations):10.1f}")
+
+if __name__ == "__main__":
+    main([int(cost) for cost in sys.argv[1:]] or DEFAULT_COSTS)
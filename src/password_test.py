@@ -0,0 +1,66 @@
+import threading
+import pytest
+from password import password_hash, password_hash_many, password_verify, password_needs_rehash, password_set_cost, password_config, \
+    _bulk_workers
+from auth import auth_register, auth_login, auth_get_user_data_from_id
+from database import clear_database
+
+@pytest.fixture
+def cheap_cost():
+    old_iterations = password_config['iterations']
+    password_set_cost(1000)
+    yield
+    password_set_cost(old_iterations)
+
+def test_password_hash_verify(cheap_cost):
+    stored = password_hash('123abc!@#')
+    assert '123abc!@#' not in stored
+    assert password_verify('123abc!@#', stored)
+    assert not password_verify('123abc!@', stored)
+
+def test_password_hash_is_salted(cheap_cost):
+    assert password_hash('123abc!@#') != password_hash('123abc!@#')
+
+def test_password_hash_many(cheap_cost):
+    hashes = password_hash_many(['first password', 'second password'])
+    assert password_verify('first password', hashes[0])
+    assert password_verify('second password', hashes[1])
+
+def test_password_verify_not_queued_behind_bulk(cheap_cost):
+    stored = password_hash('123abc!@#')
+    # every bulk worker busy, and a big import queued behind them
+    release = threading.Event()
+    busy = [_bulk_workers.submit(release.wait) for _ in range(_bulk_workers._max_workers)]
+    bulk = threading.Thread(target=password_hash_many, args=(['password'] * 100,))
+    bulk.start()
+    try:
+        assert password_verify('123abc!@#', stored)
+        assert password_hash('123abc!@#')
+    finally:
+        release.set()
+        bulk.join()
+    assert all(job.result() for job in busy)
+
+def test_password_needs_rehash(cheap_cost):
+    stored = password_hash('123abc!@#')
+    assert not password_needs_rehash(stored)
+    password_set_cost(2000)
+    assert password_needs_rehash(stored)
+    # old hashes still verify
+    assert password_verify('123abc!@#', stored)
+
+def test_password_invalid_cost():
+    with pytest.raises(ValueError):
+        password_set_cost(0)
+
+def test_login_rehashes_password(cheap_cost):
+    clear_database()
+    user = auth_register('validemail@gmail.com', '123abc!@#', 'Hayden', 'Everest')
+    old_hash = auth_get_user_data_from_id(user['u_id'])['password']
+
+    password_set_cost(2000)
+    auth_login('validemail@gmail.com', '123abc!@#')
+    new_hash = auth_get_user_data_from_id(user['u_id'])['password']
+    assert new_hash != old_hash
+    assert not password_needs_rehash(new_hash)
+    assert auth_login('validemail@gmail.com', '123abc!@#')['u_id'] == user['u_id']
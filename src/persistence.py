@@ -0,0 +1,235 @@
+"""
+Keeps the database on disk, so that it survives the server restarting.
+
+Every change made through the helpers in database.py is appended to a
+write-ahead log (wal.log) as one JSON line. Calling fsync for every line
+would cap us at a few hundred writes a second, so lines are synced in groups:
+once SYNC_BATCH_SIZE of them are waiting, or every SYNC_INTERVAL seconds,
+whichever comes first. A crash can lose at most that last group.
+
+Every SNAPSHOT_EVERY records the whole database is written to a snapshot
+(see snapshot.py) and the log starts over, so on startup we load the
+snapshot and only replay the records written since. The change that
+triggers it only waits for the log to be moved aside (to wal.previous.log)
+and the database copied; a background thread writes the snapshot and then
+deletes the old log, while changes go on being logged to the new one.
+
+Persistence is off until persistence_open is called (see server.py), so the
+tests run purely in memory.
+"""
+import os
+import json
+import time
+import threading
+from database import database, journal, clear_database, allocate_ids, add_user, update_user, \
+    add_channel, get_channel, remove_channel, add_channel_member, remove_channel_member, \
+    add_channel_owner, remove_channel_owner, add_message, edit_message, remove_message, add_scheduled_message, \
+    remove_scheduled_message, set_token_generation
+from session import session_create, session_revoke
+from search_index import search_index_add
+from snapshot import snapshot_take, snapshot_save, snapshot_load, snapshot_release, channel_from_json
+
+SYNC_BATCH_SIZE = 128
+SYNC_INTERVAL = 0.05
+SNAPSHOT_EVERY = 100_000
+
+SNAPSHOT_FILE = 'snapshot.bin'
+WAL_FILE = 'wal.log'
+# the log being snapshotted, see start_snapshot
+PREVIOUS_WAL_FILE = 'wal.previous.log'
+
+persistence = {
+    'directory': None,
+    'wal': None,
+    # sequence number of the last record written, snapshots remember the
+    # last one they include
+    'seq': 0,
+    'unsynced': 0,
+    'records_since_snapshot': 0,
+    # the thread writing a snapshot, if one is
+    'snapshotting': None,
+    # held while a change is logged and made (see dict_storage.journal), so
+    # a snapshot never has half of one
+    'lock': journal['lock'],
+}
+
+# how to redo each operation recorded by database.py
+REPLAY = {
+    'clear_database': clear_database,
+    'allocate_ids': allocate_ids,
+    'add_user': add_user,
+    'update_user': update_user,
+    'add_channel': lambda channel: add_channel(channel_from_json(channel)),
+    'remove_channel': remove_channel,
+    'add_channel_member': lambda channel_id, u_id: add_channel_member(get_channel(channel_id), u_id),
+    'remove_channel_member': lambda channel_id, u_id: remove_channel_member(get_channel(channel_id), u_id),
+    'add_channel_owner': lambda channel_id, u_id: add_channel_owner(get_channel(channel_id), u_id),
+    'remove_channel_owner': lambda channel_id, u_id: remove_channel_owner(get_channel(channel_id), u_id),
+    'add_message': lambda channel_id, message: add_message(get_channel(channel_id), message),
+    'edit_message': edit_message,
+    'remove_message': remove_message,
+    'session_create': session_create,
+    'session_revoke': session_revoke,
+    'set_token_generation': set_token_generation,
+    'add_scheduled_message': add_scheduled_message,
+    'remove_scheduled_message': remove_scheduled_message,
+}
+
+def persistence_open(directory, snapshot_every=SNAPSHOT_EVERY):
+    """
+    Loads the database saved in directory (if there is one) and starts
+    logging every change to it.
+    """
+    os.makedirs(directory, exist_ok=True)
+    persistence['directory'] = directory
+    persistence['snapshot_every'] = snapshot_every
+
+    recover()
+
+    persistence['wal'] = open(os.path.join(directory, WAL_FILE), 'a')
+    journal['record'] = wal_append
+    threading.Thread(target=sync_periodically, daemon=True).start()
+
+def persistence_close():
+    wait_for_snapshot()
+    with persistence['lock']:
+        journal['record'] = None
+        if persistence['wal'] is not None:
+            sync()
+            persistence['wal'].close()
+            persistence['wal'] = None
+        snapshot_release()
+
+def persistence_sync():
+    """ Makes sure every change so far is on disk """
+    with persistence['lock']:
+        if persistence['wal'] is not None:
+            sync()
+
+def persistence_snapshot():
+    """ Takes a snapshot, returns once it is written """
+    while True:
+        wait_for_snapshot()
+        with persistence['lock']:
+            # unless a change started another one while we waited
+            if persistence['snapshotting'] is None:
+                writer = start_snapshot()
+                break
+    writer.join()
+
+def wal_append(operation, args):
+    with persistence['lock']:
+        # called with the lock already held by the change being logged, so
+        # every change logged so far is in the database and this one isn't
+        # yet
+        if persistence['records_since_snapshot'] >= persistence['snapshot_every'] and \
+                persistence['snapshotting'] is None:
+            start_snapshot()
+
+        persistence['seq'] += 1
+        persistence['wal'].write(to_json({'seq': persistence['seq'], 'op': operation, 'args': args}) + '\n')
+        persistence['unsynced'] += 1
+        persistence['records_since_snapshot'] += 1
+        if persistence['unsynced'] >= SYNC_BATCH_SIZE:
+            sync()
+
+def sync_periodically():
+    while persistence['wal'] is not None:
+        time.sleep(SYNC_INTERVAL)
+        persistence_sync()
+
+def sync():
+    if persistence['unsynced'] == 0:
+        return
+    persistence['wal'].flush()
+    os.fsync(persistence['wal'].fileno())
+    persistence['unsynced'] = 0
+
+def start_snapshot():
+    """
+    Starts a new, empty log and a thread that saves the whole database as
+    it is now. Called with the lock held, returns the thread.
+    """
+    directory = persistence['directory']
+    wal_path = os.path.join(directory, WAL_FILE)
+    previous_path = os.path.join(directory, PREVIOUS_WAL_FILE)
+    # if the last snapshot failed, its log is still there and this snapshot
+    # has to cover it too. Going on with the same log is fine: replaying
+    # skips the records a snapshot already has thanks to their sequence
+    # numbers, as it does if we crash before the old log is deleted.
+    if not os.path.exists(previous_path):
+        sync()
+        persistence['wal'].close()
+        os.replace(wal_path, previous_path)
+        persistence['wal'] = open(wal_path, 'w')
+    persistence['records_since_snapshot'] = 0
+
+    writer = threading.Thread(target=write_snapshot, args=(snapshot_take(persistence['seq']), previous_path),
+                              daemon=True)
+    persistence['snapshotting'] = writer
+    writer.start()
+    return writer
+
+def write_snapshot(taken, previous_path):
+    try:
+        path = os.path.join(persistence['directory'], SNAPSHOT_FILE)
+        snapshot_save(path + '.tmp', taken)
+        # rename is atomic, there is always a complete snapshot on disk
+        os.replace(path + '.tmp', path)
+        os.remove(previous_path)
+    finally:
+        # not under the lock, the changes being logged could keep it from
+        # us for a while
+        persistence['snapshotting'] = None
+
+def wait_for_snapshot():
+    writer = persistence['snapshotting']
+    if writer is not None:
+        writer.join()
+
+def recover():
+    journal['record'] = None
+    clear_database()
+
+    snapshot_seq = load_snapshot(os.path.join(persistence['directory'], SNAPSHOT_FILE))
+    # the log of a snapshot that didn't get written, then the newer one
+    seq = replay_wal(os.path.join(persistence['directory'], PREVIOUS_WAL_FILE), snapshot_seq)
+    persistence['seq'] = max(snapshot_seq, replay_wal(os.path.join(persistence['directory'], WAL_FILE), seq))
+
+    # the search index isn't saved, it's quicker to rebuild it. The
+    # channels still in the snapshot are indexed when they get loaded.
+    for channel in database['channels'].values():
+        for message in channel['messages'] or ():
+            if message is not None:
+                search_index_add(message)
+
+def load_snapshot(path):
+    """ Returns the sequence number of the last record in the snapshot """
+    if not os.path.exists(path):
+        return 0
+    return snapshot_load(path)
+
+def replay_wal(path, after_seq):
+    """ Redoes the logged changes newer than after_seq, returns the last seq """
+    seq = after_seq
+    if not os.path.exists(path):
+        return seq
+    with open(path, 'r+') as file:
+        good_length = 0
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # the server died half way through writing this line, and
+                # the change it described was never acknowledged
+                break
+            good_length += len(line.encode())
+            if entry['seq'] <= after_seq:
+                continue
+            REPLAY[entry['op']](*entry['args'])
+            seq = entry['seq']
+        file.truncate(good_length)
+    return seq
+
+def to_json(value):
+    return json.dumps(value, default=sorted, separators=(',', ':'))
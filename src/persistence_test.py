@@ -0,0 +1,302 @@
+import os
+import sys
+import time
+import threading
+import pytest
+import persistence
+from persistence import persistence_open, persistence_close, persistence_snapshot, wal_append, WAL_FILE, \
+    PREVIOUS_WAL_FILE
+from snapshot import snapshot_save
+from auth import auth_register, auth_login, auth_logout
+from channel import channel_join, channel_leave, channel_addowner, channel_removeowner, channel_details, \
+    channel_messages
+from channels import channels_create, channels_list
+from message import message_send, message_edit, message_remove, message_sendlater, message_sendlater_cancel, \
+    message_sendlater_resume
+from scheduler import run_due
+from other import search
+from database import clear_database, get_channel, journal
+from error import AccessError
+
+@pytest.fixture
+def data_dir(tmp_path):
+    clear_database()
+    yield str(tmp_path)
+    persistence_close()
+    clear_database()
+
+def restart(data_dir, **options):
+    persistence_close()
+    clear_database()
+    persistence_open(data_dir, **options)
+
+def populate():
+    usera = auth_register("email@a.com", "averylongpassword", "A", "LastA")
+    userb = auth_register("email@b.com", "averylongpassword", "B", "LastB")
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    channel_join(userb['token'], channel_id)
+    channel_addowner(usera['token'], channel_id, userb['u_id'])
+    first = message_send(usera['token'], channel_id, 'hello world')['message_id']
+    second = message_send(userb['token'], channel_id, 'hello there')['message_id']
+    message_edit(usera['token'], first, 'goodbye world')
+    message_remove(userb['token'], second)
+    message_send(userb['token'], channel_id, 'last one')
+    return usera, userb, channel_id
+
+def assert_populated(usera, userb, channel_id):
+    details = channel_details(usera['token'], channel_id)
+    assert {member['u_id'] for member in details['owner_members']} == {usera['u_id'], userb['u_id']}
+    messages = channel_messages(userb['token'], channel_id, 0)['messages']
+    assert [message['message'] for message in messages] == ['last one', 'goodbye world']
+    assert [message['message'] for message in search(usera['token'], 'world')['messages']] == ['goodbye world']
+    assert auth_login("email@b.com", "averylongpassword")['u_id'] == userb['u_id']
+
+def test_persistence_replays_log(data_dir):
+    persistence_open(data_dir)
+    usera, userb, channel_id = populate()
+    restart(data_dir)
+    assert_populated(usera, userb, channel_id)
+
+def test_persistence_from_snapshot_and_log(data_dir):
+    persistence_open(data_dir)
+    usera, userb, channel_id = populate()
+    persistence_snapshot()
+    channel_leave(userb['token'], channel_id)
+    restart(data_dir)
+
+    assert channels_list(userb['token']) == []
+    channel_join(userb['token'], channel_id)
+    assert_populated(usera, userb, channel_id)
+
+def test_persistence_keeps_removed_messages_places(data_dir):
+    persistence_open(data_dir)
+    user = auth_register("email@a.com", "averylongpassword", "A", "LastA")
+    channel_id = channels_create(user['token'], 'channel', is_public=True)['channel_id']
+    sent = [message_send(user['token'], channel_id, f"message {i}")['message_id'] for i in range(3)]
+    message_remove(user['token'], sent[1])
+    persistence_snapshot()
+    restart(data_dir)
+
+    # before the channel's messages are loaded
+    page = channel_messages(user['token'], channel_id, 0, sent[1])
+    assert [message['message_id'] for message in page['messages']] == sent[:1]
+
+def test_persistence_automatic_snapshots(data_dir):
+    persistence_open(data_dir, snapshot_every=5)
+    usera, userb, channel_id = populate()
+    restart(data_dir, snapshot_every=5)
+    assert_populated(usera, userb, channel_id)
+
+    # ids keep going up after a restart
+    other_channel_id = channels_create(usera['token'], 'other', is_public=True)['channel_id']
+    assert other_channel_id != channel_id
+
+def test_persistence_changes_dont_wait_for_snapshots(data_dir, monkeypatch):
+    persistence_open(data_dir, snapshot_every=5)
+    user = auth_register("email@a.com", "averylongpassword", "A", "LastA")
+    channel_id = channels_create(user['token'], 'channel', is_public=True)['channel_id']
+    # the one those started
+    persistence_snapshot()
+
+    saving = threading.Event()
+    saved = threading.Event()
+    def save_slowly(path, taken):
+        saving.set()
+        saved.wait(10)
+        snapshot_save(path, taken)
+    monkeypatch.setattr(persistence, 'snapshot_save', save_slowly)
+
+    start = time.monotonic()
+    sent = [message_send(user['token'], channel_id, f"message {i}")['message_id'] for i in range(20)]
+    assert saving.is_set()
+    # none of them waited for the snapshot to be written
+    assert time.monotonic() - start < 5
+    assert os.path.exists(os.path.join(data_dir, PREVIOUS_WAL_FILE))
+    saved.set()
+    persistence_snapshot()
+    assert not os.path.exists(os.path.join(data_dir, PREVIOUS_WAL_FILE))
+
+    restart(data_dir)
+    messages = channel_messages(user['token'], channel_id, 0)['messages']
+    assert [message['message_id'] for message in messages] == sent[::-1]
+
+def test_persistence_recovers_from_unfinished_snapshot(data_dir, monkeypatch):
+    persistence_open(data_dir)
+    def crash(path, taken):
+        raise OSError("disk full")
+    monkeypatch.setattr(persistence, 'snapshot_save', crash)
+    monkeypatch.setattr(threading, 'excepthook', lambda args: None)
+    usera, userb, channel_id = populate()
+    persistence_snapshot()
+    # the next one goes on with the same log
+    channel_leave(userb['token'], channel_id)
+    persistence_snapshot()
+    assert os.path.exists(os.path.join(data_dir, PREVIOUS_WAL_FILE))
+
+    restart(data_dir)
+    assert channels_list(userb['token']) == []
+    channel_join(userb['token'], channel_id)
+    assert_populated(usera, userb, channel_id)
+
+def test_persistence_snapshot_waits_for_the_change_being_logged(data_dir, monkeypatch):
+    persistence_open(data_dir)
+    user = auth_register("email@a.com", "averylongpassword", "A", "LastA")
+    channel_id = channels_create(user['token'], 'channel', is_public=True)['channel_id']
+
+    logged = threading.Event()
+    def record_slowly(operation, args):
+        wal_append(operation, args)
+        if operation == 'add_message':
+            logged.set()
+            # logged but not made yet, a snapshot now mustn't leave it out
+            time.sleep(0.2)
+    monkeypatch.setitem(journal, 'record', record_slowly)
+
+    sender = threading.Thread(target=message_send, args=(user['token'], channel_id, 'hello'))
+    sender.start()
+    logged.wait()
+    persistence_snapshot()
+    sender.join()
+
+    restart(data_dir)
+    assert [message['message'] for message in channel_messages(user['token'], channel_id, 0)['messages']] == ['hello']
+
+def test_persistence_logout(data_dir):
+    persistence_open(data_dir)
+    user = auth_register("email@a.com", "averylongpassword", "A", "LastA")
+    auth_logout(user['token'])
+    restart(data_dir)
+    with pytest.raises(AccessError):
+        channels_list(user['token'])
+
+def test_persistence_ignores_torn_write(data_dir):
+    persistence_open(data_dir)
+    usera, userb, channel_id = populate()
+    persistence_close()
+    with open(os.path.join(data_dir, WAL_FILE), 'a') as wal:
+        wal.write('{"seq": 1000, "op": "add_us')
+    restart(data_dir)
+    assert_populated(usera, userb, channel_id)
+
+    # the torn line was dropped, so new records can follow
+    auth_register("email@c.com", "averylongpassword", "C", "LastC")
+    restart(data_dir)
+    assert auth_login("email@c.com", "averylongpassword")
+
+def test_persistence_loads_messages_lazily(data_dir):
+    persistence_open(data_dir)
+    usera, userb, channel_id = populate()
+    other_channel_id = channels_create(usera['token'], 'other', is_public=True)['channel_id']
+    other_message_id = message_send(usera['token'], other_channel_id, 'in the other channel')['message_id']
+    persistence_snapshot()
+    restart(data_dir)
+
+    assert get_channel(channel_id)['messages'] is None
+    assert get_channel(other_channel_id)['messages'] is None
+
+    # finding a message by id loads only its channel
+    message_edit(usera['token'], other_message_id, 'edited')
+    assert get_channel(channel_id)['messages'] is None
+    assert channel_messages(usera['token'], other_channel_id, 0)['messages'][0]['message'] == 'edited'
+
+    # a snapshot copies the channels that still aren't loaded
+    persistence_snapshot()
+    restart(data_dir)
+    assert_populated(usera, userb, channel_id)
+    assert [message['message'] for message in search(usera['token'], 'edited')['messages']] == ['edited']
+
+def test_persistence_search_loads_only_the_users_channels(data_dir):
+    persistence_open(data_dir)
+    usera, userb, channel_id = populate()
+    other_channel_id = channels_create(usera['token'], 'other', is_public=True)['channel_id']
+    message_send(usera['token'], other_channel_id, 'goodbye other')
+    channel_leave(userb['token'], channel_id)
+    persistence_snapshot()
+    restart(data_dir)
+
+    assert search(userb['token'], 'goodbye')['messages'] == []
+    assert get_channel(channel_id)['messages'] is None
+    assert get_channel(other_channel_id)['messages'] is None
+    assert len(search(usera['token'], 'goodbye')['messages']) == 2
+
+def test_persistence_loads_a_channel_once(data_dir):
+    persistence_open(data_dir)
+    user = auth_register("email@a.com", "averylongpassword", "A", "LastA")
+    channel_ids = [channels_create(user['token'], f"channel {i}", is_public=True)['channel_id'] for i in range(4)]
+    message_ids = [message_send(user['token'], channel_id, f"hello {n}")['message_id'] for channel_id in channel_ids for n in range(100)]
+    persistence_snapshot()
+    restart(data_dir)
+
+    errors = []
+    def read(i):
+        try:
+            if i % 3 == 0:
+                search(user['token'], 'hello')
+            elif i % 3 == 1:
+                message_edit(user['token'], message_ids[i * 37 % len(message_ids)], 'edited')
+            else:
+                channel_messages(user['token'], channel_ids[i % len(channel_ids)], 0)
+        except Exception as error:
+            errors.append(error)
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=read, args=(i,)) for i in range(12)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert errors == []
+    assert len(search(user['token'], 'hello')['messages']) == 50
+
+def test_persistence_removes_unloaded_channels(data_dir):
+    persistence_open(data_dir)
+    usera, userb, channel_id = populate()
+    other_channel_id = channels_create(usera['token'], 'other', is_public=True)['channel_id']
+    persistence_snapshot()
+    restart(data_dir)
+
+    assert get_channel(other_channel_id)['messages'] is None
+    channel_removeowner(usera['token'], other_channel_id, usera['u_id'])
+    assert get_channel(other_channel_id) is None
+    assert get_channel(channel_id)['messages'] is None
+    restart(data_dir)
+    assert get_channel(other_channel_id) is None
+    assert_populated(usera, userb, channel_id)
+    assert channels_create(usera['token'], 'new', is_public=True)['channel_id'] > other_channel_id
+
+def test_persistence_keeps_scheduled_messages(data_dir):
+    persistence_open(data_dir)
+    usera, userb, channel_id = populate()
+    later = time.time() + 3600
+    kept = message_sendlater(usera['token'], channel_id, 'kept for later', later)['message_id']
+    cancelled = message_sendlater(usera['token'], channel_id, 'cancelled', later)['message_id']
+    persistence_snapshot()
+    message_sendlater(userb['token'], channel_id, 'after the snapshot', later)
+    message_sendlater_cancel(usera['token'], cancelled)
+    restart(data_dir)
+    message_sendlater_resume()
+
+    run_due(later + 1)
+    messages = channel_messages(userb['token'], channel_id, 0)['messages']
+    assert [message['message'] for message in messages[:3]] == ['after the snapshot', 'kept for later', 'last one']
+    assert messages[1]['message_id'] == kept
+
+    # once sent, they aren't sent again after another restart
+    restart(data_dir)
+    message_sendlater_resume()
+    run_due(later + 2)
+    assert len(channel_messages(userb['token'], channel_id, 0)['messages']) == 4
+
+def test_persistence_replays_into_unloaded_channels(data_dir):
+    persistence_open(data_dir)
+    usera, userb, channel_id = populate()
+    persistence_snapshot()
+    message_id = message_send(usera['token'], channel_id, 'after the snapshot')['message_id']
+    restart(data_dir)
+    message_remove(usera['token'], message_id)
+    restart(data_dir)
+    assert_populated(usera, userb, channel_id)
@@ -0,0 +1,65 @@
+"""
+The read endpoints that are asked for far more often than what they return
+changes (channel_details, channels_list, channels_listall, users_all) keep
+their responses serialised, so that asking again costs a dict lookup rather
+than rebuilding and re-encoding the same JSON.
+
+A response is filed under (endpoint, entity, versions, visibility):
+
+    entity      the channel or user it is about, None for the lists of
+                everything
+    versions    the versions (see database.py) of what it is built from, so
+                a change files the next response under a new key and the
+                old one is never found again. Nothing needs to be told to
+                forget anything, which is what makes this safe with several
+                worker processes: the versions live in the shared storage.
+    visibility  what the caller is allowed to see. Callers that see the
+                same thing share the response, and the access checks are
+                still made on every request, before looking in here.
+
+The key also gives the response's ETag, so a client that already has it is
+answered 304 without it even being looked up (see server.py).
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from database import get_versions
+from fast_json import json_dumps
+
+# the least recently used responses are dropped past this
+MAX_RESPONSES = 4096
+
+cache = {
+    'lock': threading.Lock(),
+    # key -> serialised response, least recently used first
+    'responses': OrderedDict(),
+}
+
+def response_key(endpoint, entity, version_keys, visibility):
+    # the epoch makes the versions after a restart or a clear different
+    return (endpoint, entity, get_versions(('epoch', *version_keys)), visibility)
+
+def response_etag(key):
+    return hashlib.blake2b(repr(key).encode(), digest_size=12).hexdigest()
+
+def cached_response(key, build):
+    """ The serialised response filed under key, calls build() to make it if there isn't one """
+    responses = cache['responses']
+    with cache['lock']:
+        body = responses.get(key)
+        if body is not None:
+            responses.move_to_end(key)
+            return body
+
+    # built outside the lock, two threads may both build it but that's
+    # cheaper than making every other request wait
+    body = json_dumps(build())
+    with cache['lock']:
+        responses[key] = body
+        if len(responses) > MAX_RESPONSES:
+            responses.popitem(last=False)
+    return body
+
+def clear_responses():
+    with cache['lock']:
+        cache['responses'].clear()
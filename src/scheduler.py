@@ -0,0 +1,95 @@
+"""
+Runs functions at a given time, for message_sendlater and standups. Jobs
+wait in a heap ordered by when they are due, and one thread sleeps until the
+earliest of them, so thousands of waiting jobs cost nothing until they run
+(rather than a thread each, or looking through all of them every tick).
+
+Jobs run one after the other on the scheduler's thread, so they must be
+quick, like delivering a message. A job is late by at most the time the
+jobs due before it take to run.
+
+Cancelling a job only marks it, it is skipped when its time comes. Once more
+than half of the heap is cancelled jobs, the heap is rebuilt without them.
+"""
+import sys
+import time
+import heapq
+import traceback
+import itertools
+import threading
+
+scheduler = {
+    'condition': threading.Condition(),
+    # [when, seq, function, args], seq keeps jobs due at the same time in
+    # the order they were scheduled. function is None once cancelled.
+    'heap': [],
+    'cancelled': 0,
+    'seq': itertools.count(),
+    'thread': None,
+}
+
+def schedule_at(when, function, *args):
+    """
+    Calls function(*args) once time.time() reaches when. Returns the job,
+    for schedule_cancel.
+    """
+    job = [when, next(scheduler['seq']), function, args]
+    with scheduler['condition']:
+        heapq.heappush(scheduler['heap'], job)
+        if scheduler['thread'] is None:
+            scheduler['thread'] = threading.Thread(target=run_forever, name='scheduler', daemon=True)
+            scheduler['thread'].start()
+        elif scheduler['heap'][0] is job:
+            # due before whatever the thread is waiting for
+            scheduler['condition'].notify()
+    return job
+
+def schedule_cancel(job):
+    """ Returns False if the job already ran or was cancelled """
+    with scheduler['condition']:
+        if job[2] is None:
+            return False
+        job[2] = None
+        scheduler['cancelled'] += 1
+        heap = scheduler['heap']
+        if scheduler['cancelled'] > len(heap) // 2:
+            heap[:] = [job for job in heap if job[2] is not None]
+            heapq.heapify(heap)
+            scheduler['cancelled'] = 0
+        return True
+
+def run_due(now=None):
+    """ Runs the jobs due by now (time.time() by default) """
+    while True:
+        with scheduler['condition']:
+            job = pop_due(time.time() if now is None else now)
+            if job is None:
+                return
+            function, args = job[2], job[3]
+            # so it can't be cancelled any more
+            job[2] = None
+        try:
+            function(*args)
+        except Exception:
+            # one failing job mustn't stop the others
+            print(f"scheduled job {function!r} failed:", file=sys.stderr)
+            traceback.print_exc()
+
+def pop_due(now):
+    """ The first job due by now that wasn't cancelled, or None """
+    heap = scheduler['heap']
+    while heap and heap[0][0] <= now:
+        job = heapq.heappop(heap)
+        if job[2] is not None:
+            return job
+        scheduler['cancelled'] -= 1
+    return None
+
+def run_forever():
+    condition = scheduler['condition']
+    while True:
+        with condition:
+            heap = scheduler['heap']
+            while not heap or heap[0][0] > time.time():
+                condition.wait(None if not heap else heap[0][0] - time.time())
+        run_due()
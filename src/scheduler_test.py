@@ -0,0 +1,56 @@
+import time
+import threading
+from scheduler import scheduler, schedule_at, schedule_cancel, run_due
+
+def test_scheduler_runs_jobs_in_order():
+    now = time.time() + 3600
+    ran = []
+    schedule_at(now + 2, ran.append, 'last')
+    schedule_at(now + 1, ran.append, 'first')
+    schedule_at(now + 1, ran.append, 'second')
+    run_due(now)
+    assert ran == []
+    run_due(now + 1)
+    assert ran == ['first', 'second']
+    run_due(now + 2)
+    assert ran == ['first', 'second', 'last']
+
+def test_scheduler_cancel():
+    now = time.time() + 3600
+    ran = []
+    jobs = [schedule_at(now + i, ran.append, i) for i in range(10)]
+    assert schedule_cancel(jobs[3])
+    assert not schedule_cancel(jobs[3])
+    for job in jobs[4:]:
+        schedule_cancel(job)
+    # rebuilt without the cancelled jobs whenever they are most of the heap
+    heap = scheduler['heap']
+    assert sum(job[2] is None for job in heap) <= len(heap) // 2
+    run_due(now + 10)
+    assert ran == [0, 1, 2]
+    assert not schedule_cancel(jobs[0])
+
+def test_scheduler_thread_fires_on_time():
+    fired = threading.Event()
+    times = []
+    def fire():
+        times.append(time.time())
+        fired.set()
+    due = time.time() + 0.1
+    # a later job first, so the thread is waiting for it when fire is added
+    later = schedule_at(due + 3600, fire)
+    schedule_at(due, fire)
+    assert fired.wait(5)
+    assert due <= times[0] < due + 1
+    schedule_cancel(later)
+
+def test_scheduler_survives_failing_jobs(capsys):
+    now = time.time() + 3600
+    ran = []
+    schedule_at(now, lambda: 1 / 0)
+    schedule_at(now, ran.append, 'after')
+    run_due(now)
+    assert ran == ['after']
+    output = capsys.readouterr()
+    assert output.out == ''
+    assert 'ZeroDivisionError' in output.err
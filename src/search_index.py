@@ -0,0 +1,27 @@
+"""
+Inverted index of the messages' words: word -> ids of the messages that
+contain it, kept by the storage backend. message.py keeps it up to date as
+messages are sent, edited and removed, so a search only has to look at the
+messages that match.
+"""
+from storage import words_of
+from database import load_channels_messages, index_words, unindex_words, find_words
+
+def search_index_add(message):
+    index_words(message['message_id'], words_of(message['message']))
+
+def search_index_remove(message):
+    unindex_words(message['message_id'], words_of(message['message']))
+
+def search_index_query(text, channel_ids):
+    """
+    The ids of the messages that contain every word of text, including at
+    least those in channel_ids
+    """
+    words = words_of(text)
+    if not words:
+        return set()
+    # messages are only indexed once they are loaded (see snapshot.py), so
+    # a search loads the channels it looks in rather than the whole snapshot
+    load_channels_messages(channel_ids)
+    return find_words(words)
@@ -0,0 +1,151 @@
+"""
+Production entry point. APP.run is Flask's development server, which is
+fine for the tests but isn't meant to take real load. This serves APP with
+a fixed pool of worker threads, or with several pre-forked worker processes
+sharing one listening socket. The async mode (see async_server.py) also
+lets clients wait for new messages rather than poll for them.
+
+    python3 src/serve.py [--mode threaded|prefork|async] [--workers N] [--threads N] [--host HOST] [--port PORT]
+
+How the workers share the data:
+
+    threaded    the threads share this process's memory, so any storage
+                works, including the default in-memory one (persisted with
+                FLOCKR_DATA_DIR, see persistence.py).
+    prefork     the processes don't share memory, so they share a store:
+                FLOCKR_SQLITE_DB must be set, and every worker opens it as a
+                shared SQLiteStorage, which commits each change straight away
+                and caches nothing, so a change made by one worker is seen by
+                the others on their next request. Sticky sessions wouldn't be
+                enough, users see each other's channels and messages, so
+                there's no way to split the data between the workers.
+    async       one process, like threaded.
+"""
+import os
+import sys
+import signal
+import socket
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from server import APP, storage_from_environment
+from sqlite_storage import SQLiteStorage
+from async_server import serve_async
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_THREADS = 8
+BACKLOG = 1024
+
+class RequestHandler(WSGIRequestHandler):
+    # one request per connection, so that a client keeping its connection
+    # open doesn't tie up one of the worker threads
+    protocol_version = 'HTTP/1.0'
+
+    def log_request(self, code='-', size='-'):
+        # logging every request would cost more than most requests do
+        pass
+
+class PooledWSGIServer(BaseWSGIServer):
+    """ Serves each request on one of a fixed pool of threads """
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd=None):
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='request')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_in_pool, request, client_address)
+
+    def process_request_in_pool(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+def serve(server):
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.pool.shutdown(wait=False)
+
+def announce(host, port):
+    # the same line as Flask's, so the same tools can find the address
+    print(f" * Running on http://{host}:{port}/", file=sys.stderr, flush=True)
+
+def serve_threaded(host, port, threads):
+    storage_from_environment()
+    server = PooledWSGIServer(host, port, APP, threads)
+    announce(host, server.port)
+    serve(server)
+
+def serve_prefork(host, port, workers, threads):
+    if 'FLOCKR_SQLITE_DB' not in os.environ:
+        sys.exit("prefork mode needs a store the workers can share, set FLOCKR_SQLITE_DB")
+    # create the tables once, rather than have the workers race to
+    SQLiteStorage(os.environ['FLOCKR_SQLITE_DB'], shared=True).close()
+
+    listener = socket.create_server((host, port), backlog=BACKLOG)
+    announce(host, listener.getsockname()[1])
+
+    stopping = []
+    children = set()
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for _ in range(workers):
+        children.add(spawn_worker(listener, host, threads))
+    while children:
+        pid, _ = os.wait()
+        children.discard(pid)
+        if not stopping:
+            # a worker crashed, replace it
+            children.add(spawn_worker(listener, host, threads))
+    listener.close()
+
+def spawn_worker(listener, host, threads):
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        # opened after forking, an SQLite connection can't cross a fork
+        storage_from_environment(shared=True)
+        server = PooledWSGIServer(host, listener.getsockname()[1], APP, threads, fd=listener.fileno())
+        server.multiprocess = True
+        serve(server)
+    finally:
+        # never return into the parent's loop
+        os._exit(0)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Serve flockr with several workers")
+    parser.add_argument('--mode', choices=['threaded', 'prefork', 'async'], default='threaded')
+    parser.add_argument('--workers', type=int, default=None,
+                        help=f"threads (threaded) or processes (prefork), {DEFAULT_THREADS} or {DEFAULT_WORKERS} by default")
+    parser.add_argument('--threads', type=int, default=1, help="threads per process (prefork)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    options = parser.parse_args(argv)
+
+    if options.mode == 'threaded':
+        serve_threaded(options.host, options.port, options.workers or DEFAULT_THREADS)
+    elif options.mode == 'async':
+        storage_from_environment()
+        serve_async(options.host, options.port, announce)
+    else:
+        serve_prefork(options.host, options.port, options.workers or DEFAULT_WORKERS, options.threads)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,92 @@
+"""
+Load test: requests per second served by serve.py as the number of workers
+grows, in threaded mode (in-memory storage) and prefork mode (shared SQLite
+storage). Clients fetch channel_details and channel_messages of a populated
+channel as fast as they can, from several processes so that the clients
+aren't the bottleneck.
+
+Worker processes only help when there are CPUs for them to run on, worker
+threads mostly help when requests wait on something other than the CPU.
+
+    python3 src/serve_bench.py [max workers] [seconds per run]
+"""
+import os
+import re
+import sys
+import time
+import tempfile
+import subprocess
+import http.client
+from urllib.parse import urlencode
+from multiprocessing import Pool
+import requests
+
+CLIENT_PROCESSES = 4
+MESSAGES = 100
+URL_REGEX = re.compile(r' \* Running on http://([^:]+):(\d+)/')
+
+def start_server(mode, workers, environment):
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(__file__), 'serve.py'), '--mode', mode, '--workers', str(workers)],
+        stderr=subprocess.PIPE, env={**os.environ, **environment},
+    )
+    host, port = URL_REGEX.match(server.stderr.readline().decode()).groups()
+    return server, host, int(port)
+
+def populate(host, port):
+    """ Returns the paths the clients fetch """
+    url = f"http://{host}:{port}/"
+    user = requests.post(url + 'auth/register', json={
+        'email': 'bench@gmail.com', 'password': 'benchpassword', 'name_first': 'Bench', 'name_last': 'User',
+    }).json()
+    channel_id = requests.post(url + 'channels/create', json={
+        'token': user['token'], 'name': 'bench', 'is_public': True,
+    }).json()['channel_id']
+    for i in range(MESSAGES):
+        requests.post(url + 'message/send', json={'token': user['token'], 'channel_id': channel_id, 'message': f"message {i}"})
+    query = {'token': user['token'], 'channel_id': channel_id}
+    return [f"/channel/details?{urlencode(query)}", f"/channel/messages?{urlencode({**query, 'start': 0})}"]
+
+def client(arguments):
+    """ How many requests one client completed before the deadline """
+    host, port, paths, deadline = arguments
+    done = 0
+    while time.time() < deadline:
+        connection = http.client.HTTPConnection(host, port)
+        connection.request('GET', paths[done % len(paths)])
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        if response.status != 200:
+            raise RuntimeError(f"{paths[done % len(paths)]} failed with {response.status}")
+        done += 1
+    return done
+
+def requests_per_second(mode, workers, seconds, environment):
+    server, host, port = start_server(mode, workers, environment)
+    try:
+        paths = populate(host, port)
+        deadline = time.time() + seconds
+        with Pool(CLIENT_PROCESSES) as clients:
+            done = sum(clients.map(client, [(host, port, paths, deadline)] * CLIENT_PROCESSES))
+        return done / seconds
+    finally:
+        server.terminate()
+        server.wait()
+
+def main(max_workers, seconds=5):
+    print(f"{os.cpu_count()} CPUs, {CLIENT_PROCESSES} client processes, {seconds}s per run")
+    print(f"{'workers':>7} {'threaded':>10} {'prefork':>10}  requests/sec")
+    workers = 1
+    while workers <= max_workers:
+        with tempfile.TemporaryDirectory() as directory:
+            # hashing isn't what we are measuring
+            environment = {'FLOCKR_PASSWORD_ITERATIONS': '1'}
+            threaded = requests_per_second('threaded', workers, seconds, environment)
+            environment['FLOCKR_SQLITE_DB'] = os.path.join(directory, 'flockr.db')
+            prefork = requests_per_second('prefork', workers, seconds, environment)
+        print(f"{workers:>7} {threaded:>10.0f} {prefork:>10.0f}")
+        workers *= 2
+
+if __name__ == "__main__":
+    main(*([int(arg) for arg in sys.argv[1:3]] or [8, 5]))
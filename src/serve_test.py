@@ -0,0 +1,73 @@
+import os
+import re
+import sys
+import signal
+import subprocess
+import pytest
+import requests
+
+URL_REGEX = re.compile(r' \* Running on (http://\S*)')
+
+def start(*arguments, **environment):
+    server = subprocess.Popen(
+        [sys.executable, 'src/serve.py', *arguments],
+        stderr=subprocess.PIPE, stdout=subprocess.PIPE,
+        env={**os.environ, 'FLOCKR_PASSWORD_ITERATIONS': '1', **environment},
+    )
+    match = URL_REGEX.match(server.stderr.readline().decode())
+    if match is None:
+        server.kill()
+        raise Exception("Couldn't get URL from the server")
+    return server, match.group(1)
+
+def stop(server):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(5)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+def use_channel(url):
+    user = requests.post(url + 'auth/register', json={
+        'email': 'email@a.com', 'password': 'averylongpassword', 'name_first': 'A', 'name_last': 'LastA',
+    }).json()
+    channel_id = requests.post(url + 'channels/create', json={
+        'token': user['token'], 'name': 'channel', 'is_public': True,
+    }).json()['channel_id']
+    for i in range(10):
+        assert requests.post(url + 'message/send', json={
+            'token': user['token'], 'channel_id': channel_id, 'message': f"message {i}",
+        }).status_code == 200
+    # every request can land on a different worker
+    for _ in range(10):
+        messages = requests.get(url + 'channel/messages', params={
+            'token': user['token'], 'channel_id': channel_id, 'start': 0,
+        }).json()['messages']
+        assert len(messages) == 10
+
+def test_serve_threaded():
+    server, url = start('--mode', 'threaded', '--workers', '4')
+    try:
+        use_channel(url)
+    finally:
+        stop(server)
+
+def test_serve_prefork_shares_sqlite(tmp_path):
+    server, url = start('--mode', 'prefork', '--workers', '3', FLOCKR_SQLITE_DB=str(tmp_path / 'flockr.db'))
+    try:
+        use_channel(url)
+    finally:
+        stop(server)
+
+def test_serve_prefork_needs_a_shared_store():
+    environment = {key: value for key, value in os.environ.items() if key != 'FLOCKR_SQLITE_DB'}
+    result = subprocess.run([sys.executable, 'src/serve.py', '--mode', 'prefork'], env=environment, capture_output=True, timeout=30)
+    assert result.returncode != 0
+    assert b'FLOCKR_SQLITE_DB' in result.stderr
+
+def test_serve_async():
+    server, url = start('--mode', 'async')
+    try:
+        use_channel(url)
+    finally:
+        stop(server)
@@ -1,13 +1,34 @@
+import os
 import sys
-from json import dumps
+import gzip
 from flask import Flask, request
 from flask_cors import CORS
 from error import InputError
+from auth import auth_login, auth_logout, auth_register, auth_register_bulk, auth_get_current_user_id_from_token
+from channel import channel_invite, channel_details, channel_details_paged, channel_messages, channel_leave, \
+    channel_join, channel_addowner, channel_removeowner, get_member_channel, MEMBERS_PAGE_SIZE
+from channels import channels_list, channels_listall, channels_create
+from message import message_send, message_remove, message_edit, message_sendlater, message_sendlater_cancel, \
+    message_sendlater_resume
+from user import user_profile, user_profile_setname, user_profile_setemail, user_profile_sethandle
+from other import clear, users_all, admin_userpermission_change, search
+from standup import standup_start, standup_active, standup_send
+from persistence import persistence_open
+from database import use_storage, user_version, channel_version, USERS_VERSION, CHANNELS_VERSION
+from response_cache import response_key, response_etag, cached_response
+from sqlite_storage import SQLiteStorage
+from fast_json import json_dumps, json_loads
+from http_params import param, str_param, token_param, int_param, float_param, channel_id_param, u_id_param, \
+    bool_param
+
+# responses smaller than this aren't worth compressing
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 5
 
 def defaultHandler(err):
     response = err.get_response()
     print('response', err, err.get_response())
-    response.data = dumps({
+    response.data = json_dumps({
         "code": err.code,
         "name": "System Error",
         "message": err.get_description(),
@@ -21,15 +42,291 @@ CORS(APP)
 APP.config['TRAP_HTTP_EXCEPTIONS'] = True
 APP.register_error_handler(Exception, defaultHandler)
 
+def request_data():
+    """ The query string of a GET, otherwise the JSON body """
+    if request.method == 'GET':
+        return request.args
+    body = request.get_data()
+    if not body:
+        return {}
+    try:
+        data = json_loads(body)
+    except ValueError:
+        raise InputError("the body isn't valid JSON") from None
+    if not isinstance(data, dict):
+        raise InputError("the body must be a JSON object")
+    return data
+
+def json_response(result):
+    """
+    result as JSON, gzipped if it is big and the client accepts it. The
+    functions that don't return anything answer {}.
+    """
+    return body_response(json_dumps({} if result is None else result))
+
+def cached_json_response(endpoint, entity, version_keys, visibility, build):
+    """
+    Like json_response(build()), for the responses kept by response_cache.py.
+    Make the access checks before calling this. A client that sends back the
+    ETag it got is answered 304 if nothing it depends on has changed since.
+    """
+    key = response_key(endpoint, entity, version_keys, visibility)
+    etag = response_etag(key)
+    if request.if_none_match.contains_weak(etag):
+        response = APP.response_class(status=304)
+    else:
+        response = body_response(cached_response(key, build))
+    # weak, the same response may be sent gzipped or not
+    response.set_etag(etag, weak=True)
+    # the responses depend on who asks, so only the client may keep them,
+    # and it must check they are still current before using them
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def body_response(body):
+    response = APP.response_class(body, mimetype='application/json')
+    if len(body) >= GZIP_MIN_SIZE:
+        response.vary.add('Accept-Encoding')
+        if 'gzip' in request.accept_encodings:
+            response.set_data(gzip.compress(body, GZIP_LEVEL))
+            response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 # Example
 @APP.route("/echo", methods=['GET'])
 def echo():
     data = request.args.get('data')
     if data == 'echo':
    	    raise InputError(description='Cannot echo "echo"')
-    return dumps({
+    return json_response({
         'data': data
     })
 
+# Auth
+
+@APP.route("/auth/login", methods=['POST'])
+def auth_login_route():
+    data = request_data()
+    return json_response(auth_login(str_param(data, 'email'), str_param(data, 'password')))
+
+@APP.route("/auth/logout", methods=['POST'])
+def auth_logout_route():
+    return json_response(auth_logout(token_param(request_data())))
+
+@APP.route("/auth/register", methods=['POST'])
+def auth_register_route():
+    data = request_data()
+    return json_response(auth_register(
+        str_param(data, 'email'),
+        str_param(data, 'password'),
+        str_param(data, 'name_first'),
+        str_param(data, 'name_last'),
+    ))
+
+@APP.route("/auth/register/bulk", methods=['POST'])
+def auth_register_bulk_route():
+    data = request_data()
+    return json_response(auth_register_bulk(token_param(data), param(data, 'users')))
+
+# Channel
+
+@APP.route("/channel/invite", methods=['POST'])
+def channel_invite_route():
+    data = request_data()
+    return json_response(channel_invite(token_param(data), channel_id_param(data), u_id_param(data)))
+
+@APP.route("/channel/details", methods=['GET'])
+def channel_details_route():
+    data = request_data()
+    token, channel_id = token_param(data), channel_id_param(data)
+    get_member_channel(token, channel_id)
+    # every member sees the same details
+    return cached_json_response(
+        'channel_details', channel_id, (channel_version(channel_id),), 'member',
+        lambda: channel_details(token, channel_id),
+    )
+
+@APP.route("/channel/details/paged", methods=['GET'])
+def channel_details_paged_route():
+    data = request_data()
+    return json_response(channel_details_paged(
+        token_param(data),
+        channel_id_param(data),
+        int_param(data, 'cursor', 0),
+        int_param(data, 'limit', MEMBERS_PAGE_SIZE),
+    ))
+
+@APP.route("/channel/messages", methods=['GET'])
+def channel_messages_route():
+    data = request_data()
+    before_message_id = int_param(data, 'before_message_id') if 'before_message_id' in data else None
+    return json_response(channel_messages(
+        token_param(data),
+        channel_id_param(data),
+        int_param(data, 'start'),
+        before_message_id,
+    ))
+
+@APP.route("/channel/leave", methods=['POST'])
+def channel_leave_route():
+    data = request_data()
+    return json_response(channel_leave(token_param(data), channel_id_param(data)))
+
+@APP.route("/channel/join", methods=['POST'])
+def channel_join_route():
+    data = request_data()
+    return json_response(channel_join(token_param(data), channel_id_param(data)))
+
+@APP.route("/channel/addowner", methods=['POST'])
+def channel_addowner_route():
+    data = request_data()
+    return json_response(channel_addowner(token_param(data), channel_id_param(data), u_id_param(data)))
+
+@APP.route("/channel/removeowner", methods=['POST'])
+def channel_removeowner_route():
+    data = request_data()
+    return json_response(channel_removeowner(token_param(data), channel_id_param(data), u_id_param(data)))
+
+# Channels
+
+@APP.route("/channels/list", methods=['GET'])
+def channels_list_route():
+    token = token_param(request_data())
+    u_id = auth_get_current_user_id_from_token(token)
+    # channel names never change, so only joining or leaving one, or one
+    # being removed, changes the list
+    return cached_json_response(
+        'channels_list', u_id, (user_version(u_id), CHANNELS_VERSION), 'self',
+        lambda: {'channels': channels_list(token)},
+    )
+
+@APP.route("/channels/listall", methods=['GET'])
+def channels_listall_route():
+    token = token_param(request_data())
+    auth_get_current_user_id_from_token(token)
+    return cached_json_response(
+        'channels_listall', None, (CHANNELS_VERSION,), 'user',
+        lambda: {'channels': channels_listall(token)},
+    )
+
+@APP.route("/channels/create", methods=['POST'])
+def channels_create_route():
+    data = request_data()
+    return json_response(channels_create(token_param(data), str_param(data, 'name'), bool_param(data, 'is_public')))
+
+# Message
+
+@APP.route("/message/send", methods=['POST'])
+def message_send_route():
+    data = request_data()
+    return json_response(message_send(token_param(data), channel_id_param(data), str_param(data, 'message')))
+
+@APP.route("/message/sendlater", methods=['POST'])
+def message_sendlater_route():
+    data = request_data()
+    return json_response(message_sendlater(
+        token_param(data),
+        channel_id_param(data),
+        str_param(data, 'message'),
+        # a fraction of a second is rounded up by message_sendlater, not down
+        float_param(data, 'time_sent'),
+    ))
+
+@APP.route("/message/sendlater/cancel", methods=['POST'])
+def message_sendlater_cancel_route():
+    data = request_data()
+    return json_response(message_sendlater_cancel(token_param(data), int_param(data, 'message_id')))
+
+@APP.route("/message/remove", methods=['DELETE'])
+def message_remove_route():
+    data = request_data()
+    return json_response(message_remove(token_param(data), int_param(data, 'message_id')))
+
+@APP.route("/message/edit", methods=['PUT'])
+def message_edit_route():
+    data = request_data()
+    return json_response(message_edit(token_param(data), int_param(data, 'message_id'), str_param(data, 'message')))
+
+# Standup
+
+@APP.route("/standup/start", methods=['POST'])
+def standup_start_route():
+    data = request_data()
+    return json_response(standup_start(token_param(data), channel_id_param(data), int_param(data, 'length')))
+
+@APP.route("/standup/active", methods=['GET'])
+def standup_active_route():
+    data = request_data()
+    return json_response(standup_active(token_param(data), channel_id_param(data)))
+
+@APP.route("/standup/send", methods=['POST'])
+def standup_send_route():
+    data = request_data()
+    return json_response(standup_send(token_param(data), channel_id_param(data), str_param(data, 'message')))
+
+# User
+
+@APP.route("/user/profile", methods=['GET'])
+def user_profile_route():
+    data = request_data()
+    return json_response(user_profile(token_param(data), u_id_param(data)))
+
+@APP.route("/user/profile/setname", methods=['PUT'])
+def user_profile_setname_route():
+    data = request_data()
+    return json_response(user_profile_setname(token_param(data), str_param(data, 'name_first'), str_param(data, 'name_last')))
+
+@APP.route("/user/profile/setemail", methods=['PUT'])
+def user_profile_setemail_route():
+    data = request_data()
+    return json_response(user_profile_setemail(token_param(data), str_param(data, 'email')))
+
+@APP.route("/user/profile/sethandle", methods=['PUT'])
+def user_profile_sethandle_route():
+    data = request_data()
+    return json_response(user_profile_sethandle(token_param(data), str_param(data, 'handle_str')))
+
+# Other
+
+@APP.route("/users/all", methods=['GET'])
+def users_all_route():
+    token = token_param(request_data())
+    auth_get_current_user_id_from_token(token)
+    return cached_json_response('users_all', None, (USERS_VERSION,), 'user', lambda: users_all(token))
+
+@APP.route("/admin/userpermission/change", methods=['POST'])
+def admin_userpermission_change_route():
+    data = request_data()
+    return json_response(admin_userpermission_change(
+        token_param(data),
+        u_id_param(data),
+        int_param(data, 'permission_id'),
+    ))
+
+@APP.route("/search", methods=['GET'])
+def search_route():
+    data = request_data()
+    return json_response(search(token_param(data), str_param(data, 'query_str')))
+
+@APP.route("/clear", methods=['DELETE'])
+def clear_route():
+    return json_response(clear())
+
+def storage_from_environment(shared=False):
+    """
+    Keeps the data between restarts if we are told where to, either in an
+    SQLite database or in memory with a log and snapshots on disk. shared
+    is for when other processes use the same data, see serve.py. Then sends
+    the messages that were waiting to be sent when we last stopped.
+    """
+    if 'FLOCKR_SQLITE_DB' in os.environ:
+        use_storage(SQLiteStorage(os.environ['FLOCKR_SQLITE_DB'], shared=shared))
+    elif shared:
+        raise ValueError("processes can only share the data in an SQLite database, set FLOCKR_SQLITE_DB")
+    elif 'FLOCKR_DATA_DIR' in os.environ:
+        persistence_open(os.environ['FLOCKR_DATA_DIR'])
+    message_sendlater_resume()
+
 if __name__ == "__main__":
+    storage_from_environment()
     APP.run(port=0) # Do not edit this port
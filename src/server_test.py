@@ -0,0 +1,181 @@
+import gzip
+import json
+import time
+import pytest
+import fast_json
+from server import APP, GZIP_MIN_SIZE
+from database import clear_database, get_scheduled_message
+
+@pytest.fixture
+def client():
+    clear_database()
+    yield APP.test_client()
+    clear_database()
+
+def call(client, method, path, data, **kwargs):
+    if method == 'GET':
+        response = client.get(path, query_string=data, **kwargs)
+    else:
+        response = client.open(path, method=method, json=data, **kwargs)
+    return response.status_code, json.loads(response.get_data())
+
+def register(client, email):
+    return call(client, 'POST', '/auth/register', {
+        'email': email, 'password': 'averylongpassword', 'name_first': 'First', 'name_last': 'Last',
+    })[1]
+
+def test_server_routes(client):
+    usera = register(client, "email@a.com")
+    userb = register(client, "email@b.com")
+    status, channel = call(client, 'POST', '/channels/create', {'token': usera['token'], 'name': 'channel', 'is_public': True})
+    assert status == 200
+    channel_id = channel['channel_id']
+
+    assert call(client, 'POST', '/channel/join', {'token': userb['token'], 'channel_id': channel_id}) == (200, {})
+    assert call(client, 'POST', '/channel/addowner', {'token': usera['token'], 'channel_id': channel_id, 'u_id': userb['u_id']})[0] == 200
+    details = call(client, 'GET', '/channel/details', {'token': userb['token'], 'channel_id': channel_id})[1]
+    assert len(details['owner_members']) == 2
+
+    message_id = call(client, 'POST', '/message/send', {'token': userb['token'], 'channel_id': channel_id, 'message': 'hello'})[1]['message_id']
+    assert call(client, 'PUT', '/message/edit', {'token': usera['token'], 'message_id': message_id, 'message': 'hi there'})[0] == 200
+    messages = call(client, 'GET', '/channel/messages', {'token': usera['token'], 'channel_id': channel_id, 'start': 0})[1]
+    assert [message['message'] for message in messages['messages']] == ['hi there']
+    assert [message['message'] for message in call(client, 'GET', '/search', {'token': usera['token'], 'query_str': 'there'})[1]['messages']] == ['hi there']
+    assert call(client, 'DELETE', '/message/remove', {'token': usera['token'], 'message_id': message_id})[0] == 200
+    later = call(client, 'POST', '/message/sendlater', {
+        'token': usera['token'], 'channel_id': channel_id, 'message': 'later', 'time_sent': int(time.time()) + 3600,
+    })[1]['message_id']
+    assert call(client, 'POST', '/message/sendlater/cancel', {'token': usera['token'], 'message_id': later}) == (200, {})
+    time_finish = call(client, 'POST', '/standup/start', {'token': usera['token'], 'channel_id': channel_id, 'length': 60})[1]['time_finish']
+    assert call(client, 'GET', '/standup/active', {'token': userb['token'], 'channel_id': channel_id})[1] == {'is_active': True, 'time_finish': time_finish}
+    assert call(client, 'POST', '/standup/send', {'token': userb['token'], 'channel_id': channel_id, 'message': 'hi'}) == (200, {})
+
+    assert call(client, 'GET', '/channels/list', {'token': userb['token']})[1] == {'channels': [{'channel_id': channel_id, 'name': 'channel'}]}
+    assert call(client, 'PUT', '/user/profile/setname', {'token': userb['token'], 'name_first': 'New', 'name_last': 'Name'})[0] == 200
+    assert call(client, 'POST', '/channel/leave', {'token': userb['token'], 'channel_id': channel_id})[0] == 200
+    assert call(client, 'GET', '/channels/listall', {'token': userb['token']})[1]['channels'][0]['channel_id'] == channel_id
+
+    assert call(client, 'POST', '/auth/logout', {'token': userb['token']})[1] == {'is_success': True}
+    assert call(client, 'POST', '/auth/login', {'email': "email@b.com", 'password': 'averylongpassword'})[1]['u_id'] == userb['u_id']
+    assert call(client, 'DELETE', '/clear', {}) == (200, {})
+    assert call(client, 'GET', '/channels/listall', {'token': usera['token']})[0] == 400
+
+def test_server_sendlater_rounds_up(client):
+    user = register(client, "email@a.com")
+    channel_id = call(client, 'POST', '/channels/create', {'token': user['token'], 'name': 'channel', 'is_public': True})[1]['channel_id']
+    time_sent = int(time.time()) + 3600.25
+    status, later = call(client, 'POST', '/message/sendlater', {
+        'token': user['token'], 'channel_id': channel_id, 'message': 'later', 'time_sent': time_sent,
+    })
+    assert status == 200
+    # never early, not even by the quarter of a second
+    assert get_scheduled_message(later['message_id'])['time_sent'] == int(time_sent) + 1
+
+    for bad in ('soon', True, 'inf'):
+        assert call(client, 'POST', '/message/sendlater', {
+            'token': user['token'], 'channel_id': channel_id, 'message': 'later', 'time_sent': bad,
+        })[0] == 400
+
+def test_server_params_are_checked(client):
+    user = register(client, "email@a.com")
+    status, error = call(client, 'GET', '/channel/details', {'token': user['token'], 'channel_id': 'abc'})
+    assert status == 400
+    assert 'channel_id must be an integer' in error['message']
+    assert call(client, 'GET', '/channel/details', {'channel_id': 1})[0] == 400
+    assert call(client, 'POST', '/channel/join', {'token': user['token'], 'channel_id': True})[0] == 400
+    assert call(client, 'POST', '/auth/login', {'email': "email@a.com"})[0] == 400
+
+    response = client.post('/auth/login', data='not json', content_type='application/json')
+    assert response.status_code == 400
+
+    assert call(client, 'POST', '/auth/register', {
+        'email': 123, 'password': 'averylongpassword', 'name_first': 'First', 'name_last': 'Last',
+    })[0] == 400
+    assert call(client, 'POST', '/channels/create', {'token': user['token'], 'name': 123, 'is_public': True})[0] == 400
+    channel_id = call(client, 'POST', '/channels/create', {'token': user['token'], 'name': 'channel', 'is_public': True})[1]['channel_id']
+    status, error = call(client, 'POST', '/message/send', {'token': user['token'], 'channel_id': channel_id, 'message': 5})
+    assert status == 400
+    assert 'message must be a string' in error['message']
+
+def test_server_bulk_register_bad_rows(client):
+    user = register(client, "email@a.com")
+    for users in ('users', None):
+        assert call(client, 'POST', '/auth/register/bulk', {'token': user['token'], 'users': users})[0] == 400
+    status, result = call(client, 'POST', '/auth/register/bulk', {'token': user['token'], 'users': [1, {'email': 5}]})
+    assert status == 200
+    assert [error['row'] for error in result['errors']] == [0, 1]
+
+def test_server_gzips_big_responses(client):
+    user = register(client, "email@a.com")
+    channel_id = call(client, 'POST', '/channels/create', {'token': user['token'], 'name': 'channel', 'is_public': True})[1]['channel_id']
+    for i in range(50):
+        call(client, 'POST', '/message/send', {'token': user['token'], 'channel_id': channel_id, 'message': f"message number {i}"})
+
+    query = {'token': user['token'], 'channel_id': channel_id, 'start': 0}
+    response = client.get('/channel/messages', query_string=query, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(json.loads(gzip.decompress(response.get_data()))['messages']) == 50
+
+    plain = client.get('/channel/messages', query_string=query)
+    assert 'Content-Encoding' not in plain.headers
+    assert len(plain.get_data()) >= GZIP_MIN_SIZE
+
+    # small responses aren't worth it
+    small = client.get('/channels/list', query_string={'token': user['token']}, headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+
+def test_server_etags(client):
+    usera = register(client, "email@a.com")
+    userb = register(client, "email@b.com")
+    channel_id = call(client, 'POST', '/channels/create', {'token': usera['token'], 'name': 'channel', 'is_public': True})[1]['channel_id']
+    query = {'token': usera['token'], 'channel_id': channel_id}
+
+    response = client.get('/channel/details', query_string=query)
+    etag = response.headers['ETag']
+    assert len(json.loads(response.get_data())['all_members']) == 1
+    unchanged = client.get('/channel/details', query_string=query, headers={'If-None-Match': etag})
+    assert unchanged.status_code == 304
+    assert unchanged.get_data() == b''
+    # messages aren't part of the details
+    call(client, 'POST', '/message/send', {'token': usera['token'], 'channel_id': channel_id, 'message': 'hello'})
+    assert client.get('/channel/details', query_string=query, headers={'If-None-Match': etag}).status_code == 304
+
+    call(client, 'POST', '/channel/join', {'token': userb['token'], 'channel_id': channel_id})
+    changed = client.get('/channel/details', query_string=query, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert len(json.loads(changed.get_data())['all_members']) == 2
+    # the other member gets the same response
+    other = client.get('/channel/details', query_string={**query, 'token': userb['token']}, headers={'If-None-Match': changed.headers['ETag']})
+    assert other.status_code == 304
+
+    call(client, 'PUT', '/user/profile/setname', {'token': userb['token'], 'name_first': 'New', 'name_last': 'Name'})
+    renamed = json.loads(client.get('/channel/details', query_string=query).get_data())
+    assert renamed['all_members'][1]['name_first'] == 'New'
+
+    # access is still checked before the cache
+    call(client, 'POST', '/channel/leave', {'token': userb['token'], 'channel_id': channel_id})
+    assert client.get('/channel/details', query_string={**query, 'token': userb['token']}).status_code == 400
+
+    listed = client.get('/channels/list', query_string={'token': userb['token']})
+    assert json.loads(listed.get_data()) == {'channels': []}
+    listall = client.get('/channels/listall', query_string={'token': userb['token']})
+    assert client.get('/channels/listall', query_string={'token': usera['token']}, headers={'If-None-Match': listall.headers['ETag']}).status_code == 304
+    call(client, 'POST', '/channels/create', {'token': usera['token'], 'name': 'another', 'is_public': True})
+    assert len(json.loads(client.get('/channels/listall', query_string={'token': userb['token']}).get_data())['channels']) == 2
+    assert client.get('/users/all', query_string={'token': 'not a token'}).status_code == 400
+
+    # versions start again after a clear, the ETags don't
+    call(client, 'DELETE', '/clear', {})
+    usera = register(client, "email@a.com")
+    channel_id = call(client, 'POST', '/channels/create', {'token': usera['token'], 'name': 'channel', 'is_public': True})[1]['channel_id']
+    assert client.get('/channel/details', query_string={**query, 'token': usera['token']}, headers={'If-None-Match': etag}).status_code == 200
+
+def test_fast_json_fallback(monkeypatch):
+    value = {'ids': {3, 1, 2}, 'name': 'channel'}
+    encoded = fast_json.json_dumps(value)
+    monkeypatch.setattr(fast_json, 'orjson', None)
+    assert fast_json.json_dumps(value) == encoded == b'{"ids":[1,2,3],"name":"channel"}'
+    assert fast_json.json_loads(encoded) == {'ids': [1, 2, 3], 'name': 'channel'}
+    with pytest.raises(ValueError):
+        fast_json.json_loads(b'{')
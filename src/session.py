@@ -0,0 +1,39 @@
+"""
+Registry of the active sessions, so that logging in again returns the token
+the user already has.
+
+Checking a token doesn't look in the registry: every token carries its
+user's token generation from when it was made, a random number that logging
+out replaces, so the token (and any other the user had) stops matching.
+That's one small number per user rather than a lookup of the token itself,
+and being random, a token from before the data was cleared can't match the
+user who gets its id next.
+"""
+import secrets
+from database import add_session, get_session, remove_session, get_user_token, get_token_generation, \
+    set_token_generation
+
+def session_create(token, u_id):
+    add_session(token, u_id)
+
+def session_get(token):
+    """ Returns None if the token isn't an active session """
+    return get_session(token)
+
+def session_revoke(token):
+    """ Returns False if the token wasn't an active session """
+    return remove_session(token)
+
+def session_get_user_token(u_id):
+    """ Returns one of the user's active tokens, or None if they are logged out """
+    return get_user_token(u_id)
+
+def session_generation(u_id):
+    """ The generation the user's tokens must have, None if they have never had one """
+    return get_token_generation(u_id)
+
+def session_new_generation(u_id):
+    """ Logs out every one of the user's tokens, returns the generation of their next ones """
+    generation = secrets.randbits(63)
+    set_token_generation(u_id, generation)
+    return generation
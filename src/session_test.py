@@ -0,0 +1,42 @@
+import threading
+from session import session_create, session_get, session_revoke, session_get_user_token
+from database import clear_database
+
+def test_session_create_and_get():
+    clear_database()
+    session_create('token', 1)
+    assert session_get('token')['u_id'] == 1
+    assert session_get_user_token(1) == 'token'
+
+def test_session_get_invalid():
+    clear_database()
+    assert session_get('not a token') is None
+    assert session_get(['unhashable']) is None
+    assert session_get_user_token(1) is None
+
+def test_session_revoke():
+    clear_database()
+    session_create('token', 1)
+    assert session_revoke('token') == True
+    assert session_get('token') is None
+    assert session_get_user_token(1) is None
+    assert session_revoke('token') == False
+
+def test_session_revoke_from_threads():
+    clear_database()
+    session_create('token', 1)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(session_revoke('token'))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(True) == 1
+    assert session_get_user_token(1) is None
+
+def test_session_multiple_per_user():
+    clear_database()
+    session_create('first', 1)
+    session_create('second', 1)
+    session_revoke('first')
+    assert session_get_user_token(1) == 'second'
@@ -0,0 +1,253 @@
+"""
+Binary snapshots of the database, written and loaded by persistence.py.
+
+Parsing every message of every channel on startup would make the server
+take longer to come up the more history it has, so the messages are kept
+in one length-prefixed block per channel and the snapshot is memory mapped.
+Only the small metadata is parsed up front, a channel's block is parsed the
+first time its messages are needed (see dict_storage.get_channel_messages).
+
+Layout, every number little-endian:
+
+    header      MAGIC, VERSION (u32), 4 bytes of padding
+    blocks      for each channel: message count (u32), 4 bytes of padding,
+                the message ids (u64 each, 0 for a removed message), then
+                each message as its length (u32) followed by that much JSON.
+                A removed message has length 0.
+    index       all the message ids (u64), sorted, followed by the id of the
+                channel each is in (u64), in the same order
+    metadata    JSON: seq, users, sessions, token_generations, next_ids and
+                the channels, each with 'messages_block': [offset, length]
+                instead of its messages and 'removed_positions', the
+                [message id, position] of each of its removed messages
+    footer      metadata offset, metadata length, index offset, number of
+                messages in the index (u64 each), MAGIC
+"""
+import os
+import json
+import mmap
+import struct
+import heapq
+from array import array
+from bisect import bisect_left
+from database import database, lazy_messages, add_user, add_channel
+from dict_storage import index_messages, load_lock
+from search_index import search_index_add
+
+MAGIC = b'FLOCKSNP'
+VERSION = 1
+HEADER = struct.Struct('<8sI4x')
+FOOTER = struct.Struct('<QQQQ8s')
+BLOCK_HEADER = struct.Struct('<I4x')
+LENGTH = struct.Struct('<I')
+ID_SIZE = 8
+
+# the snapshot we loaded, while some of its channels' messages aren't
+snapshot_source = {
+    # closed once nothing refers to it any more, see snapshot_take
+    'map': None,
+    # views of the index
+    'ids': None,
+    'channel_ids': None,
+    # channel id -> (offset, length) of its block, for the channels that
+    # aren't loaded yet
+    'blocks': {},
+}
+
+def snapshot_write(path, seq):
+    snapshot_save(path, snapshot_take(seq))
+
+def snapshot_take(seq):
+    """
+    A copy of the database as it is now, for snapshot_save to write out
+    while the database goes on changing. Called with dict_storage.journal's
+    lock held, so it only copies the containers: DictStorage replaces users
+    and messages rather than changing them, so they can be shared.
+    """
+    # so no channel gets loaded half way through
+    with load_lock:
+        channels = [{
+            **channel,
+            'owner_members_id': set(channel['owner_members_id']),
+            'all_members_id': set(channel['all_members_id']),
+            'messages': None if channel['messages'] is None else list(channel['messages']),
+            # a list of pairs, JSON's keys would be strings
+            'removed_positions': list(database['removed_positions'].get(channel['id'], {}).items()),
+        } for channel in database['channels'].values()]
+        return {
+            'metadata': {
+                'seq': seq,
+                'users': list(database['users'].values()),
+                'sessions': list(database['sessions'].values()),
+                'token_generations': list(database['token_generations'].items()),
+                'next_ids': dict(database['next_ids']),
+                'scheduled_messages': list(database['scheduled_messages'].values()),
+            },
+            'channels': channels,
+            # the channels that aren't loaded are copied from here, holding
+            # on to the map keeps it open even if they all get loaded meanwhile
+            'map': snapshot_source['map'],
+            'blocks': dict(snapshot_source['blocks']),
+        }
+
+def snapshot_save(path, taken):
+    """ Writes what snapshot_take returned to path """
+    with open(path, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, VERSION))
+
+        channels = []
+        # one sorted list of (message id, channel id) per channel
+        channel_indexes = []
+        for channel in taken['channels']:
+            offset = file.tell()
+            if channel['messages'] is None:
+                # never loaded since the last snapshot, copy it as it is
+                block_offset, block_length = taken['blocks'][channel['id']]
+                block = taken['map'][block_offset:block_offset + block_length]
+                ids = array('Q', block[BLOCK_HEADER.size:BLOCK_HEADER.size + ID_SIZE * len_of(block)])
+                file.write(block)
+            else:
+                ids = array('Q', (0 if message is None else message['message_id'] for message in channel['messages']))
+                write_block(file, ids, channel['messages'])
+            channels.append({
+                **channel,
+                'messages': None,
+                'messages_block': [offset, file.tell() - offset],
+            })
+            # sorted, a scheduled message's id is older than its place in the channel
+            channel_indexes.append(sorted((message_id, channel['id']) for message_id in ids if message_id != 0))
+
+        index_offset = file.tell()
+        index = list(heapq.merge(*channel_indexes))
+        file.write(array('Q', (message_id for message_id, _ in index)).tobytes())
+        file.write(array('Q', (channel_id for _, channel_id in index)).tobytes())
+
+        metadata_offset = file.tell()
+        metadata = to_json({**taken['metadata'], 'channels': channels}).encode()
+        file.write(metadata)
+        file.write(FOOTER.pack(metadata_offset, len(metadata), index_offset, len(index), MAGIC))
+        file.flush()
+        os.fsync(file.fileno())
+
+def write_block(file, ids, messages):
+    file.write(BLOCK_HEADER.pack(len(ids)))
+    file.write(ids.tobytes())
+    for message in messages:
+        data = b'' if message is None else to_json(message).encode()
+        file.write(LENGTH.pack(len(data)))
+        file.write(data)
+
+def snapshot_load(path):
+    """
+    Loads everything but the channels' messages, returns the sequence number
+    of the last change the snapshot includes.
+    """
+    snapshot_release()
+    with open(path, 'rb') as file:
+        snapshot = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version = HEADER.unpack_from(snapshot, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} isn't a version {VERSION} flockr snapshot")
+    metadata_offset, metadata_length, index_offset, count, _ = FOOTER.unpack_from(snapshot, len(snapshot) - FOOTER.size)
+    metadata = json.loads(snapshot[metadata_offset:metadata_offset + metadata_length])
+
+    view = memoryview(snapshot)
+    snapshot_source.update({
+        'map': snapshot,
+        'ids': view[index_offset:index_offset + ID_SIZE * count].cast('Q'),
+        'channel_ids': view[index_offset + ID_SIZE * count:index_offset + 2 * ID_SIZE * count].cast('Q'),
+        'blocks': {},
+    })
+    view.release()
+
+    for user in metadata['users']:
+        add_user(user)
+    for session in metadata['sessions']:
+        database['sessions'][session['token']] = session
+        database['user_sessions'].setdefault(session['u_id'], set()).add(session['token'])
+    database['token_generations'].update(metadata.get('token_generations', ()))
+    database['next_ids'].update(metadata['next_ids'])
+    for message in metadata.get('scheduled_messages', ()):
+        database['scheduled_messages'][message['message_id']] = message
+    for channel in metadata['channels']:
+        snapshot_source['blocks'][channel['id']] = tuple(channel.pop('messages_block'))
+        removed = channel.pop('removed_positions', ())
+        if removed:
+            database['removed_positions'][channel['id']] = dict(removed)
+        add_channel(channel_from_json(channel))
+
+    if snapshot_source['blocks']:
+        lazy_messages['load'] = load_messages
+        lazy_messages['locate'] = locate_message
+        lazy_messages['forget'] = forget_messages
+    else:
+        snapshot_release()
+    return metadata['seq']
+
+def snapshot_release():
+    """ Forgets the loaded snapshot, every channel must have been loaded first """
+    lazy_messages['load'] = None
+    lazy_messages['locate'] = None
+    lazy_messages['forget'] = None
+    for view in ('ids', 'channel_ids'):
+        if snapshot_source[view] is not None:
+            snapshot_source[view].release()
+            snapshot_source[view] = None
+    # not closed, a snapshot being saved may still be copying from it
+    snapshot_source.update({'map': None, 'blocks': {}})
+
+def load_messages(channel):
+    """ Called with dict_storage.load_lock held """
+    block = read_block(channel['id'])
+    count = len_of(block)
+    position = BLOCK_HEADER.size + ID_SIZE * count
+    messages = []
+    for _ in range(count):
+        (length,) = LENGTH.unpack_from(block, position)
+        position += LENGTH.size
+        messages.append(json.loads(block[position:position + length]) if length else None)
+        position += length
+
+    index_messages(channel, messages)
+    for message in messages:
+        if message is not None:
+            search_index_add(message)
+    # last, the readers that don't take the lock go by it
+    channel['messages'] = messages
+    del snapshot_source['blocks'][channel['id']]
+
+    if not snapshot_source['blocks']:
+        snapshot_release()
+
+def forget_messages(channel):
+    """ For a channel removed before its messages were loaded """
+    del snapshot_source['blocks'][channel['id']]
+    if not snapshot_source['blocks']:
+        snapshot_release()
+
+def locate_message(message_id):
+    """ The id of the channel the message was in when the snapshot was taken """
+    ids = snapshot_source['ids']
+    i = bisect_left(ids, message_id)
+    if i < len(ids) and ids[i] == message_id:
+        return snapshot_source['channel_ids'][i]
+    return None
+
+def read_block(channel_id):
+    offset, length = snapshot_source['blocks'][channel_id]
+    return snapshot_source['map'][offset:offset + length]
+
+def len_of(block):
+    return BLOCK_HEADER.unpack_from(block, 0)[0]
+
+def channel_from_json(channel):
+    return {
+        **channel,
+        'owner_members_id': set(channel['owner_members_id']),
+        'all_members_id': set(channel['all_members_id']),
+        'messages': None if channel['messages'] is None else list(channel['messages']),
+    }
+
+def to_json(value):
+    return json.dumps(value, default=sorted, separators=(',', ':'))
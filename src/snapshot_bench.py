@@ -0,0 +1,70 @@
+"""
+Benchmark: server startup time with a 1,000,000 message history, loading a
+binary snapshot (snapshot.py) against parsing a plain JSON dump of the same
+data, which is what a full load on startup costs.
+
+    python3 src/snapshot_bench.py [channels] [messages per channel]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+from auth import auth_register
+from channels import channels_create
+from channel import channel_messages
+from database import clear_database, database, get_channel, add_message, allocate_ids
+from password import password_set_cost
+from persistence import persistence_open, persistence_close, to_json, SNAPSHOT_FILE
+from snapshot import snapshot_write, channel_from_json
+
+def populate(channel_count, message_count):
+    password_set_cost(1)
+    user = auth_register('bench@gmail.com', 'benchpassword', 'Bench', 'User')
+    for i in range(channel_count):
+        channel = get_channel(channels_create(user['token'], f"channel {i}", is_public=True)['channel_id'])
+        # message_send would also index every message for search, which
+        # isn't what we are measuring
+        for message_id in allocate_ids('messages', message_count):
+            add_message(channel, {
+                'message_id': message_id,
+                'u_id': user['u_id'],
+                'message': f"message number {message_id} of the benchmark",
+                'time_created': 1582426789,
+            })
+    return user['token']
+
+def json_startup(path):
+    clear_database()
+    start = time.perf_counter()
+    with open(path) as file:
+        saved = json.load(file)
+    for channel in saved['channels']:
+        database['channels'][channel['id']] = channel_from_json(channel)
+    return time.perf_counter() - start
+
+def main(channel_count, message_count):
+    data_dir = tempfile.mkdtemp()
+    clear_database()
+    token = populate(channel_count, message_count)
+
+    json_path = os.path.join(data_dir, 'snapshot.json')
+    with open(json_path, 'w') as file:
+        file.write(to_json({'channels': list(database['channels'].values())}))
+    snapshot_write(os.path.join(data_dir, SNAPSHOT_FILE), 0)
+
+    print(f"startup with {channel_count} channels of {message_count} messages")
+    print(f"json dump        {json_startup(json_path):8.3f}s")
+
+    clear_database()
+    start = time.perf_counter()
+    persistence_open(data_dir)
+    print(f"binary snapshot  {time.perf_counter() - start:8.3f}s")
+
+    start = time.perf_counter()
+    channel_messages(token, 1, 0)
+    print(f"first read of a channel {time.perf_counter() - start:8.3f}s")
+    persistence_close()
+
+if __name__ == "__main__":
+    main(*([int(arg) for arg in sys.argv[1:3]] or [1000, 1000]))
@@ -0,0 +1,584 @@
+"""
+A storage backend (see storage.py) keeping everything in an SQLite database,
+for when the data no longer fits in memory.
+
+Every lookup the rest of the code makes is covered by a primary key or an
+index (see SCHEMA). The SQL is kept in constants, so sqlite3's statement
+cache prepares each statement once and reuses it afterwards.
+
+Committing every change on its own would cap us at a few hundred writes a
+second, so changes are committed in batches: once COMMIT_BATCH_SIZE of them
+are waiting, or every COMMIT_INTERVAL seconds, whichever comes first (like
+persistence.py groups its fsyncs). Each change runs in its own savepoint, so
+one that fails half way is undone without throwing away the rest of the
+batch.
+
+A shared storage is one that several processes use at once (see serve.py).
+It commits every change straight away, so the other processes see it on
+their next request, and it doesn't cache anything.
+"""
+import time
+import sqlite3
+import secrets
+import threading
+from contextlib import contextmanager
+from storage import Storage, normalise_email
+from error import InputError
+
+COMMIT_BATCH_SIZE = 256
+COMMIT_INTERVAL = 0.05
+# how long to wait for another process to finish writing
+BUSY_TIMEOUT = 30
+
+# bigger than any message's rowid, so 'sent before it' means every message
+NO_MESSAGE = 2 ** 63 - 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    email TEXT NOT NULL,
+    -- normalised email, see storage.normalise_email
+    email_key TEXT NOT NULL,
+    password TEXT NOT NULL,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL
+);
+-- unique, the workers of serve.py's prefork mode don't share locks.py's
+-- locks, so two of them could otherwise register the same email at once
+DROP INDEX IF EXISTS users_by_email;
+CREATE UNIQUE INDEX IF NOT EXISTS users_by_email_key ON users (email_key);
+
+CREATE TABLE IF NOT EXISTS channels (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    is_public INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS channel_members (
+    channel_id INTEGER NOT NULL,
+    u_id INTEGER NOT NULL,
+    PRIMARY KEY (channel_id, u_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS channel_members_by_user ON channel_members (u_id, channel_id);
+CREATE TABLE IF NOT EXISTS channel_owners (
+    channel_id INTEGER NOT NULL,
+    u_id INTEGER NOT NULL,
+    PRIMARY KEY (channel_id, u_id)
+) WITHOUT ROWID;
+
+-- the rowids go up as messages are sent, the message ids not quite:
+-- message_sendlater gives a message its id when it is scheduled
+CREATE TABLE IF NOT EXISTS messages (
+    message_id INTEGER NOT NULL UNIQUE,
+    channel_id INTEGER NOT NULL,
+    u_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    time_created INTEGER NOT NULL
+);
+-- the rowid is part of every entry, so this is each channel's history in order
+CREATE INDEX IF NOT EXISTS messages_by_channel ON messages (channel_id);
+-- where the removed messages were, they are still places to page from (see
+-- Storage.is_channel_message). New messages go after all of them, rather
+-- than reusing the rowid of the last message if it was removed.
+CREATE TABLE IF NOT EXISTS removed_messages (
+    position INTEGER PRIMARY KEY,
+    message_id INTEGER NOT NULL UNIQUE,
+    channel_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS removed_messages_by_channel ON removed_messages (channel_id);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    token TEXT PRIMARY KEY,
+    u_id INTEGER NOT NULL,
+    time_created INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_by_user ON sessions (u_id);
+-- see session.py
+CREATE TABLE IF NOT EXISTS token_generations (
+    u_id INTEGER PRIMARY KEY,
+    generation INTEGER NOT NULL
+);
+
+-- see search_index.py
+CREATE TABLE IF NOT EXISTS message_words (
+    word TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    PRIMARY KEY (word, message_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS message_words_by_message ON message_words (message_id);
+
+CREATE TABLE IF NOT EXISTS next_ids (
+    kind TEXT PRIMARY KEY,
+    next INTEGER NOT NULL
+);
+
+-- see message_sendlater
+CREATE TABLE IF NOT EXISTS scheduled_messages (
+    message_id INTEGER PRIMARY KEY,
+    channel_id INTEGER NOT NULL,
+    u_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    time_sent INTEGER NOT NULL
+);
+
+-- see response_cache.py
+CREATE TABLE IF NOT EXISTS versions (
+    key TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+"""
+
+TABLES = ('users', 'channels', 'channel_members', 'channel_owners', 'messages', 'removed_messages', 'sessions',
+          'token_generations', 'message_words', 'next_ids', 'scheduled_messages', 'versions')
+
+USER_FIELDS = ('id', 'email', 'password', 'first_name', 'last_name')
+CHANNEL_FIELDS = ('id', 'name', 'is_public')
+MESSAGE_FIELDS = ('message_id', 'u_id', 'message', 'time_created')
+SESSION_FIELDS = ('token', 'u_id', 'time_created')
+SCHEDULED_MESSAGE_FIELDS = ('message_id', 'channel_id', 'u_id', 'message', 'time_sent')
+
+SELECT_NEXT_ID = "SELECT next FROM next_ids WHERE kind = ?"
+SET_NEXT_ID = "INSERT OR REPLACE INTO next_ids (kind, next) VALUES (?, ?)"
+
+INSERT_USER = "INSERT INTO users (id, email, email_key, password, first_name, last_name) VALUES (?, ?, ?, ?, ?, ?)"
+SELECT_USER = "SELECT id, email, password, first_name, last_name FROM users WHERE id = ?"
+SELECT_USER_BY_EMAIL = "SELECT id, email, password, first_name, last_name FROM users WHERE email_key = ? LIMIT 1"
+SELECT_PROFILE = "SELECT first_name, last_name FROM users WHERE id = ?"
+
+INSERT_CHANNEL = "INSERT INTO channels (id, name, is_public) VALUES (?, ?, ?)"
+SELECT_CHANNEL = "SELECT id, name, is_public FROM channels WHERE id = ?"
+SELECT_CHANNELS = "SELECT id, name, is_public FROM channels ORDER BY id"
+DELETE_CHANNEL = "DELETE FROM channels WHERE id = ?"
+DELETE_CHANNEL_MEMBERS = "DELETE FROM channel_members WHERE channel_id = ?"
+DELETE_CHANNEL_OWNERS = "DELETE FROM channel_owners WHERE channel_id = ?"
+DELETE_CHANNEL_MESSAGES = "DELETE FROM messages WHERE channel_id = ?"
+DELETE_CHANNEL_REMOVED_MESSAGES = "DELETE FROM removed_messages WHERE channel_id = ?"
+DELETE_CHANNEL_WORDS = """
+DELETE FROM message_words WHERE message_id IN (SELECT message_id FROM messages WHERE channel_id = ?)
+"""
+INSERT_MEMBER = "INSERT OR IGNORE INTO channel_members (channel_id, u_id) VALUES (?, ?)"
+DELETE_MEMBER = "DELETE FROM channel_members WHERE channel_id = ? AND u_id = ?"
+SELECT_MEMBER = "SELECT 1 FROM channel_members WHERE channel_id = ? AND u_id = ?"
+SELECT_MEMBERS = "SELECT u_id FROM channel_members WHERE channel_id = ? ORDER BY u_id"
+SELECT_MEMBERS_AFTER = "SELECT u_id FROM channel_members WHERE channel_id = ? AND u_id > ? ORDER BY u_id LIMIT ?"
+SELECT_USER_CHANNELS = "SELECT channel_id FROM channel_members WHERE u_id = ?"
+INSERT_OWNER = "INSERT OR IGNORE INTO channel_owners (channel_id, u_id) VALUES (?, ?)"
+DELETE_OWNER = "DELETE FROM channel_owners WHERE channel_id = ? AND u_id = ?"
+SELECT_OWNER = "SELECT 1 FROM channel_owners WHERE channel_id = ? AND u_id = ?"
+SELECT_OWNERS = "SELECT u_id FROM channel_owners WHERE channel_id = ? ORDER BY u_id"
+
+INSERT_MESSAGE = """
+INSERT INTO messages (rowid, message_id, channel_id, u_id, message, time_created)
+VALUES (MAX((SELECT IFNULL(MAX(rowid), 0) FROM messages), (SELECT IFNULL(MAX(position), 0) FROM removed_messages)) + 1,
+        ?, ?, ?, ?, ?)
+"""
+SELECT_MESSAGE = """
+SELECT channels.id, channels.name, channels.is_public, message_id, u_id, message, time_created
+FROM messages JOIN channels ON channels.id = messages.channel_id
+WHERE message_id = ?
+"""
+SELECT_MESSAGE_CHANNEL = "SELECT channel_id FROM messages WHERE message_id = ?"
+SELECT_MESSAGE_SENT = "SELECT time_created, message_id, channel_id FROM messages WHERE message_id = ?"
+UPDATE_MESSAGE = "UPDATE messages SET message = ? WHERE message_id = ?"
+DELETE_MESSAGE = "DELETE FROM messages WHERE message_id = ?"
+INSERT_REMOVED_MESSAGE = """
+INSERT INTO removed_messages (position, message_id, channel_id)
+SELECT rowid, message_id, channel_id FROM messages WHERE message_id = ?
+"""
+SELECT_MESSAGE_ROWID = """
+SELECT rowid FROM messages WHERE message_id = ? AND channel_id = ?
+UNION ALL
+SELECT position FROM removed_messages WHERE message_id = ? AND channel_id = ?
+"""
+COUNT_MESSAGES = "SELECT COUNT(*) FROM messages WHERE channel_id = ? AND rowid < ?"
+SELECT_MESSAGES_PAGE = """
+SELECT message_id, u_id, message, time_created FROM messages
+WHERE channel_id = ? AND rowid < ?
+ORDER BY rowid DESC LIMIT ? OFFSET ?
+"""
+SELECT_ALL_MESSAGES = "SELECT message_id, u_id, message, time_created FROM messages ORDER BY rowid"
+
+INSERT_SESSION = "INSERT OR REPLACE INTO sessions (token, u_id, time_created) VALUES (?, ?, ?)"
+SELECT_SESSION = "SELECT token, u_id, time_created FROM sessions WHERE token = ?"
+DELETE_SESSION = "DELETE FROM sessions WHERE token = ?"
+SELECT_USER_TOKEN = "SELECT token FROM sessions WHERE u_id = ? LIMIT 1"
+SELECT_TOKEN_GENERATION = "SELECT generation FROM token_generations WHERE u_id = ?"
+SET_TOKEN_GENERATION = "INSERT OR REPLACE INTO token_generations (u_id, generation) VALUES (?, ?)"
+
+INSERT_WORD = "INSERT OR IGNORE INTO message_words (word, message_id) VALUES (?, ?)"
+DELETE_WORD = "DELETE FROM message_words WHERE word = ? AND message_id = ?"
+SELECT_WORD = "SELECT message_id FROM message_words WHERE word = ?"
+
+INSERT_SCHEDULED_MESSAGE = """
+INSERT INTO scheduled_messages (message_id, channel_id, u_id, message, time_sent) VALUES (?, ?, ?, ?, ?)
+"""
+SELECT_SCHEDULED_MESSAGE = "SELECT message_id, channel_id, u_id, message, time_sent FROM scheduled_messages WHERE message_id = ?"
+SELECT_SCHEDULED_MESSAGES = "SELECT message_id, channel_id, u_id, message, time_sent FROM scheduled_messages"
+DELETE_SCHEDULED_MESSAGE = "DELETE FROM scheduled_messages WHERE message_id = ?"
+
+BUMP_VERSION = """
+INSERT INTO versions (key, version) VALUES (?, 1)
+ON CONFLICT (key) DO UPDATE SET version = version + 1
+"""
+SELECT_VERSION = "SELECT version FROM versions WHERE key = ?"
+# OR IGNORE, another process sharing the database may have picked it first
+INSERT_EPOCH = "INSERT OR IGNORE INTO versions (key, version) VALUES ('epoch', ?)"
+
+class SQLiteStorage(Storage):
+    def __init__(self, path=':memory:', shared=False):
+        self.shared = shared
+        self.connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False, cached_statements=256, timeout=BUSY_TIMEOUT,
+        )
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        # with the WAL, a crash can't corrupt the database, only lose the
+        # last few commits
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.RLock()
+        self.uncommitted = 0
+        # user id -> the user's public profile, emptied by update_user
+        self.profiles = {}
+        with self.change() as connection:
+            connection.execute(INSERT_EPOCH, (secrets.randbits(32),))
+        if not shared:
+            threading.Thread(target=self.commit_periodically, daemon=True).start()
+
+    @contextmanager
+    def change(self):
+        """ Runs the statements made inside as one change of the current batch """
+        with self.lock:
+            connection = self.connection
+            if not connection.in_transaction:
+                # take the write lock now rather than on the first write, so
+                # that reading then writing (like allocate_ids) can't race
+                # another process
+                connection.execute('BEGIN IMMEDIATE')
+            connection.execute('SAVEPOINT change')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK TO change')
+                connection.execute('RELEASE change')
+                raise
+            connection.execute('RELEASE change')
+            self.uncommitted += 1
+            if self.shared or self.uncommitted >= COMMIT_BATCH_SIZE:
+                self.commit()
+
+    @contextmanager
+    def unique_emails(self):
+        """ Another process took the email after our check, see users_by_email_key """
+        try:
+            yield
+        except sqlite3.IntegrityError:
+            raise InputError("Email has been used.") from None
+
+    def commit(self):
+        if self.connection.in_transaction:
+            self.connection.execute('COMMIT')
+        self.uncommitted = 0
+
+    def commit_periodically(self):
+        while self.connection is not None:
+            time.sleep(COMMIT_INTERVAL)
+            self.sync()
+
+    def query(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def query_one(self, sql, parameters=()):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchone()
+
+    def clear(self):
+        with self.change() as connection:
+            for table in TABLES:
+                connection.execute(f"DELETE FROM {table}")
+            connection.execute(INSERT_EPOCH, (secrets.randbits(32),))
+        self.profiles.clear()
+
+    def sync(self):
+        with self.lock:
+            if self.connection is not None:
+                self.commit()
+
+    def close(self):
+        with self.lock:
+            if self.connection is None:
+                return
+            self.commit()
+            self.connection.close()
+            self.connection = None
+
+    def allocate_ids(self, kind, count=1):
+        with self.change() as connection:
+            row = connection.execute(SELECT_NEXT_ID, (kind,)).fetchone()
+            first = 1 if row is None else row[0]
+            connection.execute(SET_NEXT_ID, (kind, first + count))
+        return range(first, first + count)
+
+    # Users
+
+    def add_user(self, user):
+        self.add_users([user])
+
+    def add_users(self, users):
+        with self.unique_emails(), self.change() as connection:
+            connection.executemany(INSERT_USER, ((
+                user['id'], user['email'], normalise_email(user['email']),
+                user['password'], user['first_name'], user['last_name'],
+            ) for user in users))
+
+    def get_user(self, u_id):
+        if not isinstance(u_id, int):
+            return None
+        row = self.query_one(SELECT_USER, (u_id,))
+        return None if row is None else dict(zip(USER_FIELDS, row))
+
+    def get_users(self, u_ids):
+        users = []
+        for u_id in u_ids:
+            user = self.get_user(u_id)
+            if user is None:
+                raise KeyError(u_id)
+            users.append(user)
+        return users
+
+    def get_user_profiles(self, u_ids):
+        result = []
+        for u_id in u_ids:
+            profile = self.profiles.get(u_id)
+            if profile is None:
+                row = self.query_one(SELECT_PROFILE, (u_id,))
+                if row is None:
+                    raise KeyError(u_id)
+                profile = {
+                    'u_id': u_id,
+                    'name_first': row[0],
+                    'name_last': row[1],
+                }
+                if not self.shared:
+                    self.profiles[u_id] = profile
+            result.append(profile)
+        return result
+
+    def update_user(self, u_id, changes):
+        columns = {field: changes[field] for field in USER_FIELDS[1:] if field in changes}
+        if 'email' in columns:
+            columns['email_key'] = normalise_email(columns['email'])
+        # only a handful of different statements, so they stay cached too
+        assignments = ', '.join(f"{column} = ?" for column in columns)
+        with self.unique_emails(), self.change() as connection:
+            connection.execute(f"UPDATE users SET {assignments} WHERE id = ?", (*columns.values(), u_id))
+        self.profiles.pop(u_id, None)
+
+    def get_user_by_email(self, email):
+        row = self.query_one(SELECT_USER_BY_EMAIL, (normalise_email(email),))
+        return None if row is None else dict(zip(USER_FIELDS, row))
+
+    # Channels
+
+    def add_channel(self, channel):
+        with self.change() as connection:
+            connection.execute(INSERT_CHANNEL, (channel['id'], channel['name'], channel['is_public']))
+            connection.executemany(INSERT_MEMBER, ((channel['id'], u_id) for u_id in channel['all_members_id']))
+            connection.executemany(INSERT_OWNER, ((channel['id'], u_id) for u_id in channel['owner_members_id']))
+            connection.executemany(INSERT_MESSAGE, (
+                (message['message_id'], channel['id'], message['u_id'], message['message'], message['time_created'])
+                for message in channel.get('messages') or () if message is not None
+            ))
+
+    def get_channel(self, channel_id):
+        if not isinstance(channel_id, int):
+            return None
+        row = self.query_one(SELECT_CHANNEL, (channel_id,))
+        return None if row is None else channel_from_row(row)
+
+    def get_channels(self):
+        return [channel_from_row(row) for row in self.query(SELECT_CHANNELS)]
+
+    def remove_channel(self, channel_id):
+        with self.change() as connection:
+            for sql in (DELETE_CHANNEL, DELETE_CHANNEL_MEMBERS, DELETE_CHANNEL_OWNERS, DELETE_CHANNEL_WORDS,
+                        DELETE_CHANNEL_MESSAGES, DELETE_CHANNEL_REMOVED_MESSAGES):
+                connection.execute(sql, (channel_id,))
+
+    def add_channel_member(self, channel, u_id):
+        with self.change() as connection:
+            connection.execute(INSERT_MEMBER, (channel['id'], u_id))
+
+    def remove_channel_member(self, channel, u_id):
+        with self.change() as connection:
+            connection.execute(DELETE_MEMBER, (channel['id'], u_id))
+
+    def add_channel_owner(self, channel, u_id):
+        with self.change() as connection:
+            connection.execute(INSERT_OWNER, (channel['id'], u_id))
+
+    def remove_channel_owner(self, channel, u_id):
+        with self.change() as connection:
+            connection.execute(DELETE_OWNER, (channel['id'], u_id))
+
+    def is_channel_member(self, channel, u_id):
+        return self.query_one(SELECT_MEMBER, (channel['id'], u_id)) is not None
+
+    def is_channel_owner(self, channel, u_id):
+        return self.query_one(SELECT_OWNER, (channel['id'], u_id)) is not None
+
+    def get_channel_member_ids(self, channel):
+        return [u_id for (u_id,) in self.query(SELECT_MEMBERS, (channel['id'],))]
+
+    def get_channel_owner_ids(self, channel):
+        return [u_id for (u_id,) in self.query(SELECT_OWNERS, (channel['id'],))]
+
+    def get_channel_members_after(self, channel, u_id, limit):
+        return [member for (member,) in self.query(SELECT_MEMBERS_AFTER, (channel['id'], u_id, limit))]
+
+    def get_user_channel_ids(self, u_id):
+        return {channel_id for (channel_id,) in self.query(SELECT_USER_CHANNELS, (u_id,))}
+
+    # Messages
+
+    def add_message(self, channel, message):
+        with self.change() as connection:
+            connection.execute(INSERT_MESSAGE, (
+                message['message_id'], channel['id'], message['u_id'], message['message'], message['time_created'],
+            ))
+
+    def get_message(self, message_id):
+        if not isinstance(message_id, int):
+            return None, None
+        row = self.query_one(SELECT_MESSAGE, (message_id,))
+        if row is None:
+            return None, None
+        return channel_from_row(row[:3]), dict(zip(MESSAGE_FIELDS, row[3:]))
+
+    def get_message_channel_id(self, message_id):
+        if not isinstance(message_id, int):
+            return None
+        row = self.query_one(SELECT_MESSAGE_CHANNEL, (message_id,))
+        return None if row is None else row[0]
+
+    def get_messages_sent(self, message_ids):
+        sent = []
+        for message_id in message_ids:
+            row = self.query_one(SELECT_MESSAGE_SENT, (message_id,))
+            if row is not None:
+                sent.append(row)
+        return sent
+
+    def edit_message(self, message_id, text):
+        with self.change() as connection:
+            connection.execute(UPDATE_MESSAGE, (text, message_id))
+
+    def remove_message(self, message_id):
+        with self.change() as connection:
+            connection.execute(INSERT_REMOVED_MESSAGE, (message_id,))
+            connection.execute(DELETE_MESSAGE, (message_id,))
+
+    def is_channel_message(self, channel, message_id):
+        if not isinstance(message_id, int):
+            return False
+        return self.query_one(SELECT_MESSAGE_ROWID, (message_id, channel['id']) * 2) is not None
+
+    def count_channel_messages(self, channel, before_message_id=None):
+        return self.query_one(COUNT_MESSAGES, (channel['id'], self.rowid_of(channel, before_message_id)))[0]
+
+    def get_channel_messages_page(self, channel, start, count, before_message_id=None):
+        rows = self.query(SELECT_MESSAGES_PAGE, (channel['id'], self.rowid_of(channel, before_message_id), count, start))
+        return [dict(zip(MESSAGE_FIELDS, row)) for row in rows]
+
+    def get_all_messages(self):
+        return [dict(zip(MESSAGE_FIELDS, row)) for row in self.query(SELECT_ALL_MESSAGES)]
+
+    def rowid_of(self, channel, message_id):
+        """ Where the channel's message is in the order messages were sent, NO_MESSAGE for None """
+        if message_id is None:
+            return NO_MESSAGE
+        return self.query_one(SELECT_MESSAGE_ROWID, (message_id, channel['id']) * 2)[0]
+
+    # Sessions
+
+    def add_session(self, token, u_id):
+        with self.change() as connection:
+            connection.execute(INSERT_SESSION, (token, u_id, int(time.time())))
+
+    def get_session(self, token):
+        if not isinstance(token, str):
+            return None
+        row = self.query_one(SELECT_SESSION, (token,))
+        return None if row is None else dict(zip(SESSION_FIELDS, row))
+
+    def remove_session(self, token):
+        if not isinstance(token, str):
+            return False
+        with self.change() as connection:
+            removed = connection.execute(DELETE_SESSION, (token,)).rowcount
+        return removed > 0
+
+    def get_user_token(self, u_id):
+        row = self.query_one(SELECT_USER_TOKEN, (u_id,))
+        return None if row is None else row[0]
+
+    def get_token_generation(self, u_id):
+        row = self.query_one(SELECT_TOKEN_GENERATION, (u_id,))
+        return None if row is None else row[0]
+
+    def set_token_generation(self, u_id, generation):
+        with self.change() as connection:
+            connection.execute(SET_TOKEN_GENERATION, (u_id, generation))
+
+    # Search
+
+    def index_words(self, message_id, words):
+        with self.change() as connection:
+            connection.executemany(INSERT_WORD, ((word, message_id) for word in words))
+
+    def unindex_words(self, message_id, words):
+        with self.change() as connection:
+            connection.executemany(DELETE_WORD, ((word, message_id) for word in words))
+
+    def find_words(self, words):
+        postings = sorted(({message_id for (message_id,) in self.query(SELECT_WORD, (word,))} for word in words), key=len)
+        return postings[0].intersection(*postings[1:])
+
+    # Scheduled messages
+
+    def add_scheduled_message(self, message):
+        with self.change() as connection:
+            connection.execute(INSERT_SCHEDULED_MESSAGE, tuple(message[field] for field in SCHEDULED_MESSAGE_FIELDS))
+
+    def get_scheduled_message(self, message_id):
+        if not isinstance(message_id, int):
+            return None
+        row = self.query_one(SELECT_SCHEDULED_MESSAGE, (message_id,))
+        return None if row is None else dict(zip(SCHEDULED_MESSAGE_FIELDS, row))
+
+    def get_scheduled_messages(self):
+        return [dict(zip(SCHEDULED_MESSAGE_FIELDS, row)) for row in self.query(SELECT_SCHEDULED_MESSAGES)]
+
+    def remove_scheduled_message(self, message_id):
+        if not isinstance(message_id, int):
+            return False
+        # the write lock is held from the start of the change, so of two
+        # processes deleting it at once only one finds the row
+        with self.change() as connection:
+            removed = connection.execute(DELETE_SCHEDULED_MESSAGE, (message_id,)).rowcount
+        return removed > 0
+
+    # Versions
+
+    def bump_versions(self, keys):
+        with self.change() as connection:
+            connection.executemany(BUMP_VERSION, ((key,) for key in keys))
+
+    def get_versions(self, keys):
+        with self.lock:
+            rows = [self.connection.execute(SELECT_VERSION, (key,)).fetchone() for key in keys]
+        return tuple(0 if row is None else row[0] for row in rows)
+
+def channel_from_row(row):
+    channel = dict(zip(CHANNEL_FIELDS, row))
+    channel['is_public'] = bool(channel['is_public'])
+    return channel
@@ -0,0 +1,129 @@
+"""
+Standups: for length seconds after standup_start, the messages members send
+with standup_send are collected instead of being sent, then sent as one
+message from the user who started it, a line per message:
+
+    Hayden: did the tests
+    Rob: fixed the login bug
+
+Each standup buffers its lines in a list (appending is O(1)) and joins them
+once, when the scheduler (see scheduler.py) runs standup_finish. So a
+hundred standups at once are a hundred entries in the scheduler's heap, not
+a hundred threads.
+
+Standups are only kept in memory: one running when the server stops is
+lost, and with serve.py's prefork mode a standup only exists in the worker
+process that started it.
+"""
+import time
+from database import get_channel, is_channel_member, get_user_profiles, get_versions
+from auth import auth_get_current_user_id_from_token
+from message import send_message, MAX_MESSAGE_LENGTH
+from scheduler import schedule_at
+from locks import locked, channel_key
+from error import InputError, AccessError
+
+# channel id -> the channel's standup, maybe finished but not sent yet
+standups = {
+    # 1: {
+    #     "u_id": 1,
+    #     "time_finish": 1582426789,
+    #     "lines": ["Hayden: did the tests"],
+    #     # the storage's epoch when it started, see active_standup
+    #     "epoch": 1234,
+    # },
+}
+
+def standup_start(token, channel_id, length):
+    """ Returns when the standup finishes, as a unix timestamp """
+    u_id = auth_get_current_user_id_from_token(token)
+
+    if length <= 0:
+        raise InputError(f"length must be positive, got {length}")
+
+    with locked(channel_key(channel_id)):
+        member_channel(u_id, channel_id)
+
+        if active_standup(channel_id) is not None:
+            raise InputError(f"A standup is already running in channel {channel_id}")
+
+        standup = standups[channel_id] = {
+            'u_id': u_id,
+            'time_finish': int(time.time() + length),
+            'lines': [],
+            'epoch': get_versions(('epoch',))[0],
+        }
+    schedule_at(standup['time_finish'], standup_finish, channel_id, standup)
+
+    return {
+        'time_finish': standup['time_finish'],
+    }
+
+def standup_active(token, channel_id):
+    auth_get_current_user_id_from_token(token)
+
+    if get_channel(channel_id) is None:
+        raise InputError(f"{channel_id} is invalid channel")
+
+    standup = active_standup(channel_id)
+    return {
+        'is_active': standup is not None,
+        'time_finish': None if standup is None else standup['time_finish'],
+    }
+
+def standup_send(token, channel_id, message):
+    u_id = auth_get_current_user_id_from_token(token)
+
+    with locked(channel_key(channel_id)):
+        member_channel(u_id, channel_id)
+
+        if len(message) > MAX_MESSAGE_LENGTH:
+            raise InputError(f"Message is more than {MAX_MESSAGE_LENGTH} characters")
+
+        standup = active_standup(channel_id)
+        if standup is None:
+            raise InputError(f"No standup is running in channel {channel_id}")
+
+        name = get_user_profiles([u_id])[0]['name_first']
+        standup['lines'].append(f"{name}: {message}")
+
+    return {
+    }
+
+def standup_finish(channel_id, standup):
+    """ Runs on the scheduler's thread when the standup is over, sends its summary """
+    with locked(channel_key(channel_id)):
+        if standups.get(channel_id) is standup:
+            del standups[channel_id]
+        # while locked, a standup_send may have got in just before the end
+        summary = '\n'.join(standup['lines'])
+
+    if not summary or standup['epoch'] != get_versions(('epoch',))[0]:
+        # nobody said anything, or everything was cleared since
+        return
+    try:
+        send_message(standup['u_id'], channel_id, summary, max_length=None)
+    except (InputError, AccessError):
+        # the user who started it left the channel, or it was removed
+        pass
+
+# helpers
+def active_standup(channel_id):
+    """ The channel's standup if one is running, or None """
+    standup = standups.get(channel_id)
+    if standup is None or standup['time_finish'] <= time.time():
+        return None
+    # left over from before the data was cleared
+    if standup['epoch'] != get_versions(('epoch',))[0]:
+        return None
+    return standup
+
+def member_channel(u_id, channel_id):
+    channel = get_channel(channel_id)
+    if channel is None:
+        raise InputError(f"{channel_id} is invalid channel")
+
+    if not is_channel_member(channel, u_id):
+        raise AccessError(f"user {u_id} has not joined channel {channel_id}")
+
+    return channel
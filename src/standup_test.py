@@ -0,0 +1,100 @@
+import time
+import pytest
+from standup import standup_start, standup_active, standup_send
+from message import message_send
+from channel import channel_messages, channel_join, channel_leave
+from channels import channels_create
+from auth import auth_register
+from scheduler import run_due
+from database import clear_database
+from error import InputError, AccessError
+
+@pytest.fixture
+def users():
+    clear_database()
+    usera = auth_register("email@a.com", "averylongpassword", "Alice", "LastA")
+    userb = auth_register("email@b.com", "averylongpassword", "Bob", "LastB")
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    channel_join(userb['token'], channel_id)
+    yield usera, userb, channel_id
+    clear_database()
+
+def channel_message_texts(token, channel_id):
+    return [message['message'] for message in channel_messages(token, channel_id, 0)['messages']]
+
+def test_standup(users):
+    usera, userb, channel_id = users
+    assert standup_active(usera['token'], channel_id) == {'is_active': False, 'time_finish': None}
+
+    time_finish = standup_start(usera['token'], channel_id, 60)['time_finish']
+    assert time_finish >= time.time() + 59
+    assert standup_active(userb['token'], channel_id) == {'is_active': True, 'time_finish': time_finish}
+    with pytest.raises(InputError):
+        standup_start(userb['token'], channel_id, 60)
+
+    standup_send(usera['token'], channel_id, 'did the tests')
+    standup_send(userb['token'], channel_id, 'fixed the login bug')
+    message_send(userb['token'], channel_id, 'sent straight away')
+    assert channel_message_texts(usera['token'], channel_id) == ['sent straight away']
+
+    run_due(time_finish)
+    messages = channel_messages(usera['token'], channel_id, 0)['messages']
+    assert messages[0]['message'] == 'Alice: did the tests\nBob: fixed the login bug'
+    assert messages[0]['u_id'] == usera['u_id']
+    assert standup_active(usera['token'], channel_id)['is_active'] is False
+    with pytest.raises(InputError):
+        standup_send(usera['token'], channel_id, 'too late')
+
+    # the next one can start, and a quiet one sends nothing
+    time_finish = standup_start(userb['token'], channel_id, 60)['time_finish']
+    run_due(time_finish)
+    assert len(channel_message_texts(usera['token'], channel_id)) == 2
+
+def test_standup_long_summary(users):
+    usera, userb, channel_id = users
+    time_finish = standup_start(usera['token'], channel_id, 60)['time_finish']
+    for _ in range(3):
+        standup_send(userb['token'], channel_id, 'a' * 1000)
+    run_due(time_finish)
+    assert len(channel_message_texts(usera['token'], channel_id)[0]) == 3 * len('Bob: ' + 'a' * 1000) + 2
+
+def test_standup_errors(users):
+    usera, userb, channel_id = users
+    with pytest.raises(InputError):
+        standup_start(usera['token'], channel_id + 1, 60)
+    with pytest.raises(InputError):
+        standup_start(usera['token'], channel_id, 0)
+    with pytest.raises(InputError):
+        standup_active(usera['token'], channel_id + 1)
+    with pytest.raises(InputError):
+        standup_send(usera['token'], channel_id, 'nothing running')
+
+    standup_start(usera['token'], channel_id, 60)
+    with pytest.raises(InputError):
+        standup_send(usera['token'], channel_id, 'a' * 1001)
+    channel_leave(userb['token'], channel_id)
+    with pytest.raises(AccessError):
+        standup_send(userb['token'], channel_id, 'left')
+    with pytest.raises(AccessError):
+        standup_start(userb['token'], channel_id, 60)
+
+def test_standup_forgotten_by_clear(users):
+    usera, _, channel_id = users
+    time_finish = standup_start(usera['token'], channel_id, 60)['time_finish']
+    standup_send(usera['token'], channel_id, 'before the clear')
+    clear_database()
+    usera = auth_register("email@a.com", "averylongpassword", "Alice", "LastA")
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    assert standup_active(usera['token'], channel_id)['is_active'] is False
+    run_due(time_finish)
+    assert channel_message_texts(usera['token'], channel_id) == []
+
+def test_standups_share_the_scheduler(users):
+    usera, _, _ = users
+    channel_ids = [channels_create(usera['token'], f"channel {i}", is_public=True)['channel_id'] for i in range(100)]
+    finishes = [standup_start(usera['token'], channel_id, 60 + i % 5)['time_finish'] for i, channel_id in enumerate(channel_ids)]
+    for channel_id in channel_ids:
+        standup_send(usera['token'], channel_id, f"in {channel_id}")
+    run_due(max(finishes))
+    for channel_id in channel_ids:
+        assert channel_message_texts(usera['token'], channel_id) == [f"Alice: in {channel_id}"]
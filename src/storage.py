@@ -0,0 +1,313 @@
+"""
+The interface every storage backend implements. database.py forwards each
+of its helpers to the backend in use, so the rest of the code never knows
+which one it is talking to:
+
+    DictStorage     (dict_storage.py) everything in memory, the default
+    SQLiteStorage   (sqlite_storage.py) tables on disk, for data sets that
+                    don't fit in memory
+
+Users, channels, messages and sessions are plain dicts with the fields shown
+in dict_storage.py. A backend may hand out its own dicts rather than copies,
+so callers must only change them through these methods.
+"""
+import re
+from abc import ABC, abstractmethod
+
+WORD_REGEX = re.compile(r'\w+')
+
+def normalise_email(email):
+    return email.strip().lower()
+
+def words_of(text):
+    """ The words search_index.py indexes text by, lower case """
+    return set(WORD_REGEX.findall(text.lower()))
+
+class Storage(ABC):
+    @abstractmethod
+    def clear(self):
+        raise NotImplementedError
+
+    def sync(self):
+        """ Makes sure every change so far is durable, if the backend can """
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def allocate_ids(self, kind, count=1):
+        """
+        Reserves count consecutive ids for kind and returns them as a range.
+        Ids are never handed out twice (until the storage is cleared), even
+        if the entity that had them is removed.
+        """
+        raise NotImplementedError
+
+    # Users
+
+    @abstractmethod
+    def add_user(self, user):
+        """ Raises InputError if the (normalised) email is already used """
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_users(self, users):
+        """
+        Adds all of them or, if one can't be added (see add_user, two of
+        them having the same email counts too), none
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_user(self, u_id):
+        """ Returns None if there is no user with that id """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_users(self, u_ids):
+        """ Raises KeyError if one of the ids isn't a user's """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_user_profiles(self, u_ids):
+        """
+        The public profiles ({u_id, name_first, name_last}) of the users, in
+        the same order. Raises KeyError if one of the ids isn't a user's.
+        Profiles may be cached and shared between callers, so don't modify
+        them.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_user(self, u_id, changes):
+        """ Changes the user's fields """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_user_by_email(self, email):
+        """ Returns None if there is no user with that (normalised) email """
+        raise NotImplementedError
+
+    # Channels
+
+    @abstractmethod
+    def add_channel(self, channel):
+        """ channel has its owner_members_id and all_members_id sets filled in """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_channel(self, channel_id):
+        """ Returns None if there is no channel with that id """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_channels(self):
+        """ Every channel, in the order they were created """
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_channel(self, channel_id):
+        """
+        Removes the channel, its members and owners and its messages. Its id
+        isn't handed out again (see allocate_ids).
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_channel_member(self, channel, u_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_channel_member(self, channel, u_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_channel_owner(self, channel, u_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_channel_owner(self, channel, u_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def is_channel_member(self, channel, u_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def is_channel_owner(self, channel, u_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_channel_member_ids(self, channel):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_channel_owner_ids(self, channel):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_channel_members_after(self, channel, u_id, limit):
+        """ The (at most limit) lowest member ids greater than u_id, in order """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_user_channel_ids(self, u_id):
+        """ The ids of the channels the user is a member of """
+        raise NotImplementedError
+
+    # Messages
+
+    @abstractmethod
+    def add_message(self, channel, message):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_message(self, message_id):
+        """ Returns (channel, message), or (None, None) if there is no such message """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_message_channel_id(self, message_id):
+        """ Returns None if there is no such message """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_messages_sent(self, message_ids):
+        """
+        (time_created, message_id, channel_id) for each of the messages that
+        still exists, without reading the rest of them
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def edit_message(self, message_id, text):
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_message(self, message_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def is_channel_message(self, channel, message_id):
+        """
+        Whether the message was sent to the channel, even if it has been
+        removed since: a removed message keeps its place, so clients paging
+        from it don't have to start over
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def count_channel_messages(self, channel, before_message_id=None):
+        """
+        How many messages the channel has, or how many were sent to it
+        before before_message_id, which must be one of its messages (see
+        is_channel_message)
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_channel_messages_page(self, channel, start, count, before_message_id=None):
+        """
+        Up to count of the channel's messages, most recent first, skipping
+        the start most recent ones (only counting those sent before
+        before_message_id, if it is given)
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_all_messages(self):
+        """ Every message of every channel """
+        raise NotImplementedError
+
+    def load_all_messages(self):
+        """ Makes sure no channel's messages are waiting to be loaded """
+
+    def load_channels_messages(self, channel_ids):
+        """ Makes sure none of these channels' messages are waiting to be loaded """
+
+    # Sessions, see session.py
+
+    @abstractmethod
+    def add_session(self, token, u_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_session(self, token):
+        """ Returns None if the token isn't an active session """
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_session(self, token):
+        """ Returns False if the token wasn't an active session """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_user_token(self, u_id):
+        """ Returns one of the user's active tokens, or None """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_token_generation(self, u_id):
+        """ The user's token generation (see session.py), or None if they don't have one """
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_token_generation(self, u_id, generation):
+        raise NotImplementedError
+
+    # Search, see search_index.py
+
+    @abstractmethod
+    def index_words(self, message_id, words):
+        raise NotImplementedError
+
+    @abstractmethod
+    def unindex_words(self, message_id, words):
+        raise NotImplementedError
+
+    @abstractmethod
+    def find_words(self, words):
+        """ The ids of the messages that contain every one of words """
+        raise NotImplementedError
+
+    # Scheduled messages, see message_sendlater
+
+    @abstractmethod
+    def add_scheduled_message(self, message):
+        """ message has a message_id, channel_id, u_id, message and time_sent """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_scheduled_message(self, message_id):
+        """ Returns None if no message with that id is waiting to be sent """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_scheduled_messages(self):
+        """ Every message waiting to be sent """
+        raise NotImplementedError
+
+    @abstractmethod
+    def remove_scheduled_message(self, message_id):
+        """
+        Returns False if no message with that id was waiting to be sent. Only
+        one of several callers removing the same message gets True, even
+        from different processes, so only that one sends it.
+        """
+        raise NotImplementedError
+
+    # Versions, see response_cache.py
+
+    @abstractmethod
+    def bump_versions(self, keys):
+        """ Adds one to the version of each of keys, they all start at 0 """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_versions(self, keys):
+        """
+        The versions of keys, as a tuple. The version of 'epoch' is a random
+        number picked whenever the storage is created or cleared, so versions
+        counted from 0 again are never mistaken for the ones before.
+        """
+        raise NotImplementedError
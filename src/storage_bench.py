@@ -0,0 +1,86 @@
+"""
+Benchmark: the same workload, through the public functions, against each
+storage backend (see storage.py): the in-memory DictStorage, SQLiteStorage
+in memory, and SQLiteStorage on disk.
+
+    python3 src/storage_bench.py [users] [messages per user]
+"""
+import os
+import sys
+import time
+import tempfile
+from auth import auth_register, auth_login
+from channel import channel_join, channel_details, channel_messages
+from channels import channels_create, channels_list, channels_listall
+from message import message_send, message_edit
+from database import clear_database, use_storage, sync_database
+from dict_storage import DictStorage
+from sqlite_storage import SQLiteStorage
+from password import password_set_cost
+
+CHANNELS = 20
+
+def workload(user_count, message_count):
+    """ Returns how long each step took, in seconds """
+    timings = {}
+
+    def step(name, function):
+        start = time.perf_counter()
+        result = function()
+        timings[name] = time.perf_counter() - start
+        return result
+
+    users = step('register', lambda: [
+        auth_register(f"user{i}@gmail.com", 'benchpassword', 'Bench', f"User{i}") for i in range(user_count)
+    ])
+    token = users[0]['token']
+    channel_ids = step('create', lambda: [
+        channels_create(token, f"channel {i}", is_public=True)['channel_id'] for i in range(CHANNELS)
+    ])
+    # user i joins channel i % CHANNELS, the first user owns them all
+    step('join', lambda: [
+        channel_join(user['token'], channel_ids[i % CHANNELS]) for i, user in enumerate(users) if i > 0
+    ])
+    members = [users[i or CHANNELS]['token'] for i in range(CHANNELS)]
+    message_ids = step('send', lambda: [
+        message_send(user['token'], channel_ids[i % CHANNELS], f"message {n} from {i}")['message_id']
+        for n in range(message_count) for i, user in enumerate(users) if i > 0
+    ])
+    step('edit', lambda: [message_edit(token, message_id, 'edited') for message_id in message_ids[::10]])
+    step('sync', sync_database)
+    step('login', lambda: [auth_login(f"user{i}@gmail.com", 'benchpassword') for i in range(user_count)])
+    step('list', lambda: [channels_list(user['token']) for user in users] + [channels_listall(token)])
+    step('details', lambda: [channel_details(members[i], channel_id) for i, channel_id in enumerate(channel_ids)])
+    step('messages', lambda: [
+        channel_messages(members[i], channel_id, start)
+        for i, channel_id in enumerate(channel_ids) for start in range(0, message_count * user_count // CHANNELS, 50)
+    ])
+    return timings
+
+def run(name, backend, user_count, message_count):
+    previous = use_storage(backend)
+    clear_database()
+    try:
+        timings = workload(user_count, message_count)
+    finally:
+        use_storage(previous)
+        backend.close()
+        clear_database()
+    print(f"{name:<14}" + ''.join(f"{seconds:9.3f}" for seconds in timings.values()) + f"{sum(timings.values()):9.3f}")
+    return timings
+
+def main(user_count, message_count=10):
+    if user_count <= CHANNELS:
+        raise ValueError(f"needs more than {CHANNELS} users: one to own the channels and at least one to join each")
+    # hashing isn't what we are measuring
+    password_set_cost(1)
+    print(f"{user_count} users, {user_count * message_count} messages, {CHANNELS} channels, seconds per step")
+    steps = ['register', 'create', 'join', 'send', 'edit', 'sync', 'login', 'list', 'details', 'messages', 'total']
+    print(f"{'':<14}" + ''.join(f"{step:>9}" for step in steps))
+    run('dict', DictStorage(), user_count, message_count)
+    run('sqlite memory', SQLiteStorage(), user_count, message_count)
+    with tempfile.TemporaryDirectory() as directory:
+        run('sqlite file', SQLiteStorage(os.path.join(directory, 'flockr.db')), user_count, message_count)
+
+if __name__ == "__main__":
+    main(*([int(arg) for arg in sys.argv[1:3]] or [2000, 10]))
@@ -0,0 +1,299 @@
+import sys
+import time
+import threading
+import pytest
+from auth import auth_register, auth_login, auth_logout
+from channel import channel_invite, channel_details, channel_details_paged, channel_messages, channel_leave, \
+    channel_join, channel_addowner, channel_removeowner, channel_messages_after
+from channels import channels_create, channels_list, channels_listall
+from message import message_send, message_edit, message_remove, message_sendlater
+from scheduler import run_due
+from other import search
+from user import user_profile_setname
+from database import clear_database, use_storage, get_channel, get_versions, channel_version, user_version, \
+    get_scheduled_message, remove_scheduled_message, bump_versions
+from storage import Storage
+from dict_storage import DictStorage, database, TIDY_BATCH_SIZE
+from sqlite_storage import SQLiteStorage
+from error import InputError, AccessError
+
+@pytest.fixture(params=['dict', 'sqlite'])
+def backend(request):
+    backend = DictStorage() if request.param == 'dict' else SQLiteStorage()
+    previous = use_storage(backend)
+    clear_database()
+    yield backend
+    use_storage(previous)
+    backend.close()
+    clear_database()
+
+def test_storage_users_and_sessions(backend):
+    user = auth_register("hello@gmail.com", "veryverysafe", "safety", "first")
+    assert auth_login("hello@gmail.com", "veryverysafe") == user
+    assert auth_logout(user['token']) == {'is_success': True}
+    assert auth_logout(user['token']) == {'is_success': False}
+    with pytest.raises(AccessError):
+        channels_list(user['token'])
+    with pytest.raises(InputError):
+        auth_register("hello@gmail.com", "veryverysafe", "safety", "first")
+
+def test_storage_add_users_checks_emails(backend):
+    def new_user(u_id, email):
+        return {'id': u_id, 'email': email, 'password': 'hash', 'first_name': 'First', 'last_name': 'Last'}
+
+    backend.add_user(new_user(1, 'one@gmail.com'))
+    with pytest.raises(InputError):
+        backend.add_user(new_user(2, ' ONE@gmail.com'))
+    # all or nothing, whether the email is taken or used twice in the batch
+    with pytest.raises(InputError):
+        backend.add_users([new_user(2, 'two@gmail.com'), new_user(3, 'one@gmail.com')])
+    with pytest.raises(InputError):
+        backend.add_users([new_user(2, 'two@gmail.com'), new_user(3, 'Two@gmail.com')])
+    assert backend.get_user(2) is None
+    assert backend.get_user_by_email('two@gmail.com') is None
+
+    backend.add_users([new_user(2, 'two@gmail.com'), new_user(3, 'three@gmail.com')])
+    assert backend.get_user_by_email('three@gmail.com')['id'] == 3
+
+def test_storage_is_abstract():
+    with pytest.raises(TypeError):
+        Storage()
+
+    class Partial(Storage):
+        def clear(self):
+            pass
+    with pytest.raises(TypeError):
+        Partial()
+
+def test_storage_channels(backend):
+    usera = auth_register("hello@gmail.com", "veryverysafe", "safety", "first")
+    userb = auth_register("whaa@gmail.com", "nostress", "safety", "second")
+    public_id = channels_create(usera['token'], "public", is_public=True)['channel_id']
+    private_id = channels_create(usera['token'], "private", is_public=False)['channel_id']
+
+    with pytest.raises(AccessError):
+        channel_join(userb['token'], private_id)
+    channel_join(userb['token'], public_id)
+    assert channels_list(userb['token']) == [{'channel_id': public_id, 'name': "public"}]
+    assert [channel['name'] for channel in channels_listall(userb['token'])] == ["public", "private"]
+
+    channel_addowner(usera['token'], public_id, userb['u_id'])
+    user_profile_setname(userb['token'], "changed", "name")
+    details = channel_details(usera['token'], public_id)
+    assert sorted(member['u_id'] for member in details['owner_members']) == [usera['u_id'], userb['u_id']]
+    assert {'u_id': userb['u_id'], 'name_first': "changed", 'name_last': "name"} in details['all_members']
+
+    page = channel_details_paged(usera['token'], public_id, limit=1)
+    assert [member['u_id'] for member in page['members']] == [usera['u_id']]
+    assert channel_details_paged(usera['token'], public_id, page['cursor'])['cursor'] == -1
+
+    channel_removeowner(userb['token'], public_id, usera['u_id'])
+    channel_leave(usera['token'], public_id)
+    with pytest.raises(AccessError):
+        channel_details(usera['token'], public_id)
+    channel_invite(usera['token'], private_id, userb['u_id'])
+    assert [channel['channel_id'] for channel in channels_list(userb['token'])] == [public_id, private_id]
+
+    # removing the only owner of a channel with no one else in it removes it
+    channel_removeowner(usera['token'], private_id, usera['u_id'])
+    channel_leave(userb['token'], private_id)
+    userc = auth_register("third@gmail.com", "nostress", "safety", "third")
+    lonely_id = channels_create(userc['token'], "lonely", is_public=True)['channel_id']
+    channel_removeowner(userc['token'], lonely_id, userc['u_id'])
+    assert get_channel(lonely_id) is None
+
+def test_storage_messages(backend):
+    user = auth_register("hello@gmail.com", "veryverysafe", "safety", "first")
+    channel_id = channels_create(user['token'], "channel", is_public=True)['channel_id']
+    message_ids = [message_send(user['token'], channel_id, f"message {i}")['message_id'] for i in range(120)]
+    message_edit(user['token'], message_ids[-1], "edited")
+    message_remove(user['token'], message_ids[-2])
+
+    page = channel_messages(user['token'], channel_id, 0)
+    assert page['messages'][0]['message'] == "edited"
+    assert page['messages'][1]['message'] == "message 117"
+    assert page['end'] == 50
+    cursor = channel_messages(user['token'], channel_id, 0, message_ids[10])
+    assert [message['message_id'] for message in cursor['messages']] == message_ids[9::-1]
+    assert cursor['end'] == -1
+    with pytest.raises(InputError):
+        channel_messages(user['token'], channel_id, 120)
+
+    assert [message['message'] for message in search(user['token'], "edited")['messages']] == ["edited"]
+    assert len(search(user['token'], "message")['messages']) == 50
+
+def test_storage_messages_pages_with_removals(backend):
+    user = auth_register("hello@gmail.com", "veryverysafe", "safety", "first")
+    channel_id = channels_create(user['token'], "channel", is_public=True)['channel_id']
+    sent = []
+    for i in range(300):
+        sent.append(message_send(user['token'], channel_id, f"message {i}")['message_id'])
+        if i % 3 == 0 or i % 7 == 0:
+            message_remove(user['token'], sent.pop(i * 7919 % len(sent)))
+        if i % 40 == 0:
+            # reading between the removals and the sends
+            channel_messages(user['token'], channel_id, 0)
+
+    newest_first = sent[::-1]
+    for start in range(0, len(sent), 50):
+        page = channel_messages(user['token'], channel_id, start)
+        assert [message['message_id'] for message in page['messages']] == newest_first[start:start + 50]
+    cursor = channel_messages(user['token'], channel_id, 10, sent[100])
+    assert [message['message_id'] for message in cursor['messages']] == sent[89:39:-1]
+
+def test_storage_messages_before_removed_messages(backend):
+    user = auth_register("hello@gmail.com", "veryverysafe", "safety", "first")
+    channel_id = channels_create(user['token'], "channel", is_public=True)['channel_id']
+    sent = [message_send(user['token'], channel_id, f"message {i}")['message_id'] for i in range(5)]
+    # the last two, so a new message could take the place of either
+    message_remove(user['token'], sent[4])
+    message_remove(user['token'], sent[3])
+    newer = message_send(user['token'], channel_id, "newer")['message_id']
+
+    for cursor in sent[3:]:
+        page = channel_messages(user['token'], channel_id, 0, cursor)
+        assert [message['message_id'] for message in page['messages']] == sent[2::-1]
+    assert channel_messages(user['token'], channel_id, 0)['messages'][0]['message_id'] == newer
+
+    other_id = channels_create(user['token'], "other", is_public=True)['channel_id']
+    with pytest.raises(InputError):
+        channel_messages(user['token'], other_id, 0, sent[4])
+
+def test_storage_remove_channel(backend):
+    user = auth_register("hello@gmail.com", "veryverysafe", "safety", "first")
+    removed_id = channels_create(user['token'], "removed", is_public=True)['channel_id']
+    kept_id = channels_create(user['token'], "kept", is_public=True)['channel_id']
+    removed_messages = [message_send(user['token'], removed_id, f"hello {i}")['message_id'] for i in range(5)]
+    message_remove(user['token'], removed_messages[0])
+    kept_message = message_send(user['token'], kept_id, "hello there")['message_id']
+
+    # the last member giving up ownership removes the channel
+    channel_removeowner(user['token'], removed_id, user['u_id'])
+    assert get_channel(removed_id) is None
+    assert channels_list(user['token']) == [{'channel_id': kept_id, 'name': "kept"}]
+    with pytest.raises(InputError):
+        message_edit(user['token'], removed_messages[1], "edited")
+    assert [message['message_id'] for message in search(user['token'], "hello")['messages']] == [kept_message]
+
+    # ids aren't reused
+    new_id = channels_create(user['token'], "new", is_public=True)['channel_id']
+    assert new_id not in (removed_id, kept_id)
+    assert [channel['channel_id'] for channel in channels_listall(user['token'])] == [kept_id, new_id]
+
+    if isinstance(backend, DictStorage):
+        for message_id in removed_messages[2:]:
+            with pytest.raises(InputError):
+                message_remove(user['token'], message_id)
+        # a small channel is tidied up as it is removed
+        assert database['removed_channels'] == {}
+        assert not set(removed_messages) & set(database['messages'])
+        assert database['search_index']['hello'] == {kept_message}
+
+def test_storage_remove_channel_tidies_up_in_batches():
+    clear_database()
+    user = auth_register("hello@gmail.com", "veryverysafe", "safety", "first")
+    removed_id = channels_create(user['token'], "removed", is_public=True)['channel_id']
+    kept_id = channels_create(user['token'], "kept", is_public=True)['channel_id']
+    removed_messages = [message_send(user['token'], removed_id, f"rare{i} hello")['message_id']
+                        for i in range(TIDY_BATCH_SIZE * 3)]
+    channel_removeowner(user['token'], removed_id, user['u_id'])
+    assert search(user['token'], "hello")['messages'] == []
+
+    # every message sent tidies up the next batch
+    message_send(user['token'], kept_id, "hello")
+    assert database['removed_channels']
+    message_send(user['token'], kept_id, "hello")
+    assert database['removed_channels'] == {}
+    assert not set(removed_messages) & set(database['messages'])
+    assert not any(word.startswith('rare') for word in database['search_index'])
+    clear_database()
+
+def test_storage_scheduled_messages(backend):
+    user = auth_register("hello@gmail.com", "veryverysafe", "safety", "first")
+    channel_id = channels_create(user['token'], "channel", is_public=True)['channel_id']
+    later = time.time() + 3600
+    scheduled_id = message_sendlater(user['token'], channel_id, "later", later)['message_id']
+    first_id = message_send(user['token'], channel_id, "first")['message_id']
+    assert get_scheduled_message(scheduled_id)['message'] == "later"
+
+    run_due(later + 1)
+    assert get_scheduled_message(scheduled_id) is None
+    assert not remove_scheduled_message(scheduled_id)
+    # in the order they were sent, not of their ids
+    assert [message['message_id'] for message in channel_messages(user['token'], channel_id, 0)['messages']] == [scheduled_id, first_id]
+    assert [message['message'] for message in channel_messages_after(user['token'], channel_id, first_id)['messages']] == ["later"]
+    assert channel_messages(user['token'], channel_id, 0, scheduled_id)['messages'][0]['message_id'] == first_id
+
+def test_storage_versions(backend):
+    usera = auth_register("hello@gmail.com", "veryverysafe", "safety", "first")
+    userb = auth_register("whaa@gmail.com", "nostress", "safety", "second")
+    channel_id = channels_create(usera['token'], "public", is_public=True)['channel_id']
+    keys = ('epoch', channel_version(channel_id), user_version(userb['u_id']), 'channels')
+
+    before = get_versions(keys)
+    channel_join(userb['token'], channel_id)
+    after_join = get_versions(keys)
+    assert after_join[0] == before[0]
+    assert after_join[1] > before[1] and after_join[2] > before[2] and after_join[3] == before[3]
+
+    # the channel's details show the member's name
+    user_profile_setname(userb['token'], "new", "name")
+    assert get_versions(keys)[1] > after_join[1]
+    channel_addowner(usera['token'], channel_id, userb['u_id'])
+    assert get_versions(keys)[1] > after_join[1] + 1
+
+    clear_database()
+    assert get_versions(keys)[1:] == (0, 0, 0)
+
+def test_storage_versions_from_threads(backend):
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=lambda: [bump_versions(('channels',)) for _ in range(2000)]) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert get_versions(('channels',)) == (8 * 2000,)
+
+def test_storage_sqlite_file_survives_reopening(tmp_path):
+    path = str(tmp_path / 'flockr.db')
+    previous = use_storage(SQLiteStorage(path))
+    clear_database()
+    user = auth_register("hello@gmail.com", "veryverysafe", "safety", "first")
+    channel_id = channels_create(user['token'], "channel", is_public=True)['channel_id']
+    message_send(user['token'], channel_id, "hello world")
+
+    use_storage(SQLiteStorage(path)).close()
+    try:
+        assert channels_list(user['token']) == [{'channel_id': channel_id, 'name': "channel"}]
+        assert [message['message'] for message in search(user['token'], "world")['messages']] == ["hello world"]
+    finally:
+        use_storage(previous).close()
+        clear_database()
+
+def test_storage_sqlite_workers_cant_share_an_email(tmp_path):
+    # what two prefork workers see: each has passed the email check, neither
+    # holds the other's locks
+    path = str(tmp_path / 'flockr.db')
+    first, second = SQLiteStorage(path, shared=True), SQLiteStorage(path, shared=True)
+    try:
+        def user(u_id, email):
+            return {'id': u_id, 'email': email, 'password': 'x', 'first_name': 'First', 'last_name': 'Last'}
+
+        first.add_user(user(1, "hello@gmail.com"))
+        with pytest.raises(InputError):
+            second.add_user(user(2, "Hello@gmail.com"))
+        with pytest.raises(InputError):
+            second.add_users([user(3, "new@gmail.com"), user(4, "hello@gmail.com")])
+        assert second.get_user_by_email("new@gmail.com") is None
+
+        second.add_user(user(5, "other@gmail.com"))
+        with pytest.raises(InputError):
+            first.update_user(1, {'email': "other@gmail.com"})
+        assert first.get_user(1)['email'] == "hello@gmail.com"
+    finally:
+        first.close()
+        second.close()
@@ -0,0 +1,44 @@
+"""
+Tokens are JWTs signed with SECRET. They carry the user id, so any worker
+that knows the secret can tell who a token belongs to without looking it up,
+and the user's token generation when it was made (see session.py).
+
+Checking a signature means decoding base64 and computing an HMAC, which is
+wasted work when the same token comes back request after request, so the
+payloads of tokens that have already been verified are kept in a bounded
+LRU cache.
+
+Set FLOCKR_SECRET to keep tokens valid across restarts. Without it each
+server picks a random secret when it starts (prefork's workers are forked
+after that, so they share it), and tokens from before a restart stop working.
+"""
+import os
+import secrets
+from functools import lru_cache
+import jwt
+from error import AccessError
+
+SECRET = os.environ.get('FLOCKR_SECRET') or secrets.token_hex(32)
+ALGORITHM = 'HS256'
+VERIFIED_TOKENS_CACHE_SIZE = 4096
+
+def token_generate(u_id, generation):
+    return jwt.encode({
+        'u_id': u_id,
+        'generation': generation,
+        # makes every session's token unique, even for the same user
+        'session_id': secrets.token_hex(8),
+    }, SECRET, algorithm=ALGORITHM)
+
+def token_decode(token):
+    """ Returns the token's payload, raises AccessError if it isn't signed by us """
+    try:
+        return _verify(token)
+    except (jwt.InvalidTokenError, TypeError):
+        raise AccessError("token is invalid")
+
+@lru_cache(maxsize=VERIFIED_TOKENS_CACHE_SIZE)
+def _verify(token):
+    # the cache is keyed on the whole token, signature included, so a
+    # tampered token never hits the cache entry of the genuine one
+    return jwt.decode(token, SECRET, algorithms=[ALGORITHM])
@@ -0,0 +1,26 @@
+import pytest
+import jwt
+from tokens import token_generate, token_decode
+from error import AccessError
+
+def test_token_round_trip():
+    token = token_generate(1, 0)
+    assert token_decode(token)['u_id'] == 1
+    # the second decode is served from the cache
+    assert token_decode(token)['u_id'] == 1
+
+def test_token_unique_per_session():
+    assert token_generate(1, 0) != token_generate(1, 0)
+
+def test_token_invalid():
+    with pytest.raises(AccessError):
+        token_decode(-1)
+    with pytest.raises(AccessError):
+        token_decode("non exist")
+    with pytest.raises(AccessError):
+        token_decode(['unhashable'])
+
+def test_token_wrong_signature():
+    forged = jwt.encode({'u_id': 1, 'session_id': 'x'}, 'not the secret, not even close to it', algorithm='HS256')
+    with pytest.raises(AccessError):
+        token_decode(forged)
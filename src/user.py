@@ -1,3 +1,9 @@
+from database import get_user_by_email, update_user, normalise_email
+from auth import auth_get_current_user_id_from_token
+from locks import locked, user_key, email_key
+from validation import validate_name, validate_email
+from error import InputError
+
 def user_profile(token, u_id):
     return {
         'user': {
@@ -10,10 +16,31 @@ def user_profile(token, u_id):
     }
 
 def user_profile_setname(token, name_first, name_last):
+    u_id = auth_get_current_user_id_from_token(token)
+    validate_name(name_first, name_last)
+
+    with locked(user_key(u_id)):
+        update_user(u_id, {
+            'first_name': name_first,
+            'last_name': name_last,
+        })
+
     return {
     }
 
 def user_profile_setemail(token, email):
+    u_id = auth_get_current_user_id_from_token(token)
+    validate_email(email)
+
+    with locked(user_key(u_id), email_key(normalise_email(email))):
+        owner = get_user_by_email(email)
+        if owner is not None and owner['id'] != u_id:
+            raise InputError("Email has been used.")
+
+        update_user(u_id, {
+            'email': email,
+        })
+
     return {
     }
 
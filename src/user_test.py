@@ -0,0 +1,66 @@
+import pytest
+from user import user_profile_setname, user_profile_setemail
+from auth import auth_register, auth_login
+from channel import channel_details
+from channels import channels_create
+from database import clear_database
+from error import InputError, AccessError
+
+def register_a_and_b():
+    """ Registers sample users """
+    paira = auth_register("email@a.com", "averylongpassword", "A", "LastA")
+    pairb = auth_register("email@b.com", "averylongpassword", "B", "LastB")
+    return paira, pairb
+
+# Tests for user_profile_setname
+def test_setname_shows_in_channel_details():
+    clear_database()
+    usera, _ = register_a_and_b()
+    channel_id = channels_create(usera['token'], 'channel', is_public=True)['channel_id']
+    # fills the cached profile
+    channel_details(usera['token'], channel_id)
+
+    user_profile_setname(usera['token'], 'New', 'Name')
+    details = channel_details(usera['token'], channel_id)
+    assert details['owner_members'] == [{'u_id': usera['u_id'], 'name_first': 'New', 'name_last': 'Name'}]
+    assert details['all_members'] == [{'u_id': usera['u_id'], 'name_first': 'New', 'name_last': 'Name'}]
+
+def test_setname_invalid():
+    clear_database()
+    usera, _ = register_a_and_b()
+    with pytest.raises(InputError):
+        user_profile_setname(usera['token'], '', 'Name')
+    with pytest.raises(InputError):
+        user_profile_setname(usera['token'], 'New', 'N' * 51)
+
+def test_setname_invalid_token():
+    clear_database()
+    with pytest.raises(AccessError):
+        user_profile_setname(-1, 'New', 'Name')
+
+# Tests for user_profile_setemail
+def test_setemail_simple():
+    clear_database()
+    usera, _ = register_a_and_b()
+    user_profile_setemail(usera['token'], 'new@a.com')
+    assert auth_login('new@a.com', 'averylongpassword')['u_id'] == usera['u_id']
+    with pytest.raises(InputError):
+        auth_login('email@a.com', 'averylongpassword')
+
+def test_setemail_to_own_email():
+    clear_database()
+    usera, _ = register_a_and_b()
+    user_profile_setemail(usera['token'], 'email@a.com')
+    assert auth_login('email@a.com', 'averylongpassword')['u_id'] == usera['u_id']
+
+def test_setemail_used():
+    clear_database()
+    usera, _ = register_a_and_b()
+    with pytest.raises(InputError):
+        user_profile_setemail(usera['token'], 'email@b.com')
+
+def test_setemail_invalid():
+    clear_database()
+    usera, _ = register_a_and_b()
+    with pytest.raises(InputError):
+        user_profile_setemail(usera['token'], 'invalid.com')
@@ -0,0 +1,63 @@
+"""
+Benchmark: the precompiled, single pass validators in validation.py against
+the helpers auth.py used to have (kept below as the baseline).
+
+    python3 src/validation_bench.py
+"""
+import re
+import timeit
+from error import InputError
+from validation import validate_registration, validate_registrations
+
+REPEAT = 100_000
+
+def legacy_check_email(email):
+    regex = r'^[a-z0-9]+[\._]?[a-z0-9]+[@]\w+[.]\w{2,3}$'
+    if re.search(regex, email):
+        return
+    raise InputError("Email inputted is invalid.")
+
+def legacy_input_error_checking(email, password, name_first, name_last):
+    legacy_check_email(email)
+
+    if len(password) < 6:
+        raise InputError("Password is too short.")
+
+    if len(name_first) > 50 or len(name_first) < 1:
+        raise InputError("First name is invalid.")
+
+    if len(name_last) > 50 or len(name_last) < 1:
+        raise InputError("Last name is invalid.")
+
+def legacy_validate_registrations(registrations):
+    errors = []
+    for row, registration in enumerate(registrations):
+        try:
+            legacy_input_error_checking(
+                registration['email'],
+                registration['password'],
+                registration['name_first'],
+                registration['name_last'],
+            )
+        except InputError as error:
+            errors.append({'row': row, 'message': error.description})
+    return errors
+
+def report(name, legacy, current, number):
+    legacy_time = timeit.timeit(legacy, number=number)
+    current_time = timeit.timeit(current, number=number)
+    print(f"{name:<20} {legacy_time:8.3f}s {current_time:8.3f}s {legacy_time / current_time:6.2f}x")
+
+def main():
+    valid = ('validemail@gmail.com', '123abc!@#', 'Hayden', 'Everest')
+    batch = [
+        {'email': f"student{i}@unsw.edu", 'password': '123abc!@#', 'name_first': 'Student', 'name_last': str(i)}
+        for i in range(1000)
+    ]
+
+    print(f"{'':<20} {'legacy':>9} {'current':>9} {'speedup':>7}")
+    report('one registration', lambda: legacy_input_error_checking(*valid), lambda: validate_registration(*valid), REPEAT)
+    report('batch of 1000', lambda: legacy_validate_registrations(batch), lambda: validate_registrations(batch), REPEAT // 1000)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import pytest
+from validation import validate_email, validate_registration, validate_registrations
+from error import InputError
+
+def test_validate_email():
+    validate_email('validemail@gmail.com')
+    validate_email('valid.email@gmail.com')
+    with pytest.raises(InputError):
+        validate_email('didntusethis@gmail')
+    with pytest.raises(InputError):
+        validate_email('didntusethis.com')
+
+def test_validate_registration():
+    validate_registration('validemail@gmail.com', '123abc', 'H', 'E' * 50)
+    with pytest.raises(InputError):
+        validate_registration('validemail@gmail.com', '12345', 'Hayden', 'Everest')
+    with pytest.raises(InputError):
+        validate_registration('validemail@gmail.com', '123abc', '', 'Everest')
+    with pytest.raises(InputError):
+        validate_registration('validemail@gmail.com', '123abc', 'Hayden', 'E' * 51)
+
+def test_validate_registrations():
+    registrations = [
+        {'email': 'validemail@gmail.com', 'password': '123abc', 'name_first': 'H', 'name_last': 'E'},
+        {'email': 'invalid', 'password': '123abc', 'name_first': 'H', 'name_last': 'E'},
+        {'email': 'validemail@gmail.com', 'password': '123', 'name_first': 'H', 'name_last': 'E'},
+        {'email': 'validemail@gmail.com'},
+    ]
+    errors = validate_registrations(registrations)
+    assert [error['row'] for error in errors] == [1, 2, 3]
+    assert errors[0]['message'] == "Email inputted is invalid."
+    assert errors[1]['message'] == "Password is too short."
+
+def test_validate_registrations_wrong_types():
+    registrations = [
+        1,
+        {'email': 5, 'password': '123abc', 'name_first': 'H', 'name_last': 'E'},
+        {'email': 'validemail@gmail.com', 'password': None, 'name_first': 'H', 'name_last': 'E'},
+        ['validemail@gmail.com', '123abc', 'H', 'E'],
+    ]
+    errors = validate_registrations(registrations)
+    assert [error['row'] for error in errors] == [0, 1, 2, 3]
+    assert errors[1]['message'] == "Field 'email' is not a string."
+    assert errors[3]['message'] == "Row is not an object."
+
+    for registrations in ('users', None, {'email': 'validemail@gmail.com'}):
+        with pytest.raises(InputError):
+            validate_registrations(registrations)
+
+def test_validate_registrations_empty():
+    assert validate_registrations([]) == []